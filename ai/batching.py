@@ -0,0 +1,206 @@
+from collections import deque
+from concurrent.futures import Future
+from threading import Condition, Thread
+import time
+import traceback
+
+import numpy as np
+
+
+"""
+Puts a batching scheduler between the prediction handlers and the
+model. Requests used to call model.predict() on a batch of one from
+up to 500 executor threads at once, so the dataset reviewer, batch
+predictions and the car all fought over the model. Now a single
+thread owns the model. It collects queued images for up to a max
+wait or until a batch is full, runs one vectorized predict() and
+hands each request its own row of the output.
+
+Each request can name the predict() it needs, which is how the
+prediction server swaps models without stopping: requests that
+arrived before a swap still predict with the model they were
+preprocessed for, and never share a batch with requests for the new
+one.
+
+Requests come in two lanes. Driving requests, from the car or from
+the laptop driving it, always go first and are never batched with
+bulk requests, so the most a driving request can wait behind bulk
+scoring is the one bulk batch that is already running.
+max_bulk_batch_size keeps that batch short. Bulk requests, from
+the dataset reviewer and batch predictions, wait for each other to
+fill bigger batches.
+"""
+
+DRIVING_LANE = 'driving'
+BULK_LANE = 'bulk'
+lanes = [DRIVING_LANE, BULK_LANE]
+
+
+class BatchRequest:
+
+    def __init__(self, image, predict):
+        self.image = image
+        self.predict = predict
+        self.future = Future()
+        self.submit_time = time.monotonic()
+
+
+class BatchingPredictor:
+
+    def __init__(self, predict=None, max_batch_size=32, max_bulk_batch_size=8, max_wait_seconds=0.002,
+                 max_driving_wait_seconds=0.0):
+        """
+        Parameters
+        ----------
+        predict : function
+            Takes a batch of preprocessed images as one np.ndarray
+            and returns one row of outputs per image, like a Keras
+            model's predict(). Optional, and only used for requests
+            that don't name their own
+        max_batch_size : int
+            Most images in one driving batch
+        max_bulk_batch_size : int
+            Most images in one bulk batch. A driving request that
+            arrives while a bulk batch runs has to wait for it, so
+            this bounds driving latency under bulk load
+        max_wait_seconds : float
+            How long the oldest bulk request waits for more
+            requests to batch with
+        max_driving_wait_seconds : float
+            The same for driving requests. The default of 0 runs
+            whatever driving requests are queued right away, since
+            there's usually only one car to wait for
+        """
+        self.predict = predict
+        self.max_batch_sizes = {
+            DRIVING_LANE: max_batch_size,
+            BULK_LANE: max_bulk_batch_size
+        }
+        self.max_wait_seconds = {
+            DRIVING_LANE: max_driving_wait_seconds,
+            BULK_LANE: max_wait_seconds
+        }
+        self.queues = {lane: deque() for lane in lanes}
+        self.condition = Condition()
+        self.thread = Thread(target=self.run, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, image, lane=BULK_LANE, predict=None):
+        """
+        Parameters
+        ----------
+        image : np.ndarray
+            One preprocessed image, without the batch dimension
+        lane : string
+            driving or bulk
+        predict : function
+            Optional. The predict() of the model the image was
+            preprocessed for, instead of the default one
+
+        Returns
+        ----------
+        future : concurrent.futures.Future
+            Resolves to (output, batch_size, timings), where output
+            is the image's row of the model's output and timings
+            holds batch_wait_seconds and inference_seconds. Tornado
+            coroutines can yield this directly
+        """
+        if lane not in self.queues:
+            raise ValueError('Unknown lane: {lane}. Choose one of {lanes}'.format(lane=lane, lanes=lanes))
+        request = BatchRequest(image, predict if predict is not None else self.predict)
+        with self.condition:
+            self.queues[lane].append(request)
+            self.condition.notify()
+        return request.future
+
+    def get_batch_sizes(self):
+        """
+        Returns
+        ----------
+        batch_sizes : list<int>
+            Batch sizes worth warming a model up for: one image, and
+            each lane's biggest batch
+        """
+        return [1] + list(self.max_batch_sizes.values())
+
+    def get_queue_lengths(self):
+        with self.condition:
+            return {lane: len(queue) for lane, queue in self.queues.items()}
+
+    def next_lane(self):
+        # The caller must hold self.condition
+        for lane in lanes:
+            if len(self.queues[lane]) > 0:
+                return lane
+        return None
+
+    def take_batch(self):
+        """
+        Blocks until a batch is ready
+
+        Returns
+        ----------
+        lane : string
+            The batch's lane
+        batch : list<BatchRequest>
+            Requests for the same model whose images all have the
+            same shape, oldest first
+        """
+        with self.condition:
+            while True:
+                lane = self.next_lane()
+                if lane is None:
+                    self.condition.wait()
+                    continue
+                queue = self.queues[lane]
+                max_batch_size = self.max_batch_sizes[lane]
+                deadline = queue[0].submit_time + self.max_wait_seconds[lane]
+                remaining_seconds = deadline - time.monotonic()
+                if len(queue) >= max_batch_size or remaining_seconds <= 0:
+                    break
+                """
+                A driving request that arrives while bulk requests
+                are waiting to fill a batch wakes this up, and
+                next_lane() picks it first
+                """
+                self.condition.wait(remaining_seconds)
+            """
+            Images of different shapes can't share a batch, and
+            neither can images for different models. The first
+            happens if two cameras with different resolutions use
+            the same model, the second right after a model swap.
+            Those wait for the next batch
+            """
+            shape = queue[0].image.shape
+            predict = queue[0].predict
+            batch = []
+            skipped = deque()
+            while len(queue) > 0 and len(batch) < max_batch_size:
+                request = queue.popleft()
+                # Bound methods are new objects on every access, so == rather than is
+                if request.image.shape == shape and request.predict == predict:
+                    batch.append(request)
+                else:
+                    skipped.append(request)
+            queue.extendleft(reversed(skipped))
+            return lane, batch
+
+    def run(self):
+        while True:
+            lane, batch = self.take_batch()
+            start_time = time.monotonic()
+            try:
+                outputs = batch[0].predict(np.stack([request.image for request in batch]))
+            except Exception as e:
+                traceback.print_exc()
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            inference_seconds = time.monotonic() - start_time
+            for i, request in enumerate(batch):
+                timings = {
+                    'batch_wait_seconds': start_time - request.submit_time,
+                    'inference_seconds': inference_seconds
+                }
+                request.future.set_result((outputs[i], len(batch), timings))
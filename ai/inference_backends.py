@@ -0,0 +1,304 @@
+import glob
+import os
+import tempfile
+
+import cv2
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+
+from ai.transformations import apply_transformations
+
+
+"""
+Different ways of running the same trained Keras model. Keras'
+model.predict() does a lot of work on every call, such as building
+a data adapter and checking the input, which is a large share of
+the time for the small images and batches the car sends. Every
+backend here is built from the loaded Keras model, so there is
+still only one kind of file to train, store and deploy, and the
+conversion happens when the prediction server starts.
+
+Every backend has the same predict(images) as model.predict():
+a float batch of preprocessed images in, one row of outputs per
+image out. That is all the batcher in ai/batching.py needs, so
+predict.py can swap backends with its --backend flag. None of them
+are thread safe, which is fine because only the batcher's thread
+calls predict().
+
+A conversion can silently change the model's outputs, especially
+int8 quantization, so validate_backend() compares a backend to
+Keras on real images before it's allowed to serve.
+"""
+
+
+class KerasBackend:
+
+    name = 'keras'
+    # Compared to itself
+    tolerance = 0.0
+
+    def __init__(self, model, calibration_images=None):
+        self.model = model
+
+    def predict(self, images):
+        return self.model.predict(images)
+
+
+class ConcreteFunctionBackend:
+    """
+    Traces the model once into a graph with a fixed input signature,
+    which skips model.predict()'s per call Python overhead
+    """
+
+    name = 'concrete-function'
+    tolerance = 1e-5
+
+    def __init__(self, model, calibration_images=None):
+        # The batch dimension stays open so that the batcher can send any batch size
+        input_spec = tf.TensorSpec([None] + list(model.input_shape[1:]), tf.float32)
+        self.function = tf.function(
+            lambda images: model(images, training=False)
+        ).get_concrete_function(input_spec)
+
+    def predict(self, images):
+        return self.function(tf.constant(images, dtype=tf.float32)).numpy()
+
+
+class TFLiteBackend:
+
+    name = 'tflite'
+    tolerance = 1e-4
+
+    def __init__(self, model, calibration_images=None):
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        self.configure(converter, calibration_images)
+        self.model_content = converter.convert()
+        """
+        An interpreter only has tensors for one batch size, and
+        resizing them means allocating them again. The batcher's
+        batch sizes change from one call to the next, so I keep an
+        interpreter for each batch size instead. There are at most
+        as many as the batcher's biggest batch, and they all share
+        the converted model
+        """
+        self.interpreters = {}
+
+    def configure(self, converter, calibration_images):
+        # The float model needs no extra settings
+        pass
+
+    def get_interpreter(self, shape):
+        batch_size = shape[0]
+        if batch_size not in self.interpreters:
+            interpreter = tf.lite.Interpreter(model_content=self.model_content)
+            input_index = interpreter.get_input_details()[0]['index']
+            output_index = interpreter.get_output_details()[0]['index']
+            interpreter.resize_tensor_input(input_index, list(shape))
+            interpreter.allocate_tensors()
+            self.interpreters[batch_size] = (interpreter, input_index, output_index)
+        return self.interpreters[batch_size]
+
+    def predict(self, images):
+        interpreter, input_index, output_index = self.get_interpreter(images.shape)
+        interpreter.set_tensor(input_index, images.astype(np.float32))
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index)
+
+
+class TFLiteInt8Backend(TFLiteBackend):
+    """
+    Stores the weights and computes the activations as 8 bit
+    integers. The input and output are still floats, so the backend
+    is a drop-in replacement, but the outputs drift from the Keras
+    model's, hence the much looser tolerance
+    """
+
+    name = 'tflite-int8'
+    tolerance = 0.05
+
+    def configure(self, converter, calibration_images):
+        if calibration_images is None:
+            raise ValueError('{name} needs calibration images to choose its quantization ranges'.format(
+                name=self.name))
+
+        def representative_dataset():
+            for image in calibration_images:
+                yield [np.expand_dims(image, axis=0).astype(np.float32)]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+
+class OpenCVBackend:
+    """
+    Freezes the model into a TensorFlow graph and runs it with
+    OpenCV's DNN module, which is already in every container that
+    runs the model. OpenCV's importer doesn't support every
+    TensorFlow op, so a model with an unsupported layer fails here,
+    when the server starts, rather than mid-drive
+    """
+
+    name = 'opencv'
+    tolerance = 1e-4
+
+    def __init__(self, model, calibration_images=None):
+        input_spec = tf.TensorSpec([None] + list(model.input_shape[1:]), tf.float32)
+        function = tf.function(
+            lambda images: model(images, training=False)
+        ).get_concrete_function(input_spec)
+        graph_def = convert_variables_to_constants_v2(function).graph.as_graph_def()
+        # readNetFromTensorflow() wants a file
+        with tempfile.TemporaryDirectory() as directory:
+            graph_path = os.path.join(directory, 'model.pb')
+            with open(graph_path, 'wb') as f:
+                f.write(graph_def.SerializeToString())
+            self.net = cv2.dnn.readNetFromTensorflow(graph_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+    def predict(self, images):
+        # blobFromImages() reorders the images from NHWC to the NCHW that OpenCV expects
+        blob = cv2.dnn.blobFromImages(list(images.astype(np.float32)))
+        self.net.setInput(blob)
+        return self.net.forward()
+
+
+backends = {
+    backend.name: backend for backend in [
+        KerasBackend,
+        ConcreteFunctionBackend,
+        TFLiteBackend,
+        TFLiteInt8Backend,
+        OpenCVBackend
+    ]
+}
+
+
+def make_backend(name, model, calibration_images=None):
+    """
+    Parameters
+    ----------
+    name : string
+        One of the keys of backends
+    model : Keras model
+        The loaded model, from load_keras_model()
+    calibration_images : np.ndarray
+        Preprocessed images. Only the int8 backend needs them
+
+    Returns
+    ----------
+    backend : object
+        Has predict(images) like model.predict()
+    """
+    if name not in backends:
+        raise ValueError('Unknown backend: {name}. Choose one of {names}'.format(
+            name=name, names=sorted(backends.keys())))
+    return backends[name](model, calibration_images=calibration_images)
+
+
+def load_sample_images(dataset_path, image_scale, crop_percent, count=64):
+    """
+    Parameters
+    ----------
+    dataset_path : string
+        A folder of PNGs written by the record tracker
+    image_scale : float
+        The model's image_scale
+    crop_percent : float
+        The model's crop_percent
+    count : int
+        Most images to load. They're spread over the whole dataset
+        so that they aren't all from the same stretch of track
+
+    Returns
+    ----------
+    images : np.ndarray
+        Preprocessed images, exactly like the server would pass
+        to the model
+    """
+    image_paths = sorted(glob.glob(os.path.join(dataset_path, '*.png')))
+    if len(image_paths) == 0:
+        raise ValueError('No images found in {dataset_path}'.format(dataset_path=dataset_path))
+    step = max(1, len(image_paths) // count)
+    raw_images = [cv2.imread(image_path) for image_path in image_paths[::step][:count]]
+    images = apply_transformations(
+        images=np.array(raw_images),
+        image_scale=image_scale,
+        crop_percent=crop_percent
+    )
+    return np.array(images, dtype=np.float32)
+
+
+def split_sample_images(images):
+    """
+    Int8 quantization is tuned to its calibration images, so it has
+    to be validated on other images, or a bad quantization can still
+    pass. Alternating the images keeps both halves spread over the
+    whole dataset
+
+    Returns
+    ----------
+    calibration_images : np.ndarray
+        Every other image, starting with the first
+    validation_images : np.ndarray
+        The rest
+    """
+    if len(images) < 2:
+        raise ValueError('Need at least 2 sample images to hold some out for validation, not {count}'.format(
+            count=len(images)
+        ))
+    return images[0::2], images[1::2]
+
+
+def make_random_images(model, count=64, seed=0):
+    """
+    Stand-ins for real images when there is no dataset at hand.
+    They're good enough to catch a broken conversion, but they say
+    nothing about how int8 quantization does on real frames, so that
+    backend refuses to be built from them in the server
+
+    Returns
+    ----------
+    images : np.ndarray
+        Images shaped like the model's input, with pixels between
+        0 and 1 like preprocessed images
+    """
+    random = np.random.RandomState(seed)
+    shape = [count] + list(model.input_shape[1:])
+    return random.uniform(0.0, 1.0, size=shape).astype(np.float32)
+
+
+def validate_backend(backend, reference_backend, images):
+    """
+    Parameters
+    ----------
+    backend : object
+        The backend to check
+    reference_backend : object
+        Usually the KerasBackend of the same model
+    images : np.ndarray
+        Preprocessed images
+
+    Returns
+    ----------
+    max_error : float
+        The largest absolute difference between the two backends'
+        outputs. Raises ValueError if it's above the backend's
+        tolerance
+    """
+    expected = np.asarray(reference_backend.predict(images)).reshape(len(images), -1)
+    actual = np.asarray(backend.predict(images)).reshape(len(images), -1)
+    if actual.shape != expected.shape:
+        raise ValueError('{name} returned outputs shaped {actual} instead of {expected}'.format(
+            name=backend.name, actual=actual.shape, expected=expected.shape))
+    max_error = float(np.max(np.abs(actual - expected)))
+    if max_error > backend.tolerance:
+        raise ValueError('{name} differs from {reference} by up to {error:.6f}, more than {tolerance}'.format(
+            name=backend.name,
+            reference=reference_backend.name,
+            error=max_error,
+            tolerance=backend.tolerance
+        ))
+    return max_error
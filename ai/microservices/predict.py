@@ -1,12 +1,111 @@
+import time
+# Before the other imports, because importing TensorFlow is a big part of startup
+startup_start_time = time.monotonic()
 import argparse
 import cv2
+from datetime import datetime
 import numpy as np
+import traceback
+import tornado.escape
 import tornado.ioloop
 import tornado.web
 from concurrent.futures import ThreadPoolExecutor
 
-from ai.transformations import apply_transformations
-from ai.utilities import load_keras_model
+from ai.batching import BULK_LANE, BatchingPredictor, lanes
+from ai.inference_backends import KerasBackend, backends
+from ai.model_registry import ModelRegistry
+from ai.prediction_cache import HIT, PredictionCache
+from ai.serving import get_model_path, load_served_model, warm_up
+from ai.tensor_payload import decode_tensor_payload
+
+imports_seconds = time.monotonic() - startup_start_time
+# One model load at a time, at startup or from LoadModel. TensorFlow already uses every core while it loads
+model_loader = ThreadPoolExecutor(1)
+
+
+def get_served_model(application):
+    # There's no model until warm_start() has loaded and warmed one up
+    served_model = application.registry.get_default()
+    if served_model is None:
+        raise tornado.web.HTTPError(503, 'The model is still loading. See /ready')
+    return served_model
+
+
+@tornado.gen.coroutine
+def find_served_model(application, model_id=None, epoch_id=None):
+    """
+    Requests can name the model they want with a model_id and an
+    epoch, for example the editor comparing two epochs side by side.
+    Requests that don't name one, like the car's, get the default
+    model
+
+    A named model that isn't loaded gets loaded now, which takes a
+    few seconds, with the default model's image_scale, crop_percent,
+    angle_only and backend. A model that needs different ones should
+    be loaded ahead of time with LoadModel and make_default false.
+    Either way it has to have a snapshot of the named epoch, see
+    get_model_path()
+
+    Returns
+    ----------
+    served_model : ServedModel
+        The model to use for the whole request
+    """
+    default_model = get_served_model(application)
+    if model_id is None and epoch_id is None:
+        return default_model
+    if model_id is None or epoch_id is None:
+        raise tornado.web.HTTPError(400, 'A model is named by both its model_id and its epoch')
+    try:
+        key = application.registry.make_key(model_id, epoch_id)
+    except ValueError:
+        raise tornado.web.HTTPError(400, 'The model_id and epoch must be integers')
+    served_model = application.registry.get(*key)
+    if served_model is not None:
+        return served_model
+    check_epoch_snapshot(application, model_id=key[0], epoch_id=key[1])
+    # Requests that arrive while the model is loading wait for the same load
+    if key not in application.pending_loads:
+        application.pending_loads[key] = load_on_demand(
+            application,
+            model_id=key[0],
+            epoch_id=key[1],
+            image_scale=default_model.image_scale,
+            crop_percent=default_model.crop_percent,
+            angle_only=default_model.angle_only,
+            backend_name=default_model.backend.name
+        )
+    served_model = yield application.pending_loads[key]
+    if served_model is None:
+        raise tornado.web.HTTPError(404, 'Model {model_id} epoch {epoch_id} failed to load'.format(
+            model_id=key[0],
+            epoch_id=key[1]
+        ))
+    return served_model
+
+
+def check_epoch_snapshot(application, model_id, epoch_id):
+    try:
+        get_model_path(application.model_base_directory, model_id, epoch_id, require_epoch_snapshot=True)
+    except FileNotFoundError as e:
+        raise tornado.web.HTTPError(404, str(e))
+
+
+@tornado.gen.coroutine
+def load_on_demand(application, **kwargs):
+    key = application.registry.make_key(kwargs['model_id'], kwargs['epoch_id'])
+    try:
+        # Its status isn't LoadModel's, which reports the most recent deploy
+        served_model = yield load_and_add(
+            application,
+            status={},
+            is_default=False,
+            require_epoch_snapshot=True,
+            **kwargs
+        )
+    finally:
+        del application.pending_loads[key]
+    return served_model
 
 
 class ModelMetadata(tornado.web.RequestHandler):
@@ -14,19 +113,19 @@ class ModelMetadata(tornado.web.RequestHandler):
     executor = ThreadPoolExecutor(5)
 
     @tornado.concurrent.run_on_executor
-    def get_metadata(self):
-        result = {
-            'model_id': self.application.model_id,
-            'epoch_id': self.application.epoch_id,
-            'angle_only': self.application.angle_only,
-            'image_scale': self.application.image_scale,
-            'crop_percent': self.application.crop_percent
-        }
+    def get_metadata(self, served_model):
+        result = served_model.get_metadata()
         return result
 
     @tornado.gen.coroutine
     def post(self):
-        result = yield self.get_metadata()
+        # The default model, which changes when LoadModel deploys a new one, unless the request names another
+        served_model = yield find_served_model(
+            self.application,
+            model_id=self.get_argument('model_id', None),
+            epoch_id=self.get_argument('epoch', None)
+        )
+        result = yield self.get_metadata(served_model)
         self.write(result)
 
 class Health(tornado.web.RequestHandler):
@@ -45,6 +144,24 @@ class Health(tornado.web.RequestHandler):
         result = yield self.is_healthy()
         self.write(result)
 
+class Ready(tornado.web.RequestHandler):
+    '''
+    /health only says the server is up, which it is as soon as it
+    starts. This says the model has also loaded and warmed up, so
+    predictions will be as fast as they're going to get.
+    '''
+
+    def get(self):
+        is_ready = self.application.registry.get_default() is not None
+        if not is_ready:
+            self.set_status(503)
+        self.write({
+            'is_ready': is_ready,
+            'model_load_status': self.application.model_load_status,
+            # Filled in once the server is ready
+            'startup_timings': self.application.startup_timings
+        })
+
 class PredictionHandler(tornado.web.RequestHandler):
 
     # Prevents awful blocking
@@ -52,7 +169,14 @@ class PredictionHandler(tornado.web.RequestHandler):
     executor = ThreadPoolExecutor(500)
 
     @tornado.concurrent.run_on_executor
-    def get_prediction(self, file_body):
+    def preprocess(self, served_model, file_body, received_time, is_model_shaped=False):
+        """
+        Decoding and preprocessing run in parallel on the executor.
+        Only the model itself is shared, behind the batcher
+        """
+
+        # Time spent waiting for one of the executor's threads
+        timings = {'queue_seconds': time.monotonic() - received_time}
 
         """
         Ugly code to convert string to image. Originally got the code from
@@ -60,95 +184,428 @@ class PredictionHandler(tornado.web.RequestHandler):
         but made used frombuffer instead of fromstring because of a deprecation
         warning
         """
+        start_time = time.monotonic()
         nparr = np.frombuffer(file_body, np.uint8)
         img_np = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        timings['decode_seconds'] = time.monotonic() - start_time
 
         # Normalize for contrast and pixel size
-        normalized_images = apply_transformations(
-            images=np.array([img_np]),
-            image_scale=self.image_scale,
-            crop_percent=self.crop_percent
+        start_time = time.monotonic()
+        if is_model_shaped:
+            # The sender already normalized, cropped and resized (see car/parts/video/model_shape.py)
+            image = served_model.preprocessor.normalize(img_np)
+        else:
+            # Matches apply_transformations() exactly, in float32
+            image = served_model.preprocessor(img_np)
+        timings['preprocess_seconds'] = time.monotonic() - start_time
+
+        # The batcher adds the batch dimension back
+        return image, timings
+
+    @tornado.gen.coroutine
+    def get_prediction(self, served_model, file_body, received_time, is_model_shaped=False, lane=BULK_LANE):
+        image, timings = yield self.preprocess(
+            served_model=served_model,
+            file_body=file_body,
+            received_time=received_time,
+            is_model_shaped=is_model_shaped
         )
-        np_normalized_images = np.array(normalized_images)
-        model_ouput = self.model.predict(np_normalized_images)
+        model_output, batch_size, batch_timings = yield self.batcher.submit(
+            image,
+            lane=lane,
+            predict=served_model.predict
+        )
+        timings.update(batch_timings)
 
         """
-        The model_output looks like this: [[0.52258456]], hence
-        the [0][0] to get the prediction. Presumably the output
-        looks this way because the same method could be used to
-        get batch results and also because in some models the
-        result could come from a multi-class model.
+        The model's output for one image looks like this: [0.52258456],
+        hence the [0] to get the prediction. Presumably the output
+        looks this way because in some models the result could come
+        from a multi-class model.
 
         The float() casting fixes the following bug:
         "TypeError: Object of type float32 is not JSON serializable"
         """
-        prediction = float(model_ouput[0][0])
+        prediction = float(model_output[0])
+
+        return prediction, batch_size, timings
 
-        return prediction
+    def initialize(self, batcher, cache):
+        self.batcher = batcher
+        self.cache = cache
 
-    @property
-    def image_scale(self):
-        return self._image_scale
+    @tornado.gen.coroutine
+    def post(self):
+        received_time = time.monotonic()
+
+        # I don't quite understand how this works. "image" is what
+        # I called the key of the dict in the request json but
+        # I think "body" is a built-in Tornado thing in the
+        # tornado.HTTPFile class. Anyways, it works.
+        file_body = self.request.files['image'][0]['body']
 
-    @property
-    def crop_percent(self):
-        return self._crop_percent
+        """
+        LoadModel can swap in a new model at any moment, and the
+        registry can unload one, so I read the model once and use
+        it for the whole request
+        """
+        served_model = yield find_served_model(
+            self.application,
+            model_id=self.get_body_argument('model_id', None),
+            epoch_id=self.get_body_argument('epoch', None)
+        )
 
-    @property
-    def angle_only(self):
-        return self._angle_only
+        """
+        Model-shaped frames are only valid for the image_scale and
+        crop_percent they were shaped for. If those don't match
+        mine, for example because a different model was deployed
+        since the client read /model-metadata, I refuse the frame
+        so the client can read the metadata again
+        """
+        is_model_shaped = self.get_body_argument('is_model_shaped', 'false').lower() == 'true'
+        if is_model_shaped:
+            image_scale = self.get_body_argument('image_scale')
+            crop_percent = self.get_body_argument('crop_percent')
+            if not served_model.is_shaped_for(image_scale, crop_percent):
+                self.set_status(409)
+                self.write({
+                    'error': 'Frame shaped for the wrong model',
+                    'image_scale': served_model.image_scale,
+                    'crop_percent': served_model.crop_percent
+                })
+                return
+
+        # The car and the laptop driving it send driving. Everything else is bulk
+        lane = self.get_body_argument('lane', BULK_LANE)
+        if lane not in lanes:
+            raise tornado.web.HTTPError(400, 'Unknown lane: {lane}'.format(lane=lane))
+
+        key = self.cache.make_key(served_model, file_body, 'model-shaped' if is_model_shaped else 'image')
+        (prediction, batch_size, timings), cache_status = yield self.cache.get(
+            key,
+            lambda: self.get_prediction(
+                served_model=served_model,
+                file_body=file_body,
+                received_time=received_time,
+                is_model_shaped=is_model_shaped,
+                lane=lane
+            )
+        )
+        if cache_status == HIT:
+            # Nothing ran on the server except the lookup
+            batch_size = 0
+            timings = {}
 
-    @image_scale.setter
-    def image_scale(self, image_scale):
-        self._image_scale = image_scale
+        # Result will look something like: '{"prediction": 0.4731147885322571, "batch_size": 1, "cache": "miss", "timings": {...}}'
+        result = {
+            'prediction': prediction,
+            'batch_size': batch_size,
+            'cache': cache_status,
+            'timings': timings
+        }
+        """
+        Clients that trace frames from the camera to the engine send
+        the frame's id and capture time, which I echo back so that
+        the prediction can be matched to its frame
+        """
+        frame_id = self.get_body_argument('frame_id', None)
+        if frame_id is not None:
+            result['frame_id'] = int(frame_id)
+            result['frame_timestamp'] = float(self.get_body_argument('frame_timestamp'))
+        self.write(result)
 
-    @crop_percent.setter
-    def crop_percent(self, crop_percent):
-        self._crop_percent = crop_percent
 
-    @angle_only.setter
-    def angle_only(self, angle_only):
-        self._angle_only = angle_only
+class TensorPredictionHandler(tornado.web.RequestHandler):
+    '''
+    Predicts a whole batch of raw frames or preprocessed images, sent
+    as raw pixels instead of JPEGs. See ai/tensor_payload.py for the
+    body's format.
+    '''
 
-    def initialize(self, model, image_scale, crop_percent, angle_only):
-        self.model = model
-        self.image_scale = image_scale
-        self.crop_percent = crop_percent
-        self.angle_only = angle_only
+    executor = ThreadPoolExecutor(100)
 
-    @property
-    def model(self):
-        return self._model
+    def initialize(self, batcher, cache):
+        self.batcher = batcher
+        self.cache = cache
 
-    @model.setter
-    def model(self, model):
-        self._model = model
+    @tornado.concurrent.run_on_executor
+    def preprocess(self, served_model, frame):
+        return served_model.preprocessor(frame)
 
     @tornado.gen.coroutine
-    def post(self):
+    def predict_image(self, served_model, image, is_preprocessed, lane):
+        if not is_preprocessed:
+            image = yield self.preprocess(served_model, image)
+        model_output, batch_size, _ = yield self.batcher.submit(image, lane=lane, predict=served_model.predict)
+        # float() because float32 isn't JSON serializable, same as in /predict
+        return float(model_output[0]), batch_size
+
+    def get_cached_prediction(self, served_model, image, is_preprocessed, lane):
+        # Equal bytes can be different images at different shapes
+        kind = '{kind}-{shape}'.format(
+            kind='preprocessed' if is_preprocessed else 'frame',
+            shape='x'.join(str(size) for size in image.shape)
+        )
+        key = self.cache.make_key(served_model, image, kind)
+        return self.cache.get(key, lambda: self.predict_image(served_model, image, is_preprocessed, lane))
 
-        # I don't quite understand how this works. "image" is what
-        # I called the key of the dict in the request json but
-        # I think "body" is a built-in Tornado thing in the
-        # tornado.HTTPFile class. Anyways, it works.
-        file_body = self.request.files['image'][0]['body']
+    @tornado.gen.coroutine
+    def post(self):
+        received_time = time.monotonic()
+        try:
+            header, images = decode_tensor_payload(self.request.body)
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, str(e))
+        # Same as /predict, LoadModel could swap models part way through
+        served_model = yield find_served_model(
+            self.application,
+            model_id=header.get('model_id'),
+            epoch_id=header.get('epoch')
+        )
+        lane = header.get('lane', BULK_LANE)
+        if lane not in lanes:
+            raise tornado.web.HTTPError(400, 'Unknown lane: {lane}'.format(lane=lane))
+
+        is_preprocessed = header['preprocessed']
+        if is_preprocessed:
+            if header.get('image_scale') is None or header.get('crop_percent') is None:
+                raise tornado.web.HTTPError(400, 'Preprocessed images need their image_scale and crop_percent')
+            if not served_model.is_shaped_for(header.get('image_scale'), header.get('crop_percent')):
+                self.set_status(409)
+                self.write({
+                    'error': 'Images preprocessed for the wrong model',
+                    'image_scale': served_model.image_scale,
+                    'crop_percent': served_model.crop_percent
+                })
+                return
 
-        prediction = yield self.get_prediction(file_body=file_body)
+        """
+        Each image is looked up in the cache, preprocessed and sent
+        to the batcher separately, and all at once. The frames
+        preprocess in parallel like separate /predict requests
+        would, they still batch together, and a big payload is split
+        into batches of the lane's max size that let driving
+        requests go first between them
+        """
+        results = yield [
+            self.get_cached_prediction(served_model, image, is_preprocessed, lane) for image in images
+        ]
+        self.write({
+            'predictions': [prediction for (prediction, _), _ in results],
+            # 0 for images whose prediction came from the cache
+            'batch_sizes': [batch_size if status != HIT else 0 for (_, batch_size), status in results],
+            'cache': [status for _, status in results],
+            'model_id': served_model.model_id,
+            'epoch_id': served_model.epoch_id,
+            'timings': {
+                'total_seconds': time.monotonic() - received_time
+            }
+        })
+
+
+class Models(tornado.web.RequestHandler):
 
-        # Result will look something like: '{"prediction": 0.4731147885322571}'
-        result = {'prediction': prediction}
+    def get(self):
+        # The loaded models, most recently used first, and how much of the memory budget they use
+        result = self.application.registry.get_stats()
+        result['loading'] = [
+            {'model_id': model_id, 'epoch_id': epoch_id}
+            for model_id, epoch_id in self.application.pending_loads.keys()
+        ]
         self.write(result)
 
 
-def make_app(model, image_scale, crop_percent, angle_only):
-    return tornado.web.Application(
-        [(r"/predict",PredictionHandler,
-          {'model':model,
-           'image_scale':image_scale,
-           'crop_percent':crop_percent,
-           'angle_only':angle_only}),
+class PredictionCacheStats(tornado.web.RequestHandler):
+
+    def initialize(self, cache):
+        self.cache = cache
+
+    def get(self):
+        # Hits, misses, coalesced requests, evictions and the hit rate since the server started
+        self.write(self.cache.get_stats())
+
+
+def load_and_warm_up(application, status, timings, **kwargs):
+    """
+    Runs on model_loader, off to the side, while the current model
+    keeps serving. Warm up predicts with every batch size the batcher
+    can send, so that none of the new model's first real predictions
+    pay for TensorFlow's first call setup
+    """
+    served_model = load_served_model(
+        model_base_directory=application.model_base_directory,
+        validation_dataset_path=application.validation_dataset_path,
+        timings=timings,
+        **kwargs
+    )
+    status['state'] = 'warming'
+    warm_up(served_model, batch_sizes=application.batcher.get_batch_sizes(), timings=timings)
+    return served_model
+
+
+@tornado.gen.coroutine
+def load_and_add(application, status, is_default=True, **kwargs):
+    """
+    Parameters
+    ----------
+    status : dict
+        Gets the load's state, timings and any error
+    is_default : boolean
+        Whether requests that don't name a model should get this
+        one once it's loaded
+
+    Returns
+    ----------
+    served_model : ServedModel
+        None if the model failed to load or warm up, in which case
+        the current default model, if any, keeps serving
+    """
+    timings = {}
+    try:
+        served_model = yield model_loader.submit(load_and_warm_up, application, status, timings, **kwargs)
+    except Exception as e:
+        traceback.print_exc()
+        status['state'] = 'failed'
+        status['error'] = str(e)
+        return None
+    """
+    Adding the model is a single step on the event loop. Requests
+    that already read the old default finish with it, since the
+    batcher never mixes two models in one batch, and every request
+    after this one uses the new default. Clients that send
+    model-shaped frames get a 409 if the new model wants a
+    different shape, and read /model-metadata again
+    """
+    registry = application.registry
+    previous_model = registry.get_default()
+    evicted_models = registry.add(served_model, is_default=is_default)
+    status['state'] = 'ready'
+    status['timings'] = timings
+    status['evicted'] = [evicted_model.get_metadata() for evicted_model in evicted_models]
+    if is_default and previous_model is not None and previous_model is not served_model:
+        status['previous'] = previous_model.get_metadata()
+        print('{timestamp} - Swapped model {previous_id} epoch {previous_epoch} for model {model_id} epoch {epoch_id}'.format(
+            timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"),
+            previous_id=previous_model.model_id,
+            previous_epoch=previous_model.epoch_id,
+            model_id=served_model.model_id,
+            epoch_id=served_model.epoch_id
+        ))
+    return served_model
+
+
+class LoadModel(tornado.web.RequestHandler):
+    '''
+    Deploys a new model without restarting the server. A POST starts
+    loading the model in the background and returns right away, and
+    a GET reports how the most recent load went. With make_default
+    false, the model is only loaded alongside the others, for
+    requests that name it.
+    '''
+
+    @tornado.gen.coroutine
+    def post(self):
+        if self.application.model_load_status['state'] in ['loading', 'warming']:
+            self.set_status(409)
+            self.write(self.application.model_load_status)
+            return
+        json_input = tornado.escape.json_decode(self.request.body)
+        # Anything left out stays the same as the current model's
+        current = get_served_model(self.application)
+        kwargs = {
+            'model_id': int(json_input['model_id']),
+            'epoch_id': int(json_input['epoch']),
+            'image_scale': float(json_input.get('image_scale', current.image_scale)),
+            'crop_percent': float(json_input.get('crop_percent', current.crop_percent)),
+            'angle_only': bool(json_input.get('angle_only', current.angle_only)),
+            'backend_name': json_input.get('backend', current.backend.name)
+        }
+        if kwargs['backend_name'] not in backends:
+            raise tornado.web.HTTPError(400, 'Unknown backend: {backend}'.format(backend=kwargs['backend_name']))
+        is_default = bool(json_input.get('make_default', True))
+        # Only the default can fall back to model.hdf5, since there's nothing for its epoch to be confused with
+        if not is_default:
+            check_epoch_snapshot(self.application, model_id=kwargs['model_id'], epoch_id=kwargs['epoch_id'])
+            kwargs['require_epoch_snapshot'] = True
+        self.application.model_load_status = {
+            'state': 'loading',
+            'model_id': kwargs['model_id'],
+            'epoch_id': kwargs['epoch_id'],
+            'make_default': is_default
+        }
+        tornado.ioloop.IOLoop.current().spawn_callback(
+            load_and_add,
+            self.application,
+            status=self.application.model_load_status,
+            is_default=is_default,
+            **kwargs
+        )
+        self.set_status(202)
+        self.write(self.application.model_load_status)
+
+    def get(self):
+        self.write(self.application.model_load_status)
+
+
+@tornado.gen.coroutine
+def warm_start(application, **kwargs):
+    """
+    Loads and warms up the first model after the server is already
+    listening, so /health answers right away and /ready turns true
+    once predictions will be fast. Before, the first real prediction
+    paid for TensorFlow's graph tracing and memory allocation, and
+    easily missed the car's 1 second timeout
+    """
+    application.model_load_status = {
+        'state': 'loading',
+        'model_id': kwargs['model_id'],
+        'epoch_id': kwargs['epoch_id']
+    }
+    served_model = yield load_and_add(application, status=application.model_load_status, **kwargs)
+    if served_model is None:
+        # Like before /ready existed, a model that can't load stops the server, so its container shows as exited
+        tornado.ioloop.IOLoop.current().stop()
+        return
+    startup_timings = {'imports_seconds': imports_seconds}
+    startup_timings.update(application.model_load_status['timings'])
+    startup_timings['total_seconds'] = time.monotonic() - startup_start_time
+    application.startup_timings = startup_timings
+    print('{timestamp} - Ready in {total:.1f}s: imports {imports:.1f}s, model load {load:.1f}s, backend {backend:.1f}s, first inference {first:.2f}s, warm up {warm_up:.1f}s'.format(
+        timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"),
+        total=startup_timings['total_seconds'],
+        imports=startup_timings['imports_seconds'],
+        load=startup_timings['model_load_seconds'],
+        backend=startup_timings['backend_seconds'],
+        first=startup_timings['first_inference_seconds'],
+        warm_up=startup_timings['warm_up_seconds']
+    ))
+
+
+def make_app(served_model=None, batcher=None, cache=None, registry=None):
+    if batcher is None:
+        batcher = BatchingPredictor()
+    if cache is None:
+        cache = PredictionCache()
+    if registry is None:
+        registry = ModelRegistry(memory_budget_bytes=1000 * 1e6)
+    if served_model is not None:
+        registry.add(served_model, is_default=True)
+    app = tornado.web.Application(
+        [(r"/predict",PredictionHandler, {'batcher':batcher, 'cache':cache}),
+         (r"/predict-tensor", TensorPredictionHandler, {'batcher':batcher, 'cache':cache}),
          (r"/model-metadata", ModelMetadata),
+         (r"/models", Models),
+         (r"/prediction-cache", PredictionCacheStats, {'cache':cache}),
+         (r"/admin/load-model", LoadModel),
+         (r"/ready", Ready),
         (r"/health", Health)])
+    # The default model is added by warm_start() and replaced by LoadModel
+    app.registry = registry
+    app.pending_loads = {}
+    app.batcher = batcher
+    app.model_load_status = {'state': 'idle'}
+    app.startup_timings = None
+    return app
 
 
 if __name__ == "__main__":
@@ -189,27 +646,73 @@ if __name__ == "__main__":
         required=False,
         default=50,
         help="Percent of image top that is cut. Example: 50")
+    ap.add_argument(
+        "--max_batch_size",
+        required=False,
+        default=32,
+        help="Most driving requests to predict in one batch")
+    ap.add_argument(
+        "--max_bulk_batch_size",
+        required=False,
+        default=8,
+        help="Most bulk requests to predict in one batch. Driving requests may wait for one bulk batch")
+    ap.add_argument(
+        "--max_wait_ms",
+        required=False,
+        default=2,
+        help="How long a bulk request waits for others to batch with")
+    ap.add_argument(
+        "--backend",
+        required=False,
+        default=KerasBackend.name,
+        choices=sorted(backends.keys()),
+        help="How to run the model. See ai/inference_backends.py")
+    ap.add_argument(
+        "--validation_dataset_path",
+        required=False,
+        default=None,
+        help="Dataset folder whose images validate the backend against Keras and calibrate int8. Required for tflite-int8")
+    ap.add_argument(
+        "--prediction_cache_size",
+        required=False,
+        default=10000,
+        help="Most recent predictions to remember by image, for repeated dataset reviews. 0 turns it off")
+    ap.add_argument(
+        "--model_memory_budget_mb",
+        required=False,
+        default=1000,
+        help="How much memory the loaded models may use before the least recently used are unloaded. The default model is always kept")
     args = vars(ap.parse_args())
-    path = args['model_base_directory']
     if 'y' in args['angle_only'].lower():
         args['angle_only'] = True
     else:
         args['angle_only'] = False
-    angle_only = args['angle_only']
-    image_scale = float(args['image_scale'])
-    crop_percent = float(args['crop_percent'])
     port=args['port']
-    model_id = args['model_id']
-    epoch_id = args['epoch']
-
-    # Load model just once and store in memory for all future calls
-    model = load_keras_model(path+'/'+str(model_id)+'/model.hdf5')
-
-    app = make_app(model, image_scale, crop_percent, angle_only)
-    app.model_id = int(model_id)
-    app.epoch_id = int(epoch_id)
-    app.angle_only = angle_only
-    app.image_scale = int(image_scale)
-    app.crop_percent = int(crop_percent)
+
+    # Every request names the model it needs, so the batcher has no default
+    batcher = BatchingPredictor(
+        max_batch_size=int(args['max_batch_size']),
+        max_bulk_batch_size=int(args['max_bulk_batch_size']),
+        max_wait_seconds=float(args['max_wait_ms']) / 1000.0
+    )
+    cache = PredictionCache(max_entries=int(args['prediction_cache_size']))
+    registry = ModelRegistry(memory_budget_bytes=float(args['model_memory_budget_mb']) * 1e6)
+    app = make_app(batcher=batcher, cache=cache, registry=registry)
+    app.model_base_directory = args['model_base_directory']
+    app.validation_dataset_path = args['validation_dataset_path']
     app.listen(port)
+
+    # Load model just once and store in memory until LoadModel swaps in another
+    tornado.ioloop.IOLoop.current().spawn_callback(
+        warm_start,
+        app,
+        model_id=int(args['model_id']),
+        epoch_id=int(args['epoch']),
+        image_scale=float(args['image_scale']),
+        crop_percent=float(args['crop_percent']),
+        angle_only=args['angle_only'],
+        backend_name=args['backend']
+    )
     tornado.ioloop.IOLoop.current().start()
+    if app.registry.get_default() is None:
+        raise SystemExit('The model failed to load')
@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from datetime import datetime
+
+
+"""
+Lets one prediction server keep several models loaded at once, so
+that driving and dataset review can share one process and one
+TensorFlow runtime, and the editor can compare epochs side by side.
+Requests name the model they want by model_id and epoch. Requests
+that don't name one get the default model, which is the one the
+server started with or the latest one LoadModel was told to make
+the default.
+
+Models are kept until their estimated memory adds up to more than
+the budget. Then the least recently used ones are unloaded, except
+for the default, which the car may be driving with. A request that
+is already using an unloaded model finishes with it, since it holds
+its own reference.
+
+Everything here runs on the server's event loop, so it needs no
+locks.
+"""
+
+
+class ModelRegistry:
+
+    def __init__(self, memory_budget_bytes):
+        """
+        Parameters
+        ----------
+        memory_budget_bytes : int
+            How much memory the loaded models may use, going by
+            ServedModel.memory_bytes
+        """
+        self.memory_budget_bytes = memory_budget_bytes
+        # Least recently used first
+        self.models = OrderedDict()
+        self.default_key = None
+
+    @staticmethod
+    def make_key(model_id, epoch_id):
+        return int(model_id), int(epoch_id)
+
+    def get_default(self):
+        """
+        Returns
+        ----------
+        served_model : ServedModel
+            The default model, or None until one has loaded
+        """
+        if self.default_key is None:
+            return None
+        return self.get(*self.default_key)
+
+    def get(self, model_id, epoch_id):
+        """
+        Returns
+        ----------
+        served_model : ServedModel
+            The model, or None if it isn't loaded
+        """
+        key = self.make_key(model_id, epoch_id)
+        served_model = self.models.get(key)
+        if served_model is not None:
+            self.models.move_to_end(key)
+        return served_model
+
+    def add(self, served_model, is_default=False):
+        """
+        Parameters
+        ----------
+        served_model : ServedModel
+            A loaded and warmed up model. It replaces any model with
+            the same model_id and epoch
+        is_default : boolean
+            Whether requests that don't name a model should get this
+            one from now on
+
+        Returns
+        ----------
+        evicted_models : list<ServedModel>
+            Models that were unloaded to stay within the budget
+        """
+        key = self.make_key(served_model.model_id, served_model.epoch_id)
+        self.models[key] = served_model
+        self.models.move_to_end(key)
+        if is_default or self.default_key is None:
+            self.default_key = key
+        return self.evict(keep_key=key)
+
+    def evict(self, keep_key):
+        evicted_models = []
+        for key in list(self.models.keys()):
+            if self.get_memory_bytes() <= self.memory_budget_bytes:
+                break
+            # The default could be driving the car, and the newest model was just asked for
+            if key == self.default_key or key == keep_key:
+                continue
+            evicted_models.append(self.models.pop(key))
+        for served_model in evicted_models:
+            print('{timestamp} - Unloaded model {model_id} epoch {epoch_id} to stay within the memory budget'.format(
+                timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"),
+                model_id=served_model.model_id,
+                epoch_id=served_model.epoch_id
+            ))
+        return evicted_models
+
+    def get_memory_bytes(self):
+        return sum(served_model.memory_bytes for served_model in self.models.values())
+
+    def get_stats(self):
+        models = []
+        # Most recently used first
+        for key, served_model in reversed(self.models.items()):
+            metadata = served_model.get_metadata()
+            metadata['is_default'] = key == self.default_key
+            metadata['memory_mb'] = served_model.memory_bytes / 1e6
+            models.append(metadata)
+        return {
+            'models': models,
+            'memory_mb': self.get_memory_bytes() / 1e6,
+            'memory_budget_mb': self.memory_budget_bytes / 1e6
+        }
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+import hashlib
+
+import tornado.concurrent
+import tornado.gen
+
+
+"""
+Remembers the prediction server's recent predictions by the exact
+bytes of the image they were for. Reviewing a dataset in the editor,
+and scoring it again with batch_predict.py, sends the same recorded
+frames over and over, and every repeat used to cost a full
+preprocess and forward pass. Now it costs hashing the image.
+
+The key includes the model's id, epoch, backend, preprocessing and
+load generation, so a swapped-in model never answers with the old
+model's predictions, even when it's a retrained model with the same
+id and epoch, or the same model loaded with a different image_scale
+or crop_percent. Identical
+requests that arrive while the first one is still being predicted
+wait for that one instead of predicting again.
+
+Everything here runs on the server's event loop, so it needs no
+locks.
+"""
+
+HIT = 'hit'
+MISS = 'miss'
+# Waited for an identical request that was already being predicted
+COALESCED = 'coalesced'
+
+
+class PredictionCache:
+
+    def __init__(self, max_entries=10000):
+        """
+        Parameters
+        ----------
+        max_entries : int
+            How many predictions to remember. The least recently
+            used is forgotten first. 0 turns the cache off, though
+            identical concurrent requests are still coalesced
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.counts = {HIT: 0, MISS: 0, COALESCED: 0, 'evictions': 0}
+
+    @staticmethod
+    def make_key(served_model, image_bytes, kind):
+        """
+        Parameters
+        ----------
+        served_model : ServedModel
+            The model that will make the prediction
+        image_bytes : bytes-like
+            The image exactly as it was sent
+        kind : string
+            What the bytes are, for example a JPEG or a raw frame of
+            a given shape, so the same bytes sent two different ways
+            don't collide
+
+        Returns
+        ----------
+        key : tuple
+            The cache key
+        """
+        digest = hashlib.blake2b(image_bytes, digest_size=16).digest()
+        return (
+            served_model.model_id,
+            served_model.epoch_id,
+            served_model.load_generation,
+            served_model.backend.name,
+            float(served_model.image_scale),
+            float(served_model.crop_percent),
+            kind,
+            digest
+        )
+
+    @tornado.gen.coroutine
+    def get(self, key, predict):
+        """
+        Parameters
+        ----------
+        key : tuple
+            From make_key()
+        predict : function
+            Called without arguments on a miss. Returns a future of
+            the value to cache
+
+        Returns
+        ----------
+        value : object
+            The cached or newly predicted value
+        status : string
+            hit, miss or coalesced
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.counts[HIT] += 1
+            return self.entries[key], HIT
+        if key in self.pending:
+            self.counts[COALESCED] += 1
+            value = yield self.pending[key]
+            return value, COALESCED
+        self.counts[MISS] += 1
+        future = tornado.concurrent.Future()
+        self.pending[key] = future
+        try:
+            value = yield predict()
+        except Exception as e:
+            # The waiting requests fail too, but the next identical request tries again
+            future.set_exception(e)
+            # Stops "exception was never retrieved" warnings when nobody was waiting
+            future.exception()
+            raise
+        finally:
+            del self.pending[key]
+        future.set_result(value)
+        self.put(key, value)
+        return value, MISS
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counts['evictions'] += 1
+
+    def get_stats(self):
+        lookups = self.counts[HIT] + self.counts[MISS] + self.counts[COALESCED]
+        stats = dict(self.counts)
+        stats['entries'] = len(self.entries)
+        stats['max_entries'] = self.max_entries
+        # Coalesced requests also skipped a forward pass
+        stats['hit_rate'] = (self.counts[HIT] + self.counts[COALESCED]) / lookups if lookups > 0 else None
+        return stats
@@ -0,0 +1,141 @@
+import argparse
+from datetime import datetime
+import time
+import traceback
+
+import numpy as np
+
+from ai.inference_backends import (
+    KerasBackend, backends, load_sample_images, make_backend, make_random_images, split_sample_images,
+    validate_backend
+)
+from ai.utilities import load_keras_model
+
+
+"""
+Compares the prediction server's backends on one model. For each
+backend it reports how far its outputs are from Keras', how long
+one image takes, which is what the car waits for, and how many
+images per second it gets through in full batches, which is what
+the dataset reviewer and batch predictions care about.
+
+Example:
+    python ai/qa/benchmark_backends.py \
+        --model_path /root/model/1/model.hdf5 \
+        --dataset_path /root/data/dataset_3_18-10-20 \
+        --image_scale 8 \
+        --crop_percent 50
+"""
+
+
+def time_calls(predict, images, iterations):
+    """
+    Returns
+    ----------
+    seconds : np.ndarray
+        How long each of the calls took
+    """
+    seconds = []
+    for _ in range(iterations):
+        start_time = time.perf_counter()
+        predict(images)
+        seconds.append(time.perf_counter() - start_time)
+    return np.array(seconds)
+
+
+def benchmark(backend, images, iterations, batch_size, warmup_iterations=10):
+    single_image = images[:1]
+    batch = images[np.arange(batch_size) % len(images)]
+    # The first calls allocate memory and, for some backends, compile
+    time_calls(backend.predict, single_image, warmup_iterations)
+    time_calls(backend.predict, batch, warmup_iterations)
+    single_seconds = time_calls(backend.predict, single_image, iterations)
+    batch_seconds = time_calls(backend.predict, batch, iterations)
+    return {
+        'p50_ms': np.percentile(single_seconds, 50) * 1000,
+        'p95_ms': np.percentile(single_seconds, 95) * 1000,
+        'single_images_per_second': 1.0 / np.mean(single_seconds),
+        'batch_images_per_second': batch_size / np.mean(batch_seconds)
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "--model_path",
+        required=True,
+        help="Full path to the model's hdf5 file")
+    ap.add_argument(
+        "--dataset_path",
+        required=False,
+        default=None,
+        help="Optional dataset folder. Without it the backends are compared on random images")
+    ap.add_argument(
+        "--image_scale",
+        required=False,
+        default=8,
+        help="The model's image scale")
+    ap.add_argument(
+        "--crop_percent",
+        required=False,
+        default=50,
+        help="The model's crop percent")
+    ap.add_argument(
+        "--backends",
+        required=False,
+        default=','.join(sorted(backends.keys())),
+        help="Comma separated backends to compare")
+    ap.add_argument(
+        "--iterations",
+        required=False,
+        default=200,
+        help="Timed calls per measurement")
+    ap.add_argument(
+        "--batch_size",
+        required=False,
+        default=32,
+        help="Batch size for the throughput measurement. The server's default --max_batch_size is 32")
+    args = vars(ap.parse_args())
+    iterations = int(args['iterations'])
+    batch_size = int(args['batch_size'])
+
+    model = load_keras_model(args['model_path'])
+    if args['dataset_path'] is not None:
+        images = load_sample_images(
+            dataset_path=args['dataset_path'],
+            image_scale=float(args['image_scale']),
+            crop_percent=float(args['crop_percent'])
+        )
+    else:
+        images = make_random_images(model)
+    # Int8 is calibrated on half of the images and validated on the other half, like in the server
+    calibration_images, validation_images = split_sample_images(images)
+    keras_backend = KerasBackend(model)
+
+    results = []
+    for name in args['backends'].split(','):
+        print('{timestamp} - Benchmarking {name}'.format(
+            timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"),
+            name=name
+        ))
+        try:
+            start_time = time.perf_counter()
+            backend = make_backend(name, model, calibration_images=calibration_images)
+            build_seconds = time.perf_counter() - start_time
+            max_error = validate_backend(backend, keras_backend, validation_images)
+        except Exception:
+            # One backend failing to convert shouldn't hide the others' results
+            traceback.print_exc()
+            continue
+        result = benchmark(backend, images, iterations, batch_size)
+        result['name'] = name
+        result['build_seconds'] = build_seconds
+        result['max_error'] = max_error
+        results.append(result)
+
+    print()
+    print('{:<18} {:>9} {:>11} {:>9} {:>9} {:>12} {:>12}'.format(
+        'backend', 'build s', 'max error', 'p50 ms', 'p95 ms', 'single img/s', 'batch img/s'))
+    for result in results:
+        print('{name:<18} {build_seconds:>9.2f} {max_error:>11.6f} {p50_ms:>9.2f} {p95_ms:>9.2f} '
+              '{single_images_per_second:>12.1f} {batch_images_per_second:>12.1f}'.format(**result))
@@ -0,0 +1,130 @@
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+from ai.transformations import Preprocessor, apply_transformations
+
+
+"""
+Checks that the prediction server's Preprocessor gives exactly the
+pixels the model was trained on, and how much faster it is than
+apply_transformations(). A model only ever sees its own
+image_scale and crop_percent, but the check runs several of them
+because the crop and resize rounding depend on both.
+
+Example:
+    python ai/qa/check_preprocessor.py --dataset_path /root/data/dataset_3_18-10-20
+
+Without --dataset_path it checks random 320x240 frames, which are
+harder on the equalization than real ones but less realistic for
+timing.
+"""
+
+# (image_scale, crop_percent) pairs. The first is the car's usual setting
+settings = [(8, 50), (4, 50), (8, 0), (1, 50), (3, 33), (1, 0)]
+
+
+def load_frames(dataset_path, count):
+    image_paths = sorted(glob.glob(os.path.join(dataset_path, '*.png')))[:count]
+    if len(image_paths) == 0:
+        raise ValueError('No images found in {dataset_path}'.format(dataset_path=dataset_path))
+    return [cv2.imread(image_path) for image_path in image_paths]
+
+
+def make_random_frames(count, seed=0):
+    random = np.random.RandomState(seed)
+    frames = []
+    for _ in range(count):
+        # Blurred noise, so neighbouring pixels are related like in a photo
+        noise = random.randint(0, 256, size=(240, 320, 3)).astype(np.uint8)
+        frames.append(cv2.GaussianBlur(noise, (7, 7), 0))
+    return frames
+
+
+def check_parity(frames, image_scale, crop_percent):
+    """
+    Returns
+    ----------
+    mismatch_count : int
+        Frames whose preprocessed pixels differ at all from the
+        float32 cast of apply_transformations()'s
+    """
+    preprocessor = Preprocessor(image_scale=image_scale, crop_percent=crop_percent)
+    mismatch_count = 0
+    for frame in frames:
+        expected = np.float32(apply_transformations(
+            images=np.array([frame]),
+            image_scale=image_scale,
+            crop_percent=crop_percent
+        )[0])
+        actual = preprocessor(frame)
+        if actual.shape != expected.shape or not np.array_equal(actual, expected):
+            mismatch_count += 1
+    return mismatch_count
+
+
+def time_per_frame(function, frames, iterations):
+    # One warm up pass allocates the preprocessor's buffers
+    for frame in frames:
+        function(frame)
+    start_time = time.perf_counter()
+    for i in range(iterations):
+        function(frames[i % len(frames)])
+    return (time.perf_counter() - start_time) / iterations
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "--dataset_path",
+        required=False,
+        default=None,
+        help="Optional dataset folder of PNGs to check on")
+    ap.add_argument(
+        "--frame_count",
+        required=False,
+        default=100,
+        help="Frames to check for each setting")
+    ap.add_argument(
+        "--iterations",
+        required=False,
+        default=2000,
+        help="Frames to time")
+    args = vars(ap.parse_args())
+    frame_count = int(args['frame_count'])
+    iterations = int(args['iterations'])
+    if args['dataset_path'] is not None:
+        frames = load_frames(args['dataset_path'], frame_count)
+    else:
+        frames = make_random_frames(frame_count)
+
+    is_parity = True
+    for image_scale, crop_percent in settings:
+        mismatch_count = check_parity(frames, image_scale, crop_percent)
+        is_parity = is_parity and mismatch_count == 0
+        print('image_scale={image_scale} crop_percent={crop_percent}: {mismatches} of {count} frames differ'.format(
+            image_scale=image_scale,
+            crop_percent=crop_percent,
+            mismatches=mismatch_count,
+            count=len(frames)
+        ))
+
+    image_scale, crop_percent = settings[0]
+    preprocessor = Preprocessor(image_scale=image_scale, crop_percent=crop_percent)
+    old_seconds = time_per_frame(
+        lambda frame: apply_transformations(np.array([frame]), image_scale, crop_percent),
+        frames,
+        iterations
+    )
+    new_seconds = time_per_frame(preprocessor, frames, iterations)
+    print('apply_transformations: {old:.1f} us per frame, Preprocessor: {new:.1f} us per frame, {speedup:.2f}x'.format(
+        old=old_seconds * 1e6,
+        new=new_seconds * 1e6,
+        speedup=old_seconds / new_seconds
+    ))
+    if not is_parity:
+        raise SystemExit('The Preprocessor does not match the training pipeline')
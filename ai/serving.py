@@ -0,0 +1,258 @@
+from datetime import datetime
+import itertools
+import os
+import time
+
+import numpy as np
+
+from ai.inference_backends import (
+    KerasBackend, TFLiteInt8Backend, load_sample_images, make_backend, make_random_images,
+    split_sample_images, validate_backend
+)
+from ai.transformations import Preprocessor
+from ai.utilities import load_keras_model
+
+
+"""
+Everything the prediction server needs to serve one model, bundled
+so that it can be replaced all at once. A request reads the server's
+ServedModel once when it arrives and uses that same object for its
+preprocessing, its prediction and its response. So a model swap in
+the middle of a request can never preprocess a frame for one model
+and predict with another.
+"""
+
+# What the car's camera sends. Warm up uses it to allocate the preprocessor's buffers
+CAMERA_FRAME_SHAPE = (240, 320, 3)
+# Numbers every model load, since a retrained model can come back with the same model_id and epoch
+load_generations = itertools.count(1)
+
+
+class ServedModel:
+
+    def __init__(self, model, backend, model_id, epoch_id, image_scale, crop_percent, angle_only):
+        """
+        Parameters
+        ----------
+        model : Keras model
+            The loaded model
+        backend : object
+            The model converted for serving, see
+            ai/inference_backends.py
+        model_id : int
+            Unique identifier for the model
+        epoch_id : int
+            The model's epoch, which versions the model
+        image_scale : float
+            How much the model's images shrink
+        crop_percent : float
+            Percent of each image's rows, counted from the bottom,
+            that the model uses
+        angle_only : boolean
+            Whether the model only predicts the angle
+        """
+        self.model = model
+        self.backend = backend
+        self.model_id = model_id
+        self.epoch_id = epoch_id
+        self.image_scale = image_scale
+        self.crop_percent = crop_percent
+        self.angle_only = angle_only
+        self.preprocessor = Preprocessor(image_scale=image_scale, crop_percent=crop_percent)
+        self.memory_bytes = estimate_memory_bytes(model, backend)
+        self.load_generation = next(load_generations)
+
+    @property
+    def predict(self):
+        return self.backend.predict
+
+    def is_shaped_for(self, image_scale, crop_percent):
+        """
+        Returns
+        ----------
+        is_shaped_for : boolean
+            Whether images preprocessed for this image_scale and
+            crop_percent fit this model
+        """
+        return float(image_scale) == float(self.image_scale) and float(crop_percent) == float(self.crop_percent)
+
+    def get_metadata(self):
+        return {
+            'model_id': self.model_id,
+            'epoch_id': self.epoch_id,
+            'angle_only': self.angle_only,
+            # Clients have always gotten these as integers
+            'image_scale': int(self.image_scale),
+            'crop_percent': int(self.crop_percent),
+            'backend': self.backend.name
+        }
+
+
+def estimate_memory_bytes(model, backend):
+    """
+    A rough estimate of how much memory a loaded model takes, for
+    the model registry's budget. It's the size of the weights, once
+    for the Keras model and once more for a converted backend's
+    copy. TensorFlow's own overhead is shared by all of the models,
+    so it doesn't count
+
+    Returns
+    ----------
+    memory_bytes : int
+        Estimated bytes
+    """
+    weight_bytes = sum(weight.nbytes for weight in model.get_weights())
+    if backend.name == KerasBackend.name:
+        return weight_bytes
+    return 2 * weight_bytes
+
+
+def get_model_path(model_base_directory, model_id, epoch_id, require_epoch_snapshot=False):
+    """
+    The trainer keeps one model.hdf5 per model, from its best epoch.
+    A snapshot of a specific epoch, saved next to it as
+    model-<epoch>.hdf5, is used instead if there is one, which is how
+    two epochs of the same model can be compared side by side
+
+    Parameters
+    ----------
+    require_epoch_snapshot : boolean
+        Raise FileNotFoundError instead of falling back to
+        model.hdf5, whose epoch is unknown. Models loaded alongside
+        the default need this, or they could be the same weights
+        under another epoch's name
+
+    Returns
+    ----------
+    model_path : string
+        Full path to the hdf5 file
+    """
+    model_directory = os.path.join(model_base_directory, str(model_id))
+    epoch_path = os.path.join(model_directory, 'model-{epoch_id}.hdf5'.format(epoch_id=epoch_id))
+    if os.path.exists(epoch_path):
+        return epoch_path
+    if require_epoch_snapshot:
+        raise FileNotFoundError('Model {model_id} has no snapshot of epoch {epoch_id}, expected {path}'.format(
+            model_id=model_id,
+            epoch_id=epoch_id,
+            path=epoch_path
+        ))
+    return os.path.join(model_directory, 'model.hdf5')
+
+
+def load_served_model(model_base_directory, model_id, epoch_id, image_scale, crop_percent, angle_only,
+                      backend_name=KerasBackend.name, validation_dataset_path=None, timings=None,
+                      require_epoch_snapshot=False):
+    """
+    Loads a model and converts it to a backend. Every backend other
+    than Keras has to match Keras' outputs on sample images, so a
+    bad conversion raises here instead of steering the car wrong
+
+    Parameters
+    ----------
+    model_base_directory : string
+        The folder with one subfolder per model_id
+    backend_name : string
+        One of ai.inference_backends.backends
+    validation_dataset_path : string
+        Optional dataset folder whose images validate the backend
+        and calibrate int8. Int8 is validated on images held out
+        from its calibration. Other backends are validated on random
+        images without one, but int8 raises ValueError, since
+        random images can't show whether its quantization works on
+        real frames
+    timings : dict
+        Optional. Gets model_load_seconds and backend_seconds, for
+        the startup breakdown
+    require_epoch_snapshot : boolean
+        Only load the epoch's own snapshot, see get_model_path()
+
+    Returns
+    ----------
+    served_model : ServedModel
+        The model, ready to warm up and serve
+    """
+    if timings is None:
+        timings = {}
+    # Before the slow model load
+    if backend_name == TFLiteInt8Backend.name and validation_dataset_path is None:
+        raise ValueError('The {backend} backend needs a validation dataset to calibrate and validate on real frames'.format(
+            backend=backend_name
+        ))
+    start_time = time.monotonic()
+    model = load_keras_model(get_model_path(
+        model_base_directory,
+        model_id,
+        epoch_id,
+        require_epoch_snapshot=require_epoch_snapshot
+    ))
+    timings['model_load_seconds'] = time.monotonic() - start_time
+    start_time = time.monotonic()
+    if validation_dataset_path is not None:
+        calibration_images, validation_images = split_sample_images(load_sample_images(
+            dataset_path=validation_dataset_path,
+            image_scale=image_scale,
+            crop_percent=crop_percent
+        ))
+    else:
+        calibration_images = validation_images = make_random_images(model)
+    backend = make_backend(backend_name, model, calibration_images=calibration_images)
+    if backend.name != KerasBackend.name:
+        max_error = validate_backend(backend, KerasBackend(model), validation_images)
+        print('{timestamp} - The {backend} backend is within {error:.6f} of Keras on {count} images'.format(
+            timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"),
+            backend=backend.name,
+            error=max_error,
+            count=len(validation_images)
+        ))
+    timings['backend_seconds'] = time.monotonic() - start_time
+    return ServedModel(
+        model=model,
+        backend=backend,
+        model_id=model_id,
+        epoch_id=epoch_id,
+        image_scale=image_scale,
+        crop_percent=crop_percent,
+        angle_only=angle_only
+    )
+
+
+def warm_up(served_model, batch_sizes, iterations=3, timings=None):
+    """
+    The first few predictions of a freshly loaded model are much
+    slower than the rest, because TensorFlow builds its graph and
+    allocates memory for each new batch size. This makes those
+    predictions on blank frames, before the model serves any
+    real ones
+
+    Parameters
+    ----------
+    served_model : ServedModel
+        The model to warm up
+    batch_sizes : list<int>
+        The batch sizes the batcher will send
+    iterations : int
+        Predictions per batch size
+    timings : dict
+        Optional. Gets first_inference_seconds, which is what the
+        first real request would have waited without warming up,
+        and warm_up_seconds
+
+    Returns
+    ----------
+    seconds : float
+        How long warming up took
+    """
+    if timings is None:
+        timings = {}
+    start_time = time.monotonic()
+    # Frames arrive at the camera's shape, so this is also the model's input shape
+    image = served_model.preprocessor(np.zeros(CAMERA_FRAME_SHAPE, dtype=np.uint8))
+    for batch_size in sorted(set(batch_sizes)):
+        images = np.repeat(image[np.newaxis], batch_size, axis=0)
+        for _ in range(iterations):
+            served_model.predict(images)
+            if 'first_inference_seconds' not in timings:
+                timings['first_inference_seconds'] = time.monotonic() - start_time
+    timings['warm_up_seconds'] = time.monotonic() - start_time
+    return timings['warm_up_seconds']
@@ -0,0 +1,124 @@
+import json
+import struct
+
+import numpy as np
+
+
+"""
+The body of the prediction server's /predict-tensor endpoint: a
+batch of images as raw pixels instead of one JPEG in a multipart
+form. Callers that already hold decoded frames, like the dataset
+reviewer, skip the JPEG encode, the server skips the decode, and
+the model sees exactly the pixels the caller had instead of
+whatever survived JPEG compression.
+
+The body is
+    4 bytes: the header's length, as a big endian unsigned int
+    header:  JSON, for example
+             {"shape": [16, 240, 320, 3], "dtype": "uint8", "preprocessed": false}
+    tensor:  the images' bytes in C order
+
+Raw frames are uint8 BGR, like cv2.imread() returns, and the server
+preprocesses them. Preprocessed images are float32 and go straight
+to the model, so their header also has the image_scale and
+crop_percent they were preprocessed for. The server refuses them
+with a 409 if those aren't its model's, the same as model-shaped
+frames on /predict.
+
+This file only needs numpy, so that any client can import it.
+"""
+
+CONTENT_TYPE = 'application/octet-stream'
+HEADER_LENGTH_FORMAT = '>I'
+HEADER_LENGTH_SIZE = struct.calcsize(HEADER_LENGTH_FORMAT)
+# Raw frames must be uint8 and preprocessed images float32
+dtypes = {
+    False: 'uint8',
+    True: 'float32'
+}
+
+
+def encode_tensor_payload(images, preprocessed=False, **fields):
+    """
+    Parameters
+    ----------
+    images : np.ndarray
+        A batch of images, or a single image without the batch
+        dimension
+    preprocessed : boolean
+        Whether the images have already been through
+        apply_transformations()
+    fields : dict
+        Any other header fields, like image_scale, crop_percent and
+        lane
+
+    Returns
+    ----------
+    body : bytes
+        The request body for /predict-tensor
+    """
+    images = np.asarray(images)
+    # Casting float pixels to uint8 or uint8 pixels to float would silently give the model the wrong images
+    if preprocessed and not np.issubdtype(images.dtype, np.floating):
+        raise ValueError('Preprocessed images must be floats, not {dtype}'.format(dtype=images.dtype))
+    if not preprocessed and images.dtype != np.uint8:
+        raise ValueError('Raw frames must be uint8, not {dtype}'.format(dtype=images.dtype))
+    images = np.ascontiguousarray(images, dtype=dtypes[preprocessed])
+    if images.ndim == 3:
+        images = images[np.newaxis]
+    header = dict(fields)
+    header['shape'] = list(images.shape)
+    header['dtype'] = dtypes[preprocessed]
+    header['preprocessed'] = preprocessed
+    header_bytes = json.dumps(header).encode()
+    return struct.pack(HEADER_LENGTH_FORMAT, len(header_bytes)) + header_bytes + images.tobytes()
+
+
+def decode_tensor_payload(body):
+    """
+    Parameters
+    ----------
+    body : bytes
+        The request body
+
+    Returns
+    ----------
+    header : dict
+        The decoded header
+    images : np.ndarray
+        A read-only view of the body's images with shape
+        [count, height, width, channels], without a copy. Raises
+        ValueError if the body doesn't match its header
+    """
+    if len(body) < HEADER_LENGTH_SIZE:
+        raise ValueError('The body is too short to have a header')
+    header_length = struct.unpack_from(HEADER_LENGTH_FORMAT, body)[0]
+    tensor_offset = HEADER_LENGTH_SIZE + header_length
+    if len(body) < tensor_offset:
+        raise ValueError('The body is shorter than its header length of {length}'.format(length=header_length))
+    try:
+        header = json.loads(bytes(body[HEADER_LENGTH_SIZE:tensor_offset]).decode())
+        shape = [int(size) for size in header['shape']]
+        preprocessed = bool(header.get('preprocessed', False))
+        dtype = header['dtype']
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError('Invalid header: {error}'.format(error=e))
+    if dtype != dtypes[preprocessed]:
+        raise ValueError('{kind} images must be {expected}, not {dtype}'.format(
+            kind='Preprocessed' if preprocessed else 'Raw',
+            expected=dtypes[preprocessed],
+            dtype=dtype
+        ))
+    if len(shape) != 4 or min(shape) < 1:
+        raise ValueError('The shape must be [count, height, width, channels], not {shape}'.format(shape=shape))
+    if not preprocessed and shape[3] != 3:
+        raise ValueError('Raw frames must be BGR, with 3 channels, not {channels}'.format(channels=shape[3]))
+    expected_length = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    if len(body) - tensor_offset != expected_length:
+        raise ValueError('The tensor is {actual} bytes but its shape and dtype need {expected}'.format(
+            actual=len(body) - tensor_offset,
+            expected=expected_length
+        ))
+    images = np.frombuffer(body, dtype=dtype, offset=tensor_offset).reshape(shape)
+    header['preprocessed'] = preprocessed
+    return header, images
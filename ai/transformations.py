@@ -1,5 +1,6 @@
 import numpy as np
 import cv2
+import threading
 
 
 def flip(images,labels,original_command,debug=False):
@@ -195,6 +196,135 @@ def apply_transformations(images, image_scale, crop_percent):
         )
     return images
 
+class Preprocessor:
+    """
+    apply_transformations() for one frame at a time, for serving.
+    It gives exactly the same pixels, cast to float32, which is what
+    the model computes in anyway, but wastes far less work.
+    apply_transformations() converts the whole frame to YUV and
+    back, divides the whole frame into a new float64 array and only
+    then throws away the rows the model doesn't use. Here the only
+    whole-frame steps are the ones the result depends on: the
+    conversion to YUV and the Y histogram, which has to be of the
+    whole frame for the equalization to match training. Everything
+    after that only touches the cropped rows.
+
+    Every step writes into buffers that are allocated once and
+    reused. The prediction server preprocesses on many threads at
+    once, so I keep a pool of buffer sets and a frame borrows one
+    for as long as it takes to preprocess. The pool only grows to
+    the number of frames that were ever preprocessed at the same
+    time, not to the number of threads, which the server has 500 of.
+    """
+
+    def __init__(self, image_scale, crop_percent):
+        """
+        Parameters
+        ----------
+        image_scale : float
+            The model's image_scale
+        crop_percent : float
+            The model's crop_percent
+        """
+        self.image_scale = image_scale
+        self.crop_percent = crop_percent
+        self.lock = threading.Lock()
+        self.pool = []
+        # Each uint8 value divided by 255 exactly like images / 255. Looking them up is faster than dividing
+        self.division_table = (np.arange(256) / 255).reshape(1, 256)
+        self.float32_division_table = np.float32(self.division_table)
+
+    def normalize(self, image):
+        """
+        Only the division by 255, for frames that the sender already
+        equalized, cropped and resized (see
+        car/parts/video/model_shape.py)
+
+        Returns
+        ----------
+        image : np.ndarray
+            float32, like everything else the batcher gets
+        """
+        return cv2.LUT(image, self.float32_division_table)
+
+    def borrow_buffers(self, shape):
+        with self.lock:
+            # The most recently returned set is the likeliest to still be in the CPU's cache
+            buffers = self.pool.pop() if len(self.pool) > 0 else None
+        # Frames from one camera all have the same shape, so this almost never allocates
+        if buffers is not None and buffers['shape'] == shape:
+            return buffers
+        height = int(shape[0])
+        # Same rows as crop_images()
+        top = height - int(height * (self.crop_percent / 100.0)) if self.crop_percent > 0 else 0
+        cropped_shape = (height - top,) + tuple(shape[1:])
+        buffers = {
+            'shape': shape,
+            'top': top,
+            'yuv': np.empty(shape, dtype=np.uint8),
+            'y': np.empty(shape[:2], dtype=np.uint8),
+            'bgr': np.empty(cropped_shape, dtype=np.uint8),
+            'normalized': np.empty(cropped_shape, dtype=np.float64),
+            'resized': None
+        }
+        return buffers
+
+    def return_buffers(self, buffers):
+        with self.lock:
+            self.pool.append(buffers)
+
+    def __call__(self, image, out=None):
+        """
+        Parameters
+        ----------
+        image : np.ndarray
+            One decoded BGR uint8 frame
+        out : np.ndarray
+            Optional float32 array to write the result to, for
+            example a row of a batch. Without one I return a new
+            array, since the caller usually holds on to the result
+            after this thread moves on to the next frame
+
+        Returns
+        ----------
+        preprocessed_image : np.ndarray
+            Equal to np.float32(apply_transformations([image], ...)[0])
+        """
+        buffers = self.borrow_buffers(image.shape)
+        try:
+            return self.preprocess(image, buffers, out)
+        finally:
+            self.return_buffers(buffers)
+
+    def preprocess(self, image, buffers, out):
+        top = buffers['top']
+        # Same as normalize_contrast(), except only the cropped rows are converted back to BGR
+        yuv = cv2.cvtColor(image, cv2.COLOR_BGR2YUV, dst=buffers['yuv'])
+        y = cv2.extractChannel(yuv, 0, dst=buffers['y'])
+        cv2.equalizeHist(y, dst=y)
+        cropped_yuv = yuv[top:]
+        cropped_yuv[:, :, 0] = y[top:]
+        bgr = cv2.cvtColor(cropped_yuv, cv2.COLOR_YUV2BGR, dst=buffers['bgr'])
+        # Same as images / 255
+        normalized = cv2.LUT(bgr, self.division_table, dst=buffers['normalized'])
+        # Same as resize_images(). It resizes float64, like training, because resizing float32 rounds differently
+        if self.image_scale != 1:
+            inverted_decimal_scale = 1 / self.image_scale
+            normalized = cv2.resize(
+                normalized,
+                None,
+                dst=buffers['resized'],
+                fx=inverted_decimal_scale,
+                fy=inverted_decimal_scale,
+                interpolation=cv2.INTER_CUBIC
+            )
+            buffers['resized'] = normalized
+        if out is None:
+            return normalized.astype(np.float32)
+        np.copyto(out, normalized)
+        return out
+
+
 def show_resize_effect(original_image, scale):
     smaller_scale = 1/scale
     shrunken_image = cv2.resize(original_image, None, fx=smaller_scale, fy=smaller_scale, interpolation=cv2.INTER_CUBIC)
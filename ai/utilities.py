@@ -190,42 +190,17 @@ def get_sql_rows(host, sql, postgres_pool=None):
         return rows
 
 # This is used to stream video live for the self-driving sessions
-# The syntax is super ugly and I don't understand how it works
-# This is where I got this code from here, which comes with an explanation:
-# https://stackoverflow.com/questions/21702477/how-to-parse-mjpeg-http-stream-from-ip-camera
-def live_video_stream(ip, port, no_change_count_threshold=50):
-    stream = urllib.request.urlopen('http://{ip}:{port}/video'.format(ip=ip, port=port))
-    opencv_bytes = bytes()
+def live_video_stream(ip, port):
     """
-    When the video is streaming well, about 1 of every 15
-    iterations of this loop produces an image. When the
-    video is killed and there is nothing to show, the else
-    part of the loop gets called consecutively indefinitely.
-    I can avoid the zombie threads that take over my entire
-    Tornado server (99% of CPU) if I check a consecutive
-    failure count exceeding some arbitrarily high threshold
+    The demuxer lives with the car's video part, so this only
+    works when the whole repo is on the PYTHONPATH, like in
+    car/parts/video/tests/stream_mjpeg_video.py
     """
-    consecutive_no_image_count = 0
-    was_available = False
-    while True:
-        opencv_bytes += stream.read(1024)
-        jpeg_frame_start_marker = opencv_bytes.find(b'\xff\xd8')
-        jpeg_frame_end_market = opencv_bytes.find(b'\xff\xd9')
-        if jpeg_frame_start_marker != -1 and jpeg_frame_end_market != -1:
-            jpg = opencv_bytes[jpeg_frame_start_marker:jpeg_frame_end_market + 2]
-            opencv_bytes = opencv_bytes[jpeg_frame_end_market + 2:]
-            frame = cv2.imdecode(np.fromstring(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
-            if cv2.waitKey(1) == 27:
-                exit(0)
-            consecutive_no_image_count = 0
-            was_available = True
-            yield frame
-        else:
-            if was_available:
-                consecutive_no_image_count = 1
-            else:
-                consecutive_no_image_count += 1
-            if consecutive_no_image_count > no_change_count_threshold:
-                print('Consecutive no-image count threshold exceeded')
-                break
-            was_available = False
+    from car.parts.video.mjpeg import MjpegDemuxer
+    stream = urllib.request.urlopen('http://{ip}:{port}/video'.format(ip=ip, port=port))
+    # The loop ends when the server closes the stream
+    for jpg in MjpegDemuxer(stream):
+        frame = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if cv2.waitKey(1) == 27:
+            exit(0)
+        yield frame
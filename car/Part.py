@@ -1,16 +1,20 @@
 import abc
+import asyncio
 from datetime import datetime
 import json
-import requests
-from requests.adapters import HTTPAdapter
-from threading import Thread
+from threading import Event, Lock, Thread
+import time
 import traceback
+from car.metrics import Metrics
+from car.transports import HttpTransport
 
 
 class Part:
 
     def __init__(self, name, port, url, host=None, input_names=None, output_names=None,
-            latency_threshold_seconds=0.5, is_loopable=True, is_localhost=True, is_verbose=False):
+            latency_threshold_seconds=0.5, is_loopable=True, is_localhost=True, is_verbose=False,
+            rate_hz=None, is_call_driven=False, retry_seconds=0.1, is_critical=True, heartbeat_seconds=None,
+            transport=None):
 
         """
         This function creates a new part. This is used as a
@@ -80,9 +84,82 @@ class Part:
             Indicates whether to print the stack trace of the part.
             This can be really noisy when the model services aren't
             on, but can be helpful for other services
+        rate_hz: float
+            The max frequency at which the part's thread calls
+            request(). None means as fast as the server responds,
+            which is what the camera wants because its request()
+            already blocks until the next bytes of the stream
+            arrive
+        is_call_driven: boolean
+            Indicates that request() should only run after the
+            drive loop has handed the part fresh inputs through
+            call(). The engine doesn't need to post the same
+            command more than once per drive loop tick, so its
+            thread sleeps on an event between ticks instead of
+            spinning
+        retry_seconds: float
+            How long to wait before calling request() again after
+            it raises an exception. Without a pause a dead server
+            turns the part's thread into a busy loop
+        is_critical: boolean
+            Indicates whether the drive loop must call the part
+            every tick. When the loop falls behind schedule under
+            the degrade overrun policy, Vehicle.py skips parts
+            that aren't critical, like memory publishing, until
+            the loop is back on time
+        heartbeat_seconds: float
+            Used by parts that publish their inputs, like the
+            engine and memory clients. They only send inputs that
+            have changed since their last successful send, but
+            resend everything at least this often so that a
+            restarted server recovers its state. It must stay
+            below latency_threshold_seconds, because a skipped
+            send still counts as an update
+        transport: HttpTransport, UnixSocketTransport or InProcessTransport
+            How the client reaches its server (see transports.py).
+            Defaults to HTTP over TCP. The transport only changes
+            what self.session is connected to, so request() is the
+            same regardless of the transport
         """
 
         self.last_update_time = None
+        """
+        The part's thread blocks on this event whenever it has
+        nothing to do: when an intermittent part like the record
+        tracker hasn't been asked to run, or when a call-driven
+        part like the engine is waiting for the next drive loop
+        tick. Idle threads therefore cost almost no CPU
+        """
+        self.wake_event = Event()
+        """
+        The asyncio runtime (see runtime.py) sets these when it
+        takes over the part, so that wake() can also reach a
+        coroutine waiting on the runtime's event loop
+        """
+        self.event_loop = None
+        self.async_wake_event = None
+        self.rate_hz = rate_hz
+        self.is_call_driven = is_call_driven
+        # Lets call-driven parts reach their server once during the
+        # vehicle's warm up, before the drive loop starts calling
+        self.has_new_inputs = True
+        self.retry_seconds = retry_seconds
+        self.is_critical = is_critical
+        self.heartbeat_seconds = heartbeat_seconds
+        self.last_sent_inputs = None
+        self.last_sent_time = None
+        """
+        brake() resets the sent inputs from the drive loop's thread
+        while a send may be in flight on the part's thread. Every
+        reset bumps the generation, and a send that started before
+        the reset doesn't get to mark its inputs as sent
+        """
+        self.sent_inputs_lock = Lock()
+        self.sent_inputs_generation = 0
+        self.input_delta_generation = 0
+
+        # Latency histograms that Vehicle.py serves on /metrics
+        self.metrics = Metrics()
         self.thread = Thread(target=self.infinite_loop, args=())
         self.thread.daemon = True
         self.name = name
@@ -138,15 +215,84 @@ class Part:
         self.latency_threshold_seconds = latency_threshold_seconds
         self.is_verbose = is_verbose
 
+        if transport is None:
+            transport = HttpTransport()
+        self.transport = transport
+        self.session = self.transport.make_session(self)
+
+    def get_in_process_handlers(self):
         """
-        Use a session to keep open a long-lived connection.
-        In my experience this significantly reduces latency
-        and CPU usage. You can see details about HTTPAdapeters
-        in the link below
-        https://laike9m.com/blog/requests-secret-pool_connections-and-pool_maxsize,89/
+        A placeholder function that parts override if their server
+        code can be imported into the control loop and called
+        directly by the in_process transport
+
+        Returns
+        ----------
+        handlers : dict
+            Maps a url path, like /command, to a function that
+            takes the request body and returns a dictionary
+        """
+        raise NotImplementedError(
+            '{part} does not support the in_process transport'.format(part=self.name)
+        )
+
+    def get_input_delta(self):
         """
-        self.session = requests.Session()
-        self.session.mount('http://', HTTPAdapter(pool_connections=1))
+        Works out what a publishing part needs to send to its
+        server on this iteration
+
+        Returns
+        ----------
+        inputs : dict
+            A copy of all of the current inputs. Pass it to
+            mark_inputs_sent() once the server has accepted the
+            payload
+        payload : dict
+            The inputs that changed since the last successful send,
+            all of the inputs if nothing has been sent yet or the
+            heartbeat is due, or None if there is nothing to send
+        """
+        with self.sent_inputs_lock:
+            self.input_delta_generation = self.sent_inputs_generation
+            last_sent_inputs = self.last_sent_inputs
+        inputs = dict(self.inputs)
+        now = time.monotonic()
+        if last_sent_inputs is None:
+            return inputs, inputs
+        if self.heartbeat_seconds is None or now - self.last_sent_time >= self.heartbeat_seconds:
+            return inputs, inputs
+        payload = {}
+        for key, value in inputs.items():
+            if key not in last_sent_inputs or last_sent_inputs[key] != value:
+                payload[key] = value
+        if len(payload) == 0:
+            return inputs, None
+        return inputs, payload
+
+    def mark_inputs_sent(self, inputs):
+        """
+        Parameters
+        ----------
+        inputs : dict
+            The inputs returned by get_input_delta(), which the
+            server now has, unless reset_inputs_sent() was called
+            since, in which case the next send is still complete
+        """
+        with self.sent_inputs_lock:
+            if self.input_delta_generation != self.sent_inputs_generation:
+                return
+            self.last_sent_inputs = inputs
+            self.last_sent_time = time.monotonic()
+
+    def reset_inputs_sent(self):
+        """
+        Forces the next send to include every input. Used after
+        a failed send or after anything else has changed the
+        server's state behind the part's back
+        """
+        with self.sent_inputs_lock:
+            self.sent_inputs_generation += 1
+            self.last_sent_inputs = None
 
     def initialize_inputs(self):
         """
@@ -210,6 +356,9 @@ class Part:
         """
         try:
             output = self._call(*args)
+            if self.is_call_driven:
+                self.has_new_inputs = True
+                self.wake()
             """
             It's not possible to return self.output because not all
             parts have an output, and trying to retrieve that field
@@ -245,12 +394,98 @@ class Part:
         response : requests.response
             The result of the client's call to the server
         """
-        data = json.loads(response.text)
+        self.parse_outputs(response.text)
+
+    def parse_outputs(self, text):
+        """
+        The part of update_outputs() that doesn't depend on the
+        HTTP library, so that aiohttp responses can reuse it
+
+        Parameters
+        ----------
+        text : string
+            The JSON body of the server's response
+        """
+        data = json.loads(text)
         new_outputs = []
         for output_name in self.output_names:
             new_outputs.append(data[output_name])
         self.outputs = tuple(new_outputs)
 
+    @property
+    def is_requestable(self):
+        return self._is_requestable
+
+    @is_requestable.setter
+    def is_requestable(self, is_requestable):
+        """
+        Parts toggle this flag directly, like the record tracker
+        does when a recording is requested, so the setter is
+        where I wake up the part's thread
+        """
+        self._is_requestable = is_requestable
+        if is_requestable:
+            self.wake()
+
+    def wake(self):
+        """
+        Tells the part's thread to re-check whether it has work
+        """
+        self.wake_event.set()
+        if self.event_loop is not None:
+            self.event_loop.call_soon_threadsafe(self.async_wake_event.set)
+
+    def is_ready(self):
+        """
+        Returns
+        ----------
+        is_ready : boolean
+            Boolean indicating if the part's thread should call
+            request() now rather than wait to be woken up
+        """
+        if not self.is_requestable:
+            return False
+        if self.is_call_driven and not self.has_new_inputs:
+            return False
+        return True
+
+    def wait_until_ready(self):
+        """
+        Blocks the part's thread until it has work. The event is
+        cleared after waking up rather than before waiting so that
+        a wake() that arrives between the is_ready() check and the
+        wait() is never lost
+        """
+        while not self.is_ready():
+            self.wake_event.wait()
+            self.wake_event.clear()
+
+    async def wait_until_ready_async(self):
+        """
+        The asyncio runtime's equivalent of wait_until_ready()
+        """
+        while not self.is_ready():
+            await self.async_wake_event.wait()
+            self.async_wake_event.clear()
+
+    def get_sleep_seconds(self, start_time):
+        """
+        Parameters
+        ----------
+        start_time : float
+            The time.monotonic() value when the iteration started
+
+        Returns
+        ----------
+        sleep_seconds : float
+            How long to wait so that request() runs no more often
+            than rate_hz, or 0 if the part has no rate limit
+        """
+        if self.rate_hz is None:
+            return 0.0
+        elapsed_seconds = time.monotonic() - start_time
+        return max(0.0, 1.0 / self.rate_hz - elapsed_seconds)
+
     def infinite_loop(self):
         """
         This constantly communicates with the part's server. It's
@@ -263,13 +498,98 @@ class Part:
         critical part has become unresponsive
         """
         while True:
-            if self.is_requestable:
-                try:
+            self.wait_until_ready()
+            start_time = time.monotonic()
+            self.has_new_inputs = False
+            try:
+                self.request()
+                self.last_update_time = datetime.now()
+            except:
+                self.metrics.increment('request_errors')
+                if self.is_verbose:
+                    traceback.print_exc()
+                time.sleep(self.retry_seconds)
+                continue
+            request_seconds = time.monotonic() - start_time
+            self.metrics.record('request_seconds', request_seconds)
+            sleep_seconds = self.get_sleep_seconds(start_time)
+            if sleep_seconds > 0.0:
+                self.metrics.record('sleep_slack_seconds', sleep_seconds)
+                time.sleep(sleep_seconds)
+            elif self.rate_hz is not None:
+                # request() alone took longer than the part's budget
+                self.metrics.increment('overruns')
+            self.metrics.record('loop_seconds', time.monotonic() - start_time)
+
+    async def request_async(self, session):
+        """
+        The coroutine version of request() used by the asyncio
+        runtime. Parts that only make plain HTTP calls override
+        this with a native aiohttp implementation. Everything else
+        falls back to running the blocking request() on the event
+        loop's default executor, so every part works under either
+        runtime
+
+        Overrides import aiohttp inside the method, like
+        car/runtime.py does, never at the top of their file.
+        start.py imports every part's client, so the threaded
+        runtime keeps working on images without aiohttp
+
+        Parameters
+        ----------
+        session : aiohttp.ClientSession
+            The runtime's shared session, which pools connections
+            across all of the parts
+        """
+        event_loop = asyncio.get_event_loop()
+        await event_loop.run_in_executor(None, self.request)
+
+    async def infinite_loop_async(self, session):
+        """
+        The coroutine version of infinite_loop(). All parts run
+        this on the same event loop when the vehicle uses the
+        asyncio runtime
+
+        Parameters
+        ----------
+        session : aiohttp.ClientSession
+            The runtime's shared session
+        """
+        while True:
+            await self.wait_until_ready_async()
+            start_time = time.monotonic()
+            self.has_new_inputs = False
+            try:
+                if self.transport.is_in_process:
+                    # There is no I/O to wait on, only a function call
                     self.request()
-                    self.last_update_time = datetime.now()
-                except:
-                    if self.is_verbose:
-                        traceback.print_exc()
+                else:
+                    await self.request_async(session)
+                self.last_update_time = datetime.now()
+            except asyncio.CancelledError:
+                raise
+            except:
+                self.metrics.increment('request_errors')
+                if self.is_verbose:
+                    traceback.print_exc()
+                await asyncio.sleep(self.retry_seconds)
+                continue
+            request_seconds = time.monotonic() - start_time
+            self.metrics.record('request_seconds', request_seconds)
+            sleep_seconds = self.get_sleep_seconds(start_time)
+            if sleep_seconds > 0.0:
+                self.metrics.record('sleep_slack_seconds', sleep_seconds)
+                await asyncio.sleep(sleep_seconds)
+            elif self.rate_hz is not None:
+                self.metrics.increment('overruns')
+            else:
+                """
+                A native coroutine that never awaits anything slow
+                would otherwise starve the other parts, so always
+                give the event loop a chance to switch
+                """
+                await asyncio.sleep(0)
+            self.metrics.record('loop_seconds', time.monotonic() - start_time)
 
     def get_last_update_time(self):
         """
@@ -0,0 +1,230 @@
+import cv2
+import multiprocessing
+import numpy as np
+from threading import Lock
+import time
+try:
+    # Python 3.8+. The Pi's Python 3.5 image falls back to RawArray
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+class Frame:
+    """
+    A single camera frame as it moves through Memory. The camera
+    delivers JPEG, the model and record tracker servers want JPEG,
+    and only a few consumers need pixels, so a frame keeps the
+    original compressed bytes next to the decoded image. Whichever
+    form is missing is produced at most once, the first time
+    somebody asks for it, and then shared by every consumer
+    """
+
+    def __init__(self, frame_id, jpeg=None, image=None, timestamp=None):
+        """
+        Parameters
+        ----------
+        frame_id : int
+            Increases by one with every frame the camera delivers
+        jpeg : bytes
+            The compressed frame, if available
+        image : np.ndarray
+            The decoded BGR frame, if available
+        timestamp : float
+            The time.time() when the frame was captured. Defaults
+            to now
+        """
+        if jpeg is None and image is None:
+            raise ValueError('A frame needs either JPEG bytes or an image')
+        self.frame_id = frame_id
+        if timestamp is None:
+            timestamp = time.time()
+        self.timestamp = timestamp
+        self._jpeg = jpeg
+        self._image = image
+        self.lock = Lock()
+
+    @property
+    def jpeg(self):
+        """
+        Returns
+        ----------
+        jpeg : bytes
+            The compressed frame. Only encodes if the frame was
+            created from pixels alone
+        """
+        if self._jpeg is None:
+            with self.lock:
+                if self._jpeg is None:
+                    self._jpeg = cv2.imencode('.jpg', self._image)[1].tobytes()
+        return self._jpeg
+
+    @property
+    def image(self):
+        """
+        Returns
+        ----------
+        image : np.ndarray
+            The decoded BGR frame. Decodes at most once per frame
+        """
+        if self._image is None:
+            with self.lock:
+                if self._image is None:
+                    self._image = cv2.imdecode(np.frombuffer(self._jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return self._image
+
+    def __deepcopy__(self, memo):
+        # Frames are never modified after creation, so sharing is safe
+        return self
+
+    def __getstate__(self):
+        """
+        Frames are pickled when they're sent to a part running in
+        a worker process (see worker.py). Locks can't be pickled,
+        and the JPEG is a fraction of the size of the pixels, so
+        only the JPEG is sent if there is one
+        """
+        state = dict(self.__dict__)
+        del state['lock']
+        if state['_jpeg'] is not None:
+            state['_image'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+
+class SharedFrameRing:
+    """
+    A ring buffer of frames in shared memory, written by a part
+    running in a worker process and read by the drive loop. Each
+    slot holds a frame's JPEG bytes, its decoded pixels and a
+    header with the frame id, sizes and timestamp. Frame n goes
+    into slot n % slot_count, so the writer is normally filling a
+    different slot than the one being read, and each slot's lock
+    is only held for the length of a memory copy. The drive loop
+    therefore never waits on a JPEG decode, which happens in the
+    worker, outside of the control loop's GIL
+    """
+
+    header_fields = ['frame_id', 'jpeg_bytes', 'height', 'width', 'channels']
+
+    def __init__(self, max_image_bytes, max_jpeg_bytes, slot_count=4, context=None):
+        """
+        Parameters
+        ----------
+        max_image_bytes : int
+            The largest decoded frame a slot can hold, for example
+            640 * 480 * 3 for VGA
+        max_jpeg_bytes : int
+            The largest JPEG a slot can hold
+        slot_count : int
+            Number of slots in the ring
+        context : multiprocessing.context.BaseContext
+            The multiprocessing context whose locks guard the
+            slots. Must match the one that starts the worker
+        """
+        if context is None:
+            context = multiprocessing.get_context()
+        self.max_image_bytes = max_image_bytes
+        self.max_jpeg_bytes = max_jpeg_bytes
+        self.slot_count = slot_count
+        slot_bytes = max_jpeg_bytes + max_image_bytes
+        header_bytes = slot_count * len(self.header_fields) * 8
+        timestamp_bytes = slot_count * 8
+        latest_bytes = 8
+        size = header_bytes + timestamp_bytes + latest_bytes + slot_count * slot_bytes
+        if shared_memory is not None:
+            self.shared_memory = shared_memory.SharedMemory(create=True, size=size)
+            buffer = self.shared_memory.buf
+        else:
+            self.shared_memory = None
+            buffer = context.RawArray('B', size)
+        offset = 0
+        self.headers = np.ndarray((slot_count, len(self.header_fields)), dtype=np.int64, buffer=buffer, offset=offset)
+        offset += header_bytes
+        self.timestamps = np.ndarray((slot_count,), dtype=np.float64, buffer=buffer, offset=offset)
+        offset += timestamp_bytes
+        self.latest = np.ndarray((1,), dtype=np.int64, buffer=buffer, offset=offset)
+        offset += latest_bytes
+        self.data = np.ndarray((slot_count, slot_bytes), dtype=np.uint8, buffer=buffer, offset=offset)
+        self.latest[0] = -1
+        self.locks = [context.Lock() for _ in range(slot_count)]
+
+    def write(self, frame):
+        """
+        Parameters
+        ----------
+        frame : Frame
+            The frame to publish. Decodes it if it hasn't been
+            decoded yet
+        """
+        image = frame.image
+        jpeg = frame.jpeg
+        if image.nbytes > self.max_image_bytes or len(jpeg) > self.max_jpeg_bytes:
+            raise ValueError('Frame {frame_id} does not fit in a ring slot: {image_bytes} image bytes, {jpeg_bytes} JPEG bytes'.format(
+                frame_id=frame.frame_id,
+                image_bytes=image.nbytes,
+                jpeg_bytes=len(jpeg)
+            ))
+        height, width = image.shape[:2]
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        slot = frame.frame_id % self.slot_count
+        with self.locks[slot]:
+            self.data[slot, :len(jpeg)] = np.frombuffer(jpeg, dtype=np.uint8)
+            self.data[slot, self.max_jpeg_bytes:self.max_jpeg_bytes + image.nbytes] = image.reshape(-1)
+            self.headers[slot] = (frame.frame_id, len(jpeg), height, width, channels)
+            self.timestamps[slot] = frame.timestamp
+        self.latest[0] = frame.frame_id
+
+    def get_latest_frame_id(self):
+        """
+        Returns
+        ----------
+        frame_id : int
+            The id of the newest frame, or None if nothing has been
+            written yet
+        """
+        frame_id = int(self.latest[0])
+        if frame_id < 0:
+            return None
+        return frame_id
+
+    def read_latest(self):
+        """
+        Returns
+        ----------
+        frame : Frame
+            A private copy of the newest frame, or None if nothing
+            has been written yet. If the writer has lapped the ring
+            since the newest id was read, the slot's even newer
+            frame is returned instead
+        """
+        frame_id = self.get_latest_frame_id()
+        if frame_id is None:
+            return None
+        slot = frame_id % self.slot_count
+        with self.locks[slot]:
+            frame_id, jpeg_bytes, height, width, channels = [int(value) for value in self.headers[slot]]
+            timestamp = float(self.timestamps[slot])
+            jpeg = self.data[slot, :jpeg_bytes].tobytes()
+            image_bytes = height * width * channels
+            image = self.data[slot, self.max_jpeg_bytes:self.max_jpeg_bytes + image_bytes].copy()
+        if channels == 1:
+            image = image.reshape((height, width))
+        else:
+            image = image.reshape((height, width, channels))
+        return Frame(frame_id=frame_id, jpeg=jpeg, image=image, timestamp=timestamp)
+
+    def close(self):
+        """
+        Frees the shared memory. Only the process that created the
+        ring should call this
+        """
+        if self.shared_memory is None:
+            return
+        # The shared memory can't be closed while views still use it
+        self.headers = self.timestamps = self.latest = self.data = None
+        self.shared_memory.close()
+        self.shared_memory.unlink()
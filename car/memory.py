@@ -1,13 +1,55 @@
 import copy
+from threading import Lock
+import time
 
 
 class Memory:
     """
     A convenience class to save key/value pairs.
+
+    Every key also carries the version at which its value last
+    changed and the time of that write. Versions come from a single
+    counter that increases with every change to any key, so a
+    consumer can remember the version it last read and cheaply ask
+    which keys have changed since then. Rewriting a key with the
+    same value doesn't count as a change, which is what lets the
+    drive loop notice a camera frame that hasn't been replaced
     """
 
     def __init__(self, *args, **kw):
         self.d = {}
+        self.versions = {}
+        self.timestamps = {}
+        self.version = 0
+        """
+        Writes and snapshot reads of several keys must not
+        interleave if memory is ever used from more than one thread
+        """
+        self.lock = Lock()
+
+    def is_unchanged(self, old_value, new_value):
+        """
+        Parts return the same object until they have something new,
+        like the camera's latest frame, so identity catches most
+        repeats. Simple values that come out of JSON are new
+        objects every time, so those are compared by value. I
+        deliberately don't compare numpy arrays by value because
+        that would mean scanning every pixel
+        """
+        if old_value is new_value:
+            return True
+        if type(old_value) is type(new_value) and type(new_value) in (bool, int, float, str):
+            return old_value == new_value
+        return False
+
+    def write(self, key, value):
+        # The caller must hold self.lock
+        if key in self.d and self.is_unchanged(self.d[key], value):
+            return
+        self.version += 1
+        self.d[key] = value
+        self.versions[key] = self.version
+        self.timestamps[key] = time.time()
 
     def __setitem__(self, key, value):
         if type(key) is not tuple:
@@ -15,14 +57,18 @@ class Memory:
             key = (key,)
             value = (value,)
 
-        for i, k in enumerate(key):
-            self.d[k] = value[i]
+        with self.lock:
+            for i, k in enumerate(key):
+                self.write(k, value[i])
 
     def print(self):
         simple_contents = copy.deepcopy(self.d)
         if 'camera/image_array' in simple_contents:
             image_sum = simple_contents['camera/image_array'].sum()
             simple_contents['camera/image_array'] = 'image.sum(): '+str(image_sum)
+        if simple_contents.get('camera/frame') is not None:
+            frame_id = simple_contents['camera/frame'].frame_id
+            simple_contents['camera/frame'] = 'frame_id: '+str(frame_id)
         print(simple_contents)
 
     def __getitem__(self, key):
@@ -32,27 +78,96 @@ class Memory:
             return self.d[key]
 
     def update(self, new_d):
-        self.d.update(new_d)
+        with self.lock:
+            for key, value in new_d.items():
+                self.write(key, value)
 
     def put(self, keys, inputs):
-        if len(keys) > 1:
-            for i, key in enumerate(keys):
-                try:
-                    self.d[key] = inputs[i]
-                except IndexError as e:
-                    error = str(e) + ' issue with keys: ' + str(key)
-                    raise IndexError(error)
+        with self.lock:
+            if len(keys) > 1:
+                for i, key in enumerate(keys):
+                    try:
+                        self.write(key, inputs[i])
+                    except IndexError as e:
+                        error = str(e) + ' issue with keys: ' + str(key)
+                        raise IndexError(error)
 
-        else:
-            # For some baffling reason using inputs[0] for
-            # consistency will break the image shown in
-            # tornado
-            self.d[keys[0]] = inputs
+            else:
+                # For some baffling reason using inputs[0] for
+                # consistency will break the image shown in
+                # tornado
+                self.write(keys[0], inputs)
 
     def get(self, keys):
         result = [self.d.get(k) for k in keys]
         return result
 
+    def snapshot(self, keys):
+        """
+        Reads several keys at once without any write landing in
+        between, so all of the values belong to the same version
+
+        Parameters
+        ----------
+        keys : list<string>
+            The keys to read
+
+        Returns
+        ----------
+        version : int
+            The memory's version at the time of the read. Pass it
+            to changed_since() later to find out what has changed
+        values : list
+            The values of the keys, in the same order as the keys
+        """
+        with self.lock:
+            values = [self.d.get(k) for k in keys]
+            return self.version, values
+
+    def changed_since(self, keys, version):
+        """
+        Parameters
+        ----------
+        keys : list<string>
+            The keys to check
+        version : int
+            A version previously returned by snapshot() or
+            get_version()
+
+        Returns
+        ----------
+        changed_keys : list<string>
+            The keys whose values have changed after the version
+        """
+        with self.lock:
+            return [k for k in keys if self.versions.get(k, 0) > version]
+
+    def get_version(self, key=None):
+        """
+        Returns
+        ----------
+        version : int
+            The version at which the key last changed, 0 if the key
+            has never been written, or the memory's current version
+            if no key is given
+        """
+        if key is None:
+            return self.version
+        return self.versions.get(key, 0)
+
+    def get_age_seconds(self, key):
+        """
+        Returns
+        ----------
+        age_seconds : float
+            Seconds since the key's value last changed, or None if
+            the key has never been written
+        """
+        timestamp = self.timestamps.get(key)
+        if timestamp is None:
+            return None
+        return time.time() - timestamp
+
     def keys(self):
         return self.d.keys()
 
@@ -60,4 +175,4 @@ class Memory:
         return self.d.values()
 
     def iteritems(self):
-        return self.d.iteritems()
\ No newline at end of file
+        return self.d.iteritems()
@@ -0,0 +1,171 @@
+from threading import Lock
+
+
+class Histogram:
+    """
+    A fixed-size latency histogram in the spirit of HdrHistogram.
+    Values are bucketed on a log-linear scale: each power of two
+    is split into the same number of linear sub-buckets, so the
+    relative error of a percentile is bounded no matter how big
+    the value is. The memory footprint never grows, which matters
+    because parts record into these from their threads for as
+    long as the car is on
+    """
+
+    def __init__(self, lowest_seconds=0.00001, highest_seconds=60.0, sub_bucket_bits=6):
+        """
+        Parameters
+        ----------
+        lowest_seconds : float
+            The smallest distinguishable value. Everything below
+            is counted in the first bucket. The default is 10
+            microseconds
+        highest_seconds : float
+            The largest trackable value. Anything bigger is clamped
+            to this value so that one huge stall can't break the
+            histogram
+        sub_bucket_bits : int
+            Each power of two is split into 2^sub_bucket_bits
+            linear sub-buckets. 6 bits bounds the relative error
+            of any percentile to about 3%
+        """
+        self.lowest_seconds = lowest_seconds
+        self.highest_units = int(highest_seconds / lowest_seconds)
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        magnitude_count = max(1, self.highest_units.bit_length() - sub_bucket_bits + 1)
+        self.counts = [0] * (magnitude_count * self.sub_bucket_count)
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            for i in range(len(self.counts)):
+                self.counts[i] = 0
+            self.count = 0
+            self.total_seconds = 0.0
+            self.min_seconds = None
+            self.max_seconds = None
+
+    def get_index(self, units):
+        magnitude = max(0, units.bit_length() - self.sub_bucket_bits)
+        sub_bucket = units >> magnitude
+        return magnitude * self.sub_bucket_count + sub_bucket
+
+    def get_bucket_midpoint_seconds(self, index):
+        magnitude = index // self.sub_bucket_count
+        sub_bucket = index % self.sub_bucket_count
+        lower_units = sub_bucket << magnitude
+        upper_units = (sub_bucket + 1) << magnitude
+        return (lower_units + upper_units) / 2.0 * self.lowest_seconds
+
+    def record(self, seconds):
+        """
+        Parameters
+        ----------
+        seconds : float
+            The value to record, typically a duration in seconds
+        """
+        if seconds < 0:
+            seconds = 0.0
+        units = min(int(seconds / self.lowest_seconds), self.highest_units)
+        index = self.get_index(units)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total_seconds += seconds
+            if self.min_seconds is None or seconds < self.min_seconds:
+                self.min_seconds = seconds
+            if self.max_seconds is None or seconds > self.max_seconds:
+                self.max_seconds = seconds
+
+    def get_percentile(self, percentile):
+        """
+        Parameters
+        ----------
+        percentile : float
+            A value between 0 and 100
+
+        Returns
+        ----------
+        seconds : float
+            The value at the percentile, or None if nothing has
+            been recorded yet
+        """
+        with self.lock:
+            if self.count == 0:
+                return None
+            target_count = max(1, int(round(self.count * percentile / 100.0)))
+            running_count = 0
+            for index, bucket_count in enumerate(self.counts):
+                running_count += bucket_count
+                if running_count >= target_count:
+                    midpoint = self.get_bucket_midpoint_seconds(index)
+                    # The midpoint can't be more extreme than what was recorded
+                    return min(max(midpoint, self.min_seconds), self.max_seconds)
+            return self.max_seconds
+
+    def summarize(self):
+        """
+        Returns
+        ----------
+        summary : dict
+            Count plus mean, min, max, p50, p95 and p99 in
+            milliseconds, which is easier to compare against the
+            drive loop's budget than seconds
+        """
+        def to_milliseconds(seconds):
+            if seconds is None:
+                return None
+            return seconds * 1000.0
+
+        summary = {
+            'count': self.count,
+            'mean_ms': to_milliseconds(self.total_seconds / self.count) if self.count > 0 else None,
+            'min_ms': to_milliseconds(self.min_seconds),
+            'max_ms': to_milliseconds(self.max_seconds)
+        }
+        for percentile in [50, 95, 99]:
+            key = 'p{percentile}_ms'.format(percentile=percentile)
+            summary[key] = to_milliseconds(self.get_percentile(percentile))
+        return summary
+
+
+class Metrics:
+    """
+    A named collection of histograms and counters. Every part
+    owns one and so does the vehicle, and the vehicle serves all
+    of them from its /metrics endpoint
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = Lock()
+
+    def get_histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    histogram = Histogram()
+                    self.histograms[name] = histogram
+        return histogram
+
+    def record(self, name, seconds):
+        self.get_histogram(name).record(seconds)
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summarize(self):
+        with self.lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+        result = {
+            'histograms': {name: histogram.summarize() for name, histogram in histograms.items()},
+            'counters': counters
+        }
+        return result
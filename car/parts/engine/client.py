@@ -1,26 +1,68 @@
 import json
-import requests
 from car.Part import Part
 
 
 class Client(Part):
 
-    def __init__(self, name, input_names, is_localhost, port=8092, url='/command', is_verbose=False):
+    def __init__(self, name, input_names, is_localhost, port=8092, url='/command', is_verbose=False, heartbeat_seconds=0.25,
+                 transport=None):
         super().__init__(
             name=name,
             is_localhost=is_localhost,
             port=port,
             url=url,
             input_names=input_names,
-            is_verbose=is_verbose
+            is_verbose=is_verbose,
+            is_call_driven=True,
+            heartbeat_seconds=heartbeat_seconds,
+            transport=transport
         )
 
+    def get_in_process_handlers(self):
+        """
+        The in_process transport drives the GPIO pins from the
+        control loop's own process, so the server module (and
+        RPi.GPIO) must be importable there
+        """
+        from car.parts.engine.server import make_engine, make_in_process_handlers
+        return make_in_process_handlers(make_engine())
+
     # The parent class, Part.py, automatically runs this function an in infinite loop
     def request(self):
-        response = requests.post(
-            self.endpoint,
-            data=json.dumps(self.inputs)
-        )
+        """
+        The server keeps the last command and merges whatever I
+        send into it, so I only send the inputs that changed,
+        plus a full heartbeat every heartbeat_seconds. While the
+        car idles or cruises at a constant throttle that skips
+        almost every post
+        """
+        inputs, payload = self.get_input_delta()
+        if payload is None:
+            return
+        try:
+            response = self.session.post(
+                self.endpoint,
+                data=json.dumps(payload)
+            )
+            response.raise_for_status()
+        except:
+            self.reset_inputs_sent()
+            raise
+        self.mark_inputs_sent(inputs)
+
+    # The asyncio runtime runs this instead of request()
+    async def request_async(self, session):
+        inputs, payload = self.get_input_delta()
+        if payload is None:
+            return
+        try:
+            async with session.post(self.endpoint, data=json.dumps(payload)) as response:
+                await response.read()
+                response.raise_for_status()
+        except:
+            self.reset_inputs_sent()
+            raise
+        self.mark_inputs_sent(inputs)
 
     # This is how the main control loop interacts with the part
     def _call(self, *args):
@@ -57,6 +99,8 @@ class Client(Part):
             failing on the server due to "key not found" errors
             in the json_input
         """
+        # The brake bypasses request(), so the next send must be complete
+        self.reset_inputs_sent()
         if is_catastrophic:
             """
             Pass minimum inputs to avoid killing the engine server
@@ -72,7 +116,7 @@ class Client(Part):
                 data=json.dumps(emergency_inputs)
             )
         else:
-            _ = requests.post(
+            _ = self.session.post(
                 self.endpoint,
                 data=json.dumps(self.inputs)
             )
@@ -1,8 +1,14 @@
 import argparse
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import json
+from threading import Lock
+import time
 import RPi.GPIO as GPIO
+import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
 import tornado.web
 import tornado.gen
 
@@ -90,7 +96,7 @@ class Engine(object):
                 self.run_angle(inputs['remote_model/angle'])
                 self.run_throttle(inputs['dashboard/model_constant_throttle'])
             elif driver_type == 'local_model':
-                self.run_angle(inputs['remote_model/angle'])
+                self.run_angle(inputs['local_model/angle'])
                 self.run_throttle(inputs['dashboard/model_constant_throttle'])
             else:
                 self.run_angle(inputs['ps3_controller/angle'])
@@ -109,6 +115,90 @@ class Engine(object):
         print('Stopped engine')
 
 
+class ActuationTracker(object):
+    """
+    Measures glass-to-wheel latency. The camera frame that a model
+    prediction was made from travels with the prediction, as
+    local_model/frame_id and local_model/frame_timestamp (or the
+    remote_model equivalents), all the way into the engine command.
+    Once the engine has acted on a prediction, I record how old its
+    frame was. Each frame is only counted the first time, because
+    the drive loop keeps resending the last prediction until the
+    model has a new one
+    """
+
+    def __init__(self, max_samples=1000):
+        self.lock = Lock()
+        self.max_samples = max_samples
+        self.frame_age_seconds = {}
+        self.actuation_seconds = deque(maxlen=max_samples)
+        self.last_frame_ids = {}
+
+    def record(self, inputs, actuation_seconds):
+        """
+        Parameters
+        ----------
+        inputs : dict
+            The full command the engine just ran
+        actuation_seconds : float
+            How long Engine.run() took
+        """
+        with self.lock:
+            self.actuation_seconds.append(actuation_seconds)
+            driver_type = inputs.get('dashboard/driver_type')
+            if driver_type not in ['local_model', 'remote_model']:
+                return
+            frame_id = inputs.get(driver_type + '/frame_id')
+            frame_timestamp = inputs.get(driver_type + '/frame_timestamp')
+            if frame_id is None or frame_timestamp is None:
+                return
+            if self.last_frame_ids.get(driver_type) == frame_id:
+                return
+            self.last_frame_ids[driver_type] = frame_id
+            if driver_type not in self.frame_age_seconds:
+                self.frame_age_seconds[driver_type] = deque(maxlen=self.max_samples)
+            self.frame_age_seconds[driver_type].append(time.time() - frame_timestamp)
+
+    def summarize_samples(self, samples):
+        # The engine's container doesn't have numpy
+        ordered = sorted(samples)
+        if len(ordered) == 0:
+            return {'count': 0}
+        def percentile(fraction):
+            index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+            return ordered[index] * 1000
+        return {
+            'count': len(ordered),
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+            'max_ms': ordered[-1] * 1000
+        }
+
+    def summarize(self):
+        """
+        Returns
+        ----------
+        summary : dict
+            Frame age at actuation per model driver type, and the
+            time spent in Engine.run(), in milliseconds
+        """
+        with self.lock:
+            summary = {
+                'actuation': self.summarize_samples(self.actuation_seconds),
+                'frame_age_at_actuation': {}
+            }
+            for driver_type, samples in self.frame_age_seconds.items():
+                summary['frame_age_at_actuation'][driver_type] = self.summarize_samples(samples)
+        return summary
+
+
+def run_and_track(engine, tracker, inputs):
+    start_time = time.monotonic()
+    engine.run(inputs)
+    tracker.record(inputs, time.monotonic() - start_time)
+
+
 class Command(tornado.web.RequestHandler):
 
     executor = ThreadPoolExecutor(5)
@@ -116,7 +206,11 @@ class Command(tornado.web.RequestHandler):
     @tornado.concurrent.run_on_executor
     def run(self, json_input):
         print(json_input)
-        self.application.engine.run(json_input)
+        run_and_track(
+            engine=self.application.engine,
+            tracker=self.application.actuation_tracker,
+            inputs=json_input
+        )
         return {}
 
     @tornado.gen.coroutine
@@ -124,8 +218,16 @@ class Command(tornado.web.RequestHandler):
         print('{timestamp} - Received request'.format(
             timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
         ))
+        """
+        The client only sends the inputs that changed since its
+        last command, so I merge them into the last command here
+        on the IOLoop's thread, where merges can't interleave,
+        and hand a copy of the full command to the executor
+        """
         json_input = tornado.escape.json_decode(self.request.body)
-        result = yield self.run(json_input=json_input)
+        self.application.inputs.update(json_input)
+        inputs = dict(self.application.inputs)
+        result = yield self.run(json_input=inputs)
         self.write(result)
 
 class Health(tornado.web.RequestHandler):
@@ -144,13 +246,67 @@ class Health(tornado.web.RequestHandler):
         result = yield self.is_healthy()
         self.write(result)
 
+class Metrics(tornado.web.RequestHandler):
+
+    def get(self):
+        self.write(self.application.actuation_tracker.summarize())
+
 def make_app():
     handlers = [
         (r"/command", Command),
-        (r"/health", Health)
+        (r"/health", Health),
+        (r"/metrics", Metrics)
     ]
     return tornado.web.Application(handlers)
 
+def make_engine():
+    return Engine(16, 18, 22, 19, 21, 23)
+
+def make_in_process_handlers(engine, tracker=None):
+    """
+    Used by the in_process transport (see car/transports.py) to
+    drive the engine from the control loop's own process, without
+    a socket or Tornado in between. The handlers mirror the
+    Command and Health handlers above, including merging partial
+    commands into the last full command
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine to drive
+    tracker : ActuationTracker
+        Records frame age at actuation. A new one is created if
+        not given
+
+    Returns
+    ----------
+    handlers : dict
+        Maps each url path to a function of the request body
+    """
+    if tracker is None:
+        tracker = ActuationTracker()
+    inputs = {}
+    lock = Lock()
+
+    def command(body):
+        with lock:
+            inputs.update(json.loads(body))
+            command_inputs = dict(inputs)
+        run_and_track(engine=engine, tracker=tracker, inputs=command_inputs)
+        return {}
+
+    def health(body):
+        return {'is_healthy': True}
+
+    def metrics(body):
+        return tracker.summarize()
+
+    return {
+        '/command': command,
+        '/health': health,
+        '/metrics': metrics
+    }
+
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument(
@@ -159,9 +315,20 @@ if __name__ == "__main__":
         help="Server port to use",
         default=8092
     )
+    ap.add_argument(
+        "--unix_socket",
+        required=False,
+        help="Optional Unix domain socket path to listen on in addition to the port",
+        default=None
+    )
     args = vars(ap.parse_args())
     port = args['port']
     app = make_app()
-    app.engine = Engine(16, 18, 22, 19, 21, 23)
+    app.engine = make_engine()
+    app.inputs = {}
+    app.actuation_tracker = ActuationTracker()
     app.listen(port)
+    if args['unix_socket'] is not None:
+        server = tornado.httpserver.HTTPServer(app)
+        server.add_socket(tornado.netutil.bind_unix_socket(args['unix_socket']))
     tornado.ioloop.IOLoop.current().start()
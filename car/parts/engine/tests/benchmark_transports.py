@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+from threading import Event, Thread
+import time
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.web
+from car.parts.engine.client import Client as Engine
+from car.transports import HttpTransport, InProcessTransport, UnixSocketTransport
+
+
+"""
+Measures the round trip of the engine command path, the client's
+request() posting a full command to the server, over each part
+transport. The stub server does no work, so the numbers are pure
+transport overhead: JSON encoding, the socket hop and HTTP parsing.
+
+Example:
+    export PYTHONPATH=$PYTHONPATH:/Users/ryanzotti/Documents/repos/Self-Driving-Car
+    python car/parts/engine/tests/benchmark_transports.py --requests 2000
+"""
+
+engine_input_names = [
+    'dashboard/brake',
+    'dashboard/driver_type',
+    'dashboard/model_constant_throttle',
+    'local_model/angle',
+    'local_model/throttle',
+    'ps3_controller/angle',
+    'ps3_controller/brake',
+    'ps3_controller/throttle',
+    'remote_model/angle',
+    'remote_model/throttle',
+    'vehicle/brake'
+]
+
+
+class Command(tornado.web.RequestHandler):
+    def post(self):
+        tornado.escape.json_decode(self.request.body)
+        self.write({})
+
+
+def in_process_command(body):
+    # Decodes the body like the Tornado handler does
+    json.loads(body)
+    return {}
+
+
+def start_stub_server(port, socket_path):
+    is_listening = Event()
+
+    def run():
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        app = tornado.web.Application([
+            (r"/command", Command)
+        ])
+        app.listen(port)
+        server = tornado.httpserver.HTTPServer(app)
+        server.add_socket(tornado.netutil.bind_unix_socket(socket_path))
+        tornado.ioloop.IOLoop.current().add_callback(is_listening.set)
+        tornado.ioloop.IOLoop.current().start()
+    thread = Thread(target=run, args=())
+    thread.daemon = True
+    thread.start()
+    is_listening.wait()
+
+
+def benchmark(transport, port, request_count):
+    engine = Engine(
+        name='engine',
+        input_names=engine_input_names,
+        is_localhost=True,
+        port=port,
+        transport=transport
+    )
+    engine.inputs = {
+        'dashboard/brake': False,
+        'dashboard/driver_type': 'user',
+        'dashboard/model_constant_throttle': 0.0,
+        'local_model/angle': None,
+        'local_model/throttle': None,
+        'ps3_controller/angle': 0.25,
+        'ps3_controller/brake': False,
+        'ps3_controller/throttle': 0.5,
+        'remote_model/angle': 0.0,
+        'remote_model/throttle': None,
+        'vehicle/brake': False
+    }
+    round_trips_us = []
+    for i in range(request_count):
+        # Force a full command every time, like a heartbeat
+        engine.reset_inputs_sent()
+        start_time = time.perf_counter()
+        engine.request()
+        round_trips_us.append((time.perf_counter() - start_time) * 1000000.0)
+    # The first requests open connections and warm up caches
+    round_trips_us = sorted(round_trips_us[request_count // 10:])
+    return {
+        'transport': transport.name,
+        'mean_us': round(statistics.mean(round_trips_us), 1),
+        'p50_us': round(round_trips_us[len(round_trips_us) // 2], 1),
+        'p99_us': round(round_trips_us[int(len(round_trips_us) * 0.99) - 1], 1)
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "--requests",
+        required=False,
+        help="Number of commands to send per transport",
+        default=2000
+    )
+    ap.add_argument(
+        "--port",
+        required=False,
+        help="Port for the stub engine server",
+        default=8192
+    )
+    args = vars(ap.parse_args())
+    request_count = int(args['requests'])
+    port = int(args['port'])
+
+    socket_directory = tempfile.mkdtemp()
+    start_stub_server(port, os.path.join(socket_directory, 'engine.sock'))
+    transports = [
+        HttpTransport(),
+        UnixSocketTransport(socket_directory=socket_directory),
+        InProcessTransport(handlers={'/command': in_process_command})
+    ]
+    for transport in transports:
+        print(benchmark(transport, port, request_count))
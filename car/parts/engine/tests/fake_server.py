@@ -1,7 +1,9 @@
 import argparse
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
 import tornado.web
 import tornado.gen
 
@@ -54,8 +56,17 @@ if __name__ == "__main__":
         help="Server port to use",
         default=8092
     )
+    ap.add_argument(
+        "--unix_socket",
+        required=False,
+        help="Optional Unix domain socket path to listen on in addition to the port",
+        default=None
+    )
     args = vars(ap.parse_args())
     port = args['port']
     app = make_app()
     app.listen(port)
+    if args['unix_socket'] is not None:
+        server = tornado.httpserver.HTTPServer(app)
+        server.add_socket(tornado.netutil.bind_unix_socket(args['unix_socket']))
     tornado.ioloop.IOLoop.current().start()
@@ -5,25 +5,56 @@ from car.Part import Part
 
 class Client(Part):
 
-    def __init__(self, name, input_names, is_localhost, port=8095, url='/update', is_verbose=False):
+    def __init__(self, name, input_names, is_localhost, port=8095, url='/update', is_verbose=False, heartbeat_seconds=0.25,
+                 transport=None):
         super().__init__(
             name=name,
             is_localhost=is_localhost,
             port=port,
             url=url,
             input_names=input_names,
-            is_verbose=is_verbose
+            is_verbose=is_verbose,
+            is_call_driven=True,
+            is_critical=False,
+            heartbeat_seconds=heartbeat_seconds,
+            transport=transport
         )
         self.outputs = None
 
     # Part.py runs this function in an infinite loop
     def request(self):
+        # Like the engine, only send what changed plus a heartbeat
+        inputs, payload = self.get_input_delta()
+        if payload is None:
+            return
         timeout_seconds = 1
-        response = self.session.post(
-            self.endpoint,
-            data=json.dumps(self.inputs),
-            timeout=timeout_seconds
-        )
+        try:
+            response = self.session.post(
+                self.endpoint,
+                data=json.dumps(payload),
+                timeout=timeout_seconds
+            )
+            response.raise_for_status()
+        except:
+            self.reset_inputs_sent()
+            raise
+        self.mark_inputs_sent(inputs)
+
+    # The asyncio runtime runs this instead of request()
+    async def request_async(self, session):
+        import aiohttp
+        inputs, payload = self.get_input_delta()
+        if payload is None:
+            return
+        timeout = aiohttp.ClientTimeout(total=1)
+        try:
+            async with session.post(self.endpoint, data=json.dumps(payload), timeout=timeout) as response:
+                await response.read()
+                response.raise_for_status()
+        except:
+            self.reset_inputs_sent()
+            raise
+        self.mark_inputs_sent(inputs)
 
     # This is how the main control loop interacts with the part
     def _call(self, *args):
@@ -1,6 +1,8 @@
 import argparse
 from concurrent.futures import ThreadPoolExecutor
+import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
 import tornado.web
 import tornado.gen
 
@@ -12,7 +14,8 @@ class Input(tornado.web.RequestHandler):
     @tornado.concurrent.run_on_executor
     def update(self,data):
         print(data)
-        self.application.data = data
+        # The client only sends the values that changed
+        self.application.data.update(data)
         return {}
 
     @tornado.gen.coroutine
@@ -61,6 +64,12 @@ if __name__ == "__main__":
         required=False,
         help="Server port to use",
         default=8095)
+    ap.add_argument(
+        "--unix_socket",
+        required=False,
+        help="Optional Unix domain socket path to listen on in addition to the port",
+        default=None
+    )
     args = vars(ap.parse_args())
     port = args['port']
     app = make_app()
@@ -80,4 +89,7 @@ if __name__ == "__main__":
         'vehicle/brake':None
     }
     app.listen(port)
+    if args['unix_socket'] is not None:
+        server = tornado.httpserver.HTTPServer(app)
+        server.add_socket(tornado.netutil.bind_unix_socket(args['unix_socket']))
     tornado.ioloop.IOLoop.current().start()
@@ -1,11 +1,13 @@
-import cv2
 import json
+import time
 from car.Part import Part
+from car.parts.video.model_shape import encode_for_model
 
 
 class Client(Part):
 
-    def __init__(self, name, input_names, output_names, is_localhost, host=None, port=8885, url='/predict', is_verbose=False):
+    def __init__(self, name, input_names, output_names, is_localhost, host=None, port=8885, url='/predict',
+                 is_model_shaped=False, is_verbose=False):
         super().__init__(
             name=name,
             host=host,
@@ -14,21 +16,43 @@ class Client(Part):
             url=url,
             input_names=input_names,
             output_names=output_names,
-            is_verbose=is_verbose
+            is_verbose=is_verbose,
+            is_call_driven=True
         )
         self.outputs = None
+        """
+        When is_model_shaped is True I crop, shrink and contrast
+        normalize each frame here, the way the model would, and
+        send only the pixels the model uses (see
+        car/parts/video/model_shape.py). The shape comes from the
+        server's /model-metadata and is read again whenever the
+        server says it has changed
+        """
+        self.is_model_shaped = is_model_shaped
+        self.metadata_endpoint = 'http://{host}:{port}/model-metadata'.format(
+            host=self.host,
+            port=self.port
+        )
+        self.model_shape = None
 
     # Part.py runs this function in an infinite loop
     def request(self):
-        frame = self.inputs['camera/image_array']
-        img = cv2.imencode('.jpg', frame)[1].tostring()
-        files = {'image': img}
+        frame = self.inputs['camera/frame']
         timeout_seconds = 1
+        if self.is_model_shaped and self.model_shape is None:
+            response = self.session.post(self.metadata_endpoint, timeout=timeout_seconds)
+            self.set_model_shape(json.loads(response.text))
+        image, data = self.get_payload(frame)
+        files = {'image': image}
+        start_time = time.monotonic()
         response = self.session.post(
             self.endpoint,
             files=files,
+            data=data,
             timeout=timeout_seconds
         )
+        round_trip_seconds = time.monotonic() - start_time
+        self.check_model_shape(response.status_code)
         """
         Normally I should call self.update_outputs(response=response),
         but update_outputs() expects that the server returns dictionary
@@ -40,8 +64,125 @@ class Client(Part):
         laptop in this case, but that required skipping the
         update_outputs() function
         """
-        predicted_angle = json.loads(response.text)['prediction']
-        self.outputs = predicted_angle
+        self.handle_prediction(json.loads(response.text), frame, round_trip_seconds)
+
+    # The asyncio runtime runs this instead of request()
+    async def request_async(self, session):
+        import aiohttp
+        frame = self.inputs['camera/frame']
+        timeout = aiohttp.ClientTimeout(total=1)
+        if self.is_model_shaped and self.model_shape is None:
+            async with session.post(self.metadata_endpoint, timeout=timeout) as response:
+                self.set_model_shape(json.loads(await response.text()))
+        image, fields = self.get_payload(frame)
+        # Tornado only puts the part in request.files if it has a filename
+        data = aiohttp.FormData()
+        data.add_field('image', image, filename='image')
+        for name, value in fields.items():
+            data.add_field(name, value)
+        start_time = time.monotonic()
+        async with session.post(self.endpoint, data=data, timeout=timeout) as response:
+            text = await response.text()
+            status_code = response.status
+        round_trip_seconds = time.monotonic() - start_time
+        self.check_model_shape(status_code)
+        self.handle_prediction(json.loads(text), frame, round_trip_seconds)
+
+    def set_model_shape(self, metadata):
+        """
+        Parameters
+        ----------
+        metadata : dict
+            The server's /model-metadata
+        """
+        self.model_shape = (float(metadata['image_scale']), float(metadata['crop_percent']))
+
+    def check_model_shape(self, status_code):
+        # 409 means the server's model wants a different shape than the one I sent
+        if status_code == 409:
+            image_scale, crop_percent = self.model_shape
+            # The next request reads /model-metadata again
+            self.model_shape = None
+            raise ValueError('The model server rejected a frame shaped for image_scale={image_scale}, crop_percent={crop_percent}'.format(
+                image_scale=image_scale,
+                crop_percent=crop_percent
+            ))
+
+    def get_payload(self, frame):
+        """
+        Parameters
+        ----------
+        frame : Frame
+            The frame to send
+
+        Returns
+        ----------
+        image : bytes
+            The camera's JPEG, or a model-shaped PNG if
+            is_model_shaped is True
+        fields : dict
+            The form fields to send along with the image
+        """
+        fields = self.get_trace_fields(frame)
+        # Lets the model server put driving ahead of bulk scoring (see ai/batching.py)
+        fields['lane'] = 'driving'
+        if not self.is_model_shaped:
+            image = frame.jpeg
+        else:
+            image_scale, crop_percent = self.model_shape
+            start_time = time.monotonic()
+            image = encode_for_model(frame.image, image_scale, crop_percent)
+            self.metrics.record('shape_seconds', time.monotonic() - start_time)
+            fields['is_model_shaped'] = 'true'
+            fields['image_scale'] = repr(image_scale)
+            fields['crop_percent'] = repr(crop_percent)
+        self.metrics.increment('sent_image_bytes', len(image))
+        return image, fields
+
+    def get_trace_fields(self, frame):
+        """
+        The server echoes these back, so a prediction can always be
+        matched to the frame it was made from
+        """
+        return {
+            'frame_id': str(frame.frame_id),
+            'frame_timestamp': repr(frame.timestamp)
+        }
+
+    def handle_prediction(self, result, frame, round_trip_seconds):
+        """
+        Records the server's stage timings and sets the outputs
+
+        Parameters
+        ----------
+        result : dict
+            The server's response
+        frame : Frame
+            The frame the prediction was made from
+        round_trip_seconds : float
+            How long the request took from the client's side
+        """
+        timings = result.get('timings', {})
+        for name, seconds in timings.items():
+            self.metrics.record('server_' + name, seconds)
+        # Whatever the server didn't spend on the prediction was spent on the network
+        self.metrics.record('network_seconds', max(0.0, round_trip_seconds - sum(timings.values())))
+        """
+        Output names end in angle, frame_id or frame_timestamp, like
+        local_model/angle. The frame id and timestamp are optional
+        and pass through Memory.py to the engine
+        """
+        values = {
+            'angle': result['prediction'],
+            'frame_id': frame.frame_id,
+            'frame_timestamp': frame.timestamp
+        }
+        outputs = tuple(values[output_name.split('/')[-1]] for output_name in self.output_names)
+        if len(outputs) == 1:
+            # Memory.put() expects single outputs without a tuple
+            self.outputs = outputs[0]
+        else:
+            self.outputs = outputs
 
     # This is how the main control loop interacts with the part
     def _call(self, *args):
@@ -5,14 +5,15 @@ from car.Part import Part
 
 class Client(Part):
 
-    def __init__(self, name, output_names, is_localhost, port=8094, url='/get-state', is_verbose=False):
+    def __init__(self, name, output_names, is_localhost, port=8094, url='/get-state', is_verbose=False, rate_hz=None):
         super().__init__(
             name=name,
             is_localhost=is_localhost,
             port=port,
             url=url,
             output_names=output_names,
-            is_verbose=is_verbose
+            is_verbose=is_verbose,
+            rate_hz=rate_hz
         )
         self.outputs = None
 
@@ -26,6 +27,15 @@ class Client(Part):
         if response is not None:
             self.update_outputs(response=response)
 
+    # The asyncio runtime runs this instead of request()
+    async def request_async(self, session):
+        import aiohttp
+        timeout = aiohttp.ClientTimeout(total=1)
+        async with session.post(self.endpoint, timeout=timeout) as response:
+            response.raise_for_status()
+            text = await response.text()
+        self.parse_outputs(text)
+
     # This is how the main control loop interacts with the part
     def _call(self):
         return self.outputs
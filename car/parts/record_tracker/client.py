@@ -1,4 +1,4 @@
-import cv2
+import asyncio
 from datetime import datetime
 import json
 import requests
@@ -31,9 +31,7 @@ class Client(Part):
 
     def request_with_image(self):
         try:
-            image = self.inputs['camera/image_array']
-            image_string = cv2.imencode('.jpg', image)[1].tostring()
-            files = {'image': image_string}
+            files = {'image': self.inputs['camera/jpeg']}
             response = requests.post(
                 self.with_image_endpoint,
                 files=files
@@ -48,7 +46,7 @@ class Client(Part):
         simpler values like strings and floats.
         """
         json_payload = self.inputs.copy()
-        del json_payload['camera/image_array']
+        del json_payload['camera/jpeg']
         try:
             response = self.session.post(
                 self.without_image_endpoint,
@@ -82,6 +80,45 @@ class Client(Part):
             )
             self.is_requestable = False
 
+    async def request_with_image_async(self, session):
+        import aiohttp
+        try:
+            data = aiohttp.FormData()
+            data.add_field('image', self.inputs['camera/jpeg'], filename='image')
+            async with session.post(self.with_image_endpoint, data=data) as response:
+                await response.read()
+            return True
+        except:
+            return False
+
+    async def request_without_image_async(self, session):
+        json_payload = self.inputs.copy()
+        del json_payload['camera/jpeg']
+        try:
+            async with session.post(self.without_image_endpoint, data=json.dumps(json_payload)) as response:
+                await response.read()
+            return True
+        except:
+            return False
+
+    # The asyncio runtime runs this instead of request()
+    async def request_async(self, session):
+        """
+        Same three requests as request(), except that the image
+        and the labels are sent concurrently
+        """
+        print('{timestamp} - Record tracker client called service'.format(
+            timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+        ))
+        is_with_image_success, is_without_image_success = await asyncio.gather(
+            self.request_with_image_async(session),
+            self.request_without_image_async(session)
+        )
+        if is_with_image_success and is_without_image_success:
+            async with session.post(self.endpoint) as response:
+                await response.read()
+            self.is_requestable = False
+
     # This is how the main control loop interacts with the part
     def _call(self, *args):
         self.inputs = dict(zip(self.input_names, *args))
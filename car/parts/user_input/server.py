@@ -32,6 +32,9 @@ class TrackRemoteModel(tornado.web.RequestHandler):
     def update(self,data):
         print(data)
         self.application.remote_model_angle = data['remote_model/angle']
+        # Older coordinators don't trace frames, so these are optional
+        self.application.remote_model_frame_id = data.get('remote_model/frame_id')
+        self.application.remote_model_frame_timestamp = data.get('remote_model/frame_timestamp')
         return {}
 
     @tornado.gen.coroutine
@@ -51,7 +54,9 @@ class GetInput(tornado.web.RequestHandler):
             'dashboard/driver_type': self.application.driver_type,
             'dashboard/brake': self.application.brake,
             'dashboard/model_constant_throttle': self.application.model_constant_throttle,
-            'remote_model/angle': self.application.remote_model_angle
+            'remote_model/angle': self.application.remote_model_angle,
+            'remote_model/frame_id': self.application.remote_model_frame_id,
+            'remote_model/frame_timestamp': self.application.remote_model_frame_timestamp
         }
         self.write(state)
 
@@ -93,6 +98,8 @@ if __name__ == "__main__":
     app = make_app()
     app.remote_model_angle = 0.0
     app.remote_model_throttle = 0.0
+    app.remote_model_frame_id = None
+    app.remote_model_frame_timestamp = None
     app.driver_type = 'user'
     app.brake = True
     app.model_constant_throttle = 1.0
@@ -1,13 +1,16 @@
-import cv2
 from datetime import datetime
+import itertools
+import time
+from car.frame import Frame
 from car.Part import Part
+from car.parts.video.mjpeg import MjpegDemuxer
 import urllib.request
 from car.utils import *
 
 
 class Client(Part):
 
-    def __init__(self, name, output_names, is_localhost, port=8091, url='/video', consecutive_no_image_count_threshold=150, is_verbose=False):
+    def __init__(self, name, output_names, is_localhost, port=8091, url='/video', stream_timeout_seconds=2, is_verbose=False):
         super().__init__(
             name=name,
             is_localhost=is_localhost,
@@ -19,6 +22,11 @@ class Client(Part):
         # Need to define as None to avoid "does not exist bugs"
         self.frame = None
         self.stream = None
+        self.demuxer = None
+        # Only numbers frames if the video server doesn't
+        self.frame_ids = itertools.count()
+        # A stream that stops sending this long is reopened
+        self.stream_timeout_seconds = stream_timeout_seconds
         try:
             print('{timestamp} - Attempting to open video stream...'.format(
                 timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
@@ -32,62 +40,77 @@ class Client(Part):
                 timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
             ))
 
-        """
-        When the video is streaming well, about 1 of every 15
-        iterations of the infinite loop produces an image. When
-        the video is killed and there is nothing to show, the else
-        part of the loop gets called consecutively indefinitely.
-        I can avoid the zombie threads that take over my entire
-        Tornado server (99% of CPU) if I check a consecutive
-        failure count exceeding some arbitrarily high threshold
-        """
-        self.consecutive_no_image_count = 0
-        self.consecutive_no_image_count_threshold = consecutive_no_image_count_threshold
-        self.was_available = False
-
     # This automatically gets called in an infinite loop by the parent class, Part.py
     def request(self):
+        """
+        Blocks until the next frame arrives. If the video server
+        goes away the stream either ends or times out, and I set
+        the stream to None so that the next call reopens it. The
+        raised exception keeps last_update_time from advancing,
+        so the car brakes while the video is down
+        """
         if self.stream is None:
             self.open_stream()
-        self.opencv_bytes += self.stream.read(1024)
-        a = self.opencv_bytes.find(b'\xff\xd8')
-        b = self.opencv_bytes.find(b'\xff\xd9')
-        if a != -1 and b != -1:
-            jpg = self.opencv_bytes[a:b + 2]
-            self.opencv_bytes = self.opencv_bytes[b + 2:]
-            frame = cv2.imdecode(np.fromstring(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
-            if cv2.waitKey(1) == 27:
-                exit(0)
-            self.frame = frame
-            self.consecutive_no_image_count = 0
-            self.was_available = True
+        try:
+            jpg = self.demuxer.read_frame()
+        except:
+            self.stream = None
+            raise
+        if jpg is None:
+            self.stream = None
+            raise Exception('The video stream ended')
+        received_time = time.time()
+        """
+        The video server stamps each frame with an id and the time
+        it arrived from ffserver. The frame keeps both all the way
+        to the engine command, which is how the engine server
+        matches predictions to frames and measures the frame's age
+        at actuation. The coordinator reads the same id, so the
+        local and remote model's frame ids agree
+        """
+        frame_id = self.demuxer.headers.get(b'x-frame-id')
+        if frame_id is not None:
+            frame_id = int(frame_id)
+        else:
+            frame_id = next(self.frame_ids)
+        timestamp = self.demuxer.headers.get(b'x-timestamp')
+        if timestamp is not None:
+            timestamp = float(timestamp)
+            self.metrics.record('video_transport_seconds', received_time - timestamp)
         else:
-            if self.was_available:
-                self.consecutive_no_image_count = 1
-            else:
-                self.consecutive_no_image_count += 1
-            if self.consecutive_no_image_count > self.consecutive_no_image_count_threshold:
-                self.stream = None  # Tells self.open_stream() to run
-                """
-                Resetting the count to 0 fixed a bug where the
-                client could never recover, even after the
-                ffmpeg server was brought up again. I suspect
-                the bug occurred because I set the stream to None
-                which would indicate that the stream needed to be
-                reopened, and presumably it takes a few
-                iterations to return an image. Resuming the count
-                from where I left off would mean that I would
-                have only once (or zero) chance of not exceeding
-                the threshold
-                """
-                self.consecutive_no_image_count = 0
-                raise Exception
-            self.was_available = False
+            timestamp = received_time
+        """
+        I don't decode here. Most frames are replaced before the
+        drive loop even reads them, and the model and record
+        tracker clients only forward the JPEG anyway. The Frame
+        decodes the first time somebody asks for its pixels, and
+        only once no matter how many parts ask
+        """
+        self.frame = Frame(
+            frame_id=frame_id,
+            jpeg=jpg,
+            timestamp=timestamp
+        )
+        self.metrics.increment('received_frames')
 
     # This is how the main control loop interacts with the part
     def _call(self):
-        return self.frame
+        """
+        Output names end in frame or jpeg, like camera/frame and
+        camera/jpeg. camera/jpeg is the frame's compressed bytes,
+        for parts that forward the JPEG and don't need the frame's
+        id or timestamp
+        """
+        values = {
+            'frame': self.frame,
+            'jpeg': self.frame.jpeg if self.frame is not None else None
+        }
+        outputs = tuple(values[output_name.split('/')[-1]] for output_name in self.output_names)
+        if len(outputs) == 1:
+            # Memory.put() expects single outputs without a tuple
+            return outputs[0]
+        return outputs
 
     def open_stream(self):
-        self.stream = urllib.request.urlopen(self.endpoint)
-        self.opencv_bytes = bytes()
+        self.stream = urllib.request.urlopen(self.endpoint, timeout=self.stream_timeout_seconds)
+        self.demuxer = MjpegDemuxer(self.stream)
@@ -0,0 +1,219 @@
+"""
+Splits an MJPEG (multipart/x-mixed-replace) HTTP stream into its
+JPEG frames. Every consumer of the car's video uses this, so there
+is only one copy of the parsing code.
+
+The old parsers read 1024 bytes at a time, appended them to a
+bytes object, which copies the whole buffer on every read, and
+searched the buffer for the JPEG start and end markers from the
+beginning every time. This one parses each part's headers, and
+when a part has a Content-length header, which both ffserver and
+the video server send, it reads the JPEG straight from the socket
+into the frame's own buffer. Only the few bytes that arrived along
+with the headers are ever copied. Streams without Content-length
+fall back to searching for the JPEG end marker, but only through
+the bytes that haven't been searched yet.
+
+This file is deliberately self-contained because the video server's
+container only has the files in this folder.
+"""
+
+# The boundary the car's video servers have always used
+BOUNDARY = '--boundarydonotcross'
+CONTENT_TYPE = 'multipart/x-mixed-replace;boundary={boundary}'.format(boundary=BOUNDARY)
+
+
+def make_part_header(jpeg_length, boundary=BOUNDARY, extra_headers=None, content_type='image/jpeg'):
+    """
+    Parameters
+    ----------
+    jpeg_length : int
+        Number of bytes in the JPEG that follows the header
+    boundary : string
+        The boundary from the response's Content-type header
+    extra_headers : dict
+        Optional additional headers for this part, like the
+        video server's X-Frame-Id and X-Timestamp
+    content_type : string
+        The part's image type. The video server's /preview stream
+        sends PNGs, which MjpegDemuxer reads just the same thanks
+        to the Content-length
+
+    Returns
+    ----------
+    header : bytes
+        The boundary and headers to write in front of a JPEG. The
+        Content-length lets MjpegDemuxer read the JPEG without
+        searching for its end
+    """
+    lines = [
+        boundary,
+        'Content-type: {content_type}'.format(content_type=content_type),
+        'Content-length: {length}'.format(length=jpeg_length)
+    ]
+    for name, value in (extra_headers or {}).items():
+        lines.append('{name}: {value}'.format(name=name, value=value))
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode()
+
+
+class MjpegDemuxer:
+
+    start_marker = b'\xff\xd8'
+    end_marker = b'\xff\xd9'
+
+    def __init__(self, stream, read_size=65536, max_header_bytes=65536):
+        """
+        Parameters
+        ----------
+        stream : file-like
+            A binary stream, like the response of
+            urllib.request.urlopen(). It must support read() and
+            readinto(). If it supports read1(), like HTTP responses
+            do, reads return as soon as any data has arrived
+            instead of waiting for read_size bytes
+        read_size : int
+            Max bytes to read at a time while looking for headers
+        max_header_bytes : int
+            Bytes between frames that don't contain a line break are
+            discarded once there are more than this many
+        """
+        self.stream = stream
+        self.read_size = read_size
+        self.max_header_bytes = max_header_bytes
+        self.buffer = bytearray()
+        # The headers of the most recent frame, with lower case names
+        self.headers = {}
+        if hasattr(stream, 'read1'):
+            self.read_chunk = stream.read1
+        else:
+            self.read_chunk = stream.read
+
+    def __iter__(self):
+        while True:
+            jpeg = self.read_frame()
+            if jpeg is None:
+                return
+            yield jpeg
+
+    def read_frame(self):
+        """
+        Blocks until the next complete frame has arrived
+
+        Returns
+        ----------
+        jpeg : bytearray
+            The frame's JPEG bytes in a buffer of their own, or None
+            if the stream has ended
+        """
+        headers = self.read_headers()
+        if headers is None:
+            return None
+        self.headers = headers
+        content_length = headers.get(b'content-length')
+        if content_length is not None:
+            return self.read_payload(int(content_length))
+        return self.read_until_end_marker()
+
+    def fill(self):
+        """
+        Returns
+        ----------
+        is_filled : boolean
+            False if the stream has ended
+        """
+        chunk = self.read_chunk(self.read_size)
+        if not chunk:
+            return False
+        self.buffer += chunk
+        return True
+
+    def read_headers(self):
+        """
+        Consumes the boundary and headers in front of the next
+        JPEG
+
+        Returns
+        ----------
+        headers : dict
+            Lower case header names mapped to their values, empty
+            if the JPEG isn't preceded by any headers, or None if the
+            stream has ended
+        """
+        headers = {}
+        while True:
+            if self.buffer.startswith(self.start_marker):
+                return headers
+            index = self.buffer.find(b'\n')
+            if index == -1:
+                if len(self.buffer) > self.max_header_bytes:
+                    self.buffer.clear()
+                if not self.fill():
+                    return None
+                continue
+            line = bytes(self.buffer[:index]).strip()
+            del self.buffer[:index + 1]
+            if len(line) == 0:
+                # The blank line after the headers
+                if len(headers) > 0:
+                    return headers
+                continue
+            if line.startswith(b'--'):
+                """
+                The boundary. Some servers, including the old video
+                server, don't end it with a line break, so whatever
+                header shares its line is lost. That's fine as long
+                as it isn't Content-length
+                """
+                continue
+            name, separator, value = line.partition(b':')
+            if separator:
+                headers[name.strip().lower()] = value.strip()
+
+    def read_payload(self, length):
+        """
+        Parameters
+        ----------
+        length : int
+            The JPEG's size from the Content-length header
+
+        Returns
+        ----------
+        jpeg : bytearray
+            The JPEG, or None if the stream ended part way through
+        """
+        payload = bytearray(length)
+        buffered_length = min(length, len(self.buffer))
+        payload[:buffered_length] = self.buffer[:buffered_length]
+        del self.buffer[:buffered_length]
+        filled_length = buffered_length
+        with memoryview(payload) as view:
+            while filled_length < length:
+                count = self.stream.readinto(view[filled_length:])
+                if not count:
+                    return None
+                filled_length += count
+        return payload
+
+    def read_until_end_marker(self):
+        """
+        The fallback for parts without a Content-length header
+
+        Returns
+        ----------
+        jpeg : bytearray
+            The JPEG, or None if the stream ended part way through
+        """
+        search_start = 0
+        while True:
+            index = self.buffer.find(self.end_marker, search_start)
+            if index != -1:
+                payload = self.buffer[:index + 2]
+                del self.buffer[:index + 2]
+                start = payload.find(self.start_marker)
+                if start > 0:
+                    del payload[:start]
+                return payload
+            # The last byte could be the first half of the marker
+            search_start = max(0, len(self.buffer) - 1)
+            if not self.fill():
+                return None
@@ -0,0 +1,87 @@
+import cv2
+
+
+"""
+The model never sees a full camera frame. ai/transformations.py's
+apply_transformations() equalizes the frame's contrast, keeps only
+the bottom crop_percent of the rows and shrinks what is left by
+image_scale. Sending the full frame to the model server, only for
+the server to throw most of it away, wastes bandwidth and the
+server's decode time. This does the same work where the frame is
+produced, so only the pixels the model uses are sent: at
+image_scale=8 that's 1/64th of the pixels of the cropped frame.
+
+The shaped frame is encoded as PNG rather than JPEG because it is
+tiny either way, and PNG doesn't add compression artifacts on top
+of the camera's. The only difference from apply_transformations()
+is that the resize interpolates 0-255 integers instead of 0.0-1.0
+floats, so each pixel rounds to the nearest 1/255 and bicubic
+overshoot is clipped. The model server's only remaining step is
+dividing by 255.
+
+This file is deliberately self-contained because the video server's
+container only has the files in this folder.
+"""
+
+CONTENT_TYPE = 'image/png'
+
+
+def shape_for_model(image, image_scale, crop_percent):
+    """
+    Parameters
+    ----------
+    image : np.ndarray
+        A decoded BGR camera frame
+    image_scale : float
+        The model's image_scale. The frame shrinks by this factor
+    crop_percent : float
+        The model's crop_percent. The percentage of rows, counted
+        from the bottom, that the model uses
+
+    Returns
+    ----------
+    shaped_image : np.ndarray
+        The uint8 BGR image the model sees, before dividing by 255
+    """
+    # Same as normalize_contrast(). The histogram is of the whole frame, so this must come before the crop
+    yuv_image = cv2.cvtColor(image, cv2.COLOR_BGR2YUV)
+    yuv_image[:, :, 0] = cv2.equalizeHist(yuv_image[:, :, 0])
+    shaped_image = cv2.cvtColor(yuv_image, cv2.COLOR_YUV2BGR)
+    # Same as crop_images()
+    if crop_percent > 0:
+        height = int(shaped_image.shape[0])
+        top = height - int(height * (crop_percent / 100.0))
+        shaped_image = shaped_image[top:height]
+    # Same as resize_images()
+    if image_scale != 1:
+        inverted_scale = 1 / image_scale
+        shaped_image = cv2.resize(
+            shaped_image,
+            None,
+            fx=inverted_scale,
+            fy=inverted_scale,
+            interpolation=cv2.INTER_CUBIC
+        )
+    return shaped_image
+
+
+def encode_for_model(image, image_scale, crop_percent):
+    """
+    Parameters
+    ----------
+    image : np.ndarray
+        A decoded BGR camera frame
+    image_scale : float
+        The model's image_scale
+    crop_percent : float
+        The model's crop_percent
+
+    Returns
+    ----------
+    png : bytes
+        The shaped frame, ready to post to the model server with
+        is_model_shaped set
+    """
+    shaped_image = shape_for_model(image, image_scale, crop_percent)
+    return cv2.imencode('.png', shaped_image)[1].tobytes()
+
@@ -0,0 +1,218 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from datetime import datetime
+import glob
+import json
+import os
+import re
+import time
+# This file runs as a script next to mjpeg.py in the video container
+from mjpeg import CONTENT_TYPE, make_part_header
+import tornado.gen
+import tornado.ioloop
+import tornado.iostream
+import tornado.web
+
+
+"""
+Replays a recorded dataset as an MJPEG stream, in place of the
+camera. It serves /test.mjpg on ffserver's port, so server.py
+consumes it without any changes, and so does everything behind
+the video server: the control loop, the model services and the
+dashboard. That makes it possible to load test the whole stack on
+a laptop without a camera, and because every run replays the same
+frames in the same order, latency numbers from different runs can
+be compared.
+
+Example:
+    python car/parts/video/replay_server.py --dataset_path /root/data/dataset_3_18-10-20 --fps 10
+    python car/parts/video/server.py
+
+Every frame is decoded from its PNG and encoded to JPEG once at
+startup, so the replay itself costs almost nothing and doesn't
+skew the measurements of the services under test.
+"""
+
+
+def get_record_index(record_path):
+    # record_12.json -> 12. Sorting by name would put 12 before 2
+    return int(re.search(r'record_(\d+)\.json$', record_path).group(1))
+
+
+def load_dataset(dataset_path, jpeg_quality=95, max_frames=None):
+    """
+    Parameters
+    ----------
+    dataset_path : string
+        A folder of record_*.json and PNG pairs written by the
+        record tracker
+    jpeg_quality : int
+        Between 0 and 100. The camera's frames arrive as JPEGs, so
+        replayed frames do too
+    max_frames : int
+        Optional limit on the number of records to load
+
+    Returns
+    ----------
+    frames : list<tuple>
+        (record_id, jpeg) pairs in recording order
+    """
+    record_paths = glob.glob(os.path.join(dataset_path, 'record_*.json'))
+    record_paths = sorted(record_paths, key=get_record_index)
+    if max_frames is not None:
+        record_paths = record_paths[:max_frames]
+    frames = []
+    for record_path in record_paths:
+        with open(record_path, 'r') as f:
+            contents = json.load(f)
+        # Older datasets called the image cam/image_array
+        image_file = contents.get('camera/image_array', contents.get('cam/image_array'))
+        if image_file is None:
+            continue
+        image = cv2.imread(os.path.join(dataset_path, image_file))
+        if image is None:
+            continue
+        jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])[1].tobytes()
+        frames.append((get_record_index(record_path), jpeg))
+    return frames
+
+
+class ReplayAPI(tornado.web.RequestHandler):
+    '''
+    Streams the dataset's frames at fps * speed frames per second.
+    '''
+
+    @tornado.gen.coroutine
+    def get(self):
+        """
+        Like a camera, the replay never slows down for a client.
+        Each frame has a fixed time slot, measured from when the
+        client connected, so timing errors don't add up over a
+        long replay. A client that falls behind skips the frames
+        whose slots it missed instead of receiving them late. A
+        client that keeps up always gets every frame in the same
+        order, which is what makes runs reproducible
+        """
+        frames = self.application.frames
+        frame_seconds = 1.0 / (self.application.fps * self.application.speed)
+        self.set_header("Content-type", CONTENT_TYPE)
+        start_time = time.monotonic()
+        slot = 0
+        sent_count = 0
+        skipped_count = 0
+        while True:
+            if slot >= len(frames) and not self.application.is_looping:
+                break
+            record_id, jpeg = frames[slot % len(frames)]
+            self.write(make_part_header(len(jpeg), extra_headers={'X-Record-Id': record_id}))
+            self.write(jpeg)
+            self.write(b'\r\n')
+            try:
+                yield self.flush()
+            except tornado.iostream.StreamClosedError:
+                break
+            sent_count += 1
+            next_slot = slot + 1
+            current_slot = int((time.monotonic() - start_time) / frame_seconds)
+            if current_slot > next_slot:
+                skipped_count += current_slot - next_slot
+                next_slot = current_slot
+            slot = next_slot
+            delay_seconds = start_time + slot * frame_seconds - time.monotonic()
+            if delay_seconds > 0:
+                yield tornado.gen.sleep(delay_seconds)
+        elapsed_seconds = time.monotonic() - start_time
+        print('{timestamp} - Replay ended: sent {sent} frames, skipped {skipped}, {fps:.1f} fps'.format(
+            timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"),
+            sent=sent_count,
+            skipped=skipped_count,
+            fps=sent_count / max(elapsed_seconds, 1e-9)
+        ))
+
+
+class Health(tornado.web.RequestHandler):
+
+    executor = ThreadPoolExecutor(5)
+
+    @tornado.concurrent.run_on_executor
+    def is_healthy(self):
+        result = {
+            'is_healthy': True
+        }
+        return result
+
+    @tornado.gen.coroutine
+    def get(self):
+        result = yield self.is_healthy()
+        self.write(result)
+
+
+def make_app():
+    handlers = [
+        (r"/test.mjpg", ReplayAPI),
+        (r"/health", Health)
+    ]
+    return tornado.web.Application(handlers)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "--dataset_path",
+        required=True,
+        help="Folder of record_*.json and PNG files written by the record tracker")
+    ap.add_argument(
+        "--port",
+        required=False,
+        help="Server port to use. The default is ffserver's",
+        default=8090)
+    ap.add_argument(
+        "--fps",
+        required=False,
+        help="Frames per second of the original recording. The camera records at 10",
+        default=10.0)
+    ap.add_argument(
+        "--speed",
+        required=False,
+        help="Playback speed multiplier, for example 4 to replay four times faster than real time",
+        default=1.0)
+    ap.add_argument(
+        "--jpeg_quality",
+        required=False,
+        help="JPEG quality of the replayed frames, between 0 and 100",
+        default=95)
+    ap.add_argument(
+        "--max_frames",
+        required=False,
+        help="Optional limit on the number of records to replay",
+        default=None)
+    ap.add_argument(
+        "--once",
+        required=False,
+        help="End the stream after one pass instead of looping",
+        action='store_true')
+    args = vars(ap.parse_args())
+    app = make_app()
+    app.fps = float(args['fps'])
+    app.speed = float(args['speed'])
+    app.is_looping = not args['once']
+    print('{timestamp} - Loading dataset: {dataset_path}'.format(
+        timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"),
+        dataset_path=args['dataset_path']
+    ))
+    max_frames = args['max_frames']
+    app.frames = load_dataset(
+        dataset_path=args['dataset_path'],
+        jpeg_quality=int(args['jpeg_quality']),
+        max_frames=int(max_frames) if max_frames is not None else None
+    )
+    if len(app.frames) == 0:
+        raise ValueError('No images found in {dataset_path}'.format(dataset_path=args['dataset_path']))
+    print('{timestamp} - Replaying {count} frames at {fps} fps'.format(
+        timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"),
+        count=len(app.frames),
+        fps=app.fps * app.speed
+    ))
+    app.listen(int(args['port']))
+    tornado.ioloop.IOLoop.current().start()
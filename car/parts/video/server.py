@@ -1,59 +1,156 @@
+import argparse
 from concurrent.futures import ThreadPoolExecutor
 import contextlib
 import cv2
-import time
+import itertools
 import numpy as np
+import socket
+from threading import Lock
+import time
+import traceback
+# This file runs as a script next to mjpeg.py in the video container
+from mjpeg import CONTENT_TYPE, MjpegDemuxer, make_part_header
+import model_shape
 import urllib.request
 import tornado.gen
 import tornado.ioloop
+import tornado.iostream
+import tornado.locks
 import tornado.web
-import tornado.websocket
 from threading import Thread
 
 
-# This is used to stream video live for the self-driving sessions
-# The syntax is super ugly and I don't understand how it works
-# This is where I got this code from here, which comes with an explanation:
-# https://stackoverflow.com/questions/21702477/how-to-parse-mjpeg-http-stream-from-ip-camera
-def live_video_stream(ip):
+def live_video_stream(source_url):
+    """
+    Yields ffserver's frames exactly as the camera compressed them,
+    without decoding them. Only the /preview stream decodes frames
+    (see VideoCache.publish_previews), and only while it has
+    subscribers
+
+    Parameters
+    ----------
+    source_url : string
+        ffserver's MJPEG stream, or replay_server.py's
+    """
     # The `with` closes the stream
     # https://stackoverflow.com/questions/1522636/should-i-call-close-after-urllib-urlopen
-    with contextlib.closing(urllib.request.urlopen('http://{ip}:8090/test.mjpg'.format(ip=ip))) as stream:
+    with contextlib.closing(urllib.request.urlopen(source_url)) as stream:
+        # The loop ends when ffserver closes the stream
+        for jpg in MjpegDemuxer(stream):
+            # Tornado only writes bytes
+            yield bytes(jpg)
 
-        opencv_bytes = bytes()
+
+class FrameBroadcaster():
+    """
+    Holds the latest JPEG from the camera and its frame id, which
+    VideoCache assigns and which increases with every new frame.
+    Every VideoAPI subscriber
+    waits on the same condition and writes the same bytes, so a
+    frame is never encoded again no matter how many clients are
+    connected. A subscriber only ever asks for the newest frame
+    after it has finished writing the previous one, so a slow
+    client skips frames rather than buffering them. All methods
+    run on the IOLoop's thread
+    """
+
+    def __init__(self):
+        self.jpeg = None
+        self.timestamp = None
+        self.frame_id = 0
+        self.condition = tornado.locks.Condition()
+
+    def publish(self, jpeg, frame_id, timestamp):
         """
-        When the video is streaming well, about 1 of every 15
-        iterations of this loop produces an image. When the
-        video is killed and there is nothing to show, the else
-        part of the loop gets called consecutively indefinitely.
-        I can avoid the zombie threads that take over my entire
-        Tornado server (99% of CPU) if I check a consecutive
-        failure count exceeding some arbitrarily high threshold
+        Parameters
+        ----------
+        jpeg : bytes
+            The new frame
+        frame_id : int
+            The camera frame's id. A preview of the frame has the
+            same id as the frame itself on /video
+        timestamp : float
+            The time.time() when the frame arrived from ffserver,
+            which is as close to capture as the car's clock gets
         """
-        count_threshold = 50
-        consecutive_no_image_count = 0
-        was_available = False
-        while True:
-            opencv_bytes += stream.read(1024)
-            a = opencv_bytes.find(b'\xff\xd8')
-            b = opencv_bytes.find(b'\xff\xd9')
-            if a != -1 and b != -1:
-                jpg = opencv_bytes[a:b + 2]
-                opencv_bytes = opencv_bytes[b + 2:]
-                frame = cv2.imdecode(np.fromstring(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
-                if cv2.waitKey(1) == 27:
-                    exit(0)
-                consecutive_no_image_count = 0
-                was_available = True
-                yield frame
-            else:
-                if was_available:
-                    consecutive_no_image_count = 1
-                else:
-                    consecutive_no_image_count += 1
-                if consecutive_no_image_count > count_threshold:
-                    break
-                was_available = False
+        self.jpeg = jpeg
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.condition.notify_all()
+
+    @tornado.gen.coroutine
+    def wait_for_frame(self, seen_frame_id):
+        """
+        Parameters
+        ----------
+        seen_frame_id : int
+            The id of the last frame the subscriber wrote, or 0 if
+            it hasn't written any
+
+        Returns
+        ----------
+        jpeg : bytes
+            The newest frame
+        frame_id : int
+            The newest frame's id
+        timestamp : float
+            When the newest frame arrived from ffserver
+        """
+        while self.frame_id <= seen_frame_id:
+            yield self.condition.wait()
+        return self.jpeg, self.frame_id, self.timestamp
+
+
+class PreviewBroadcasters():
+    """
+    One FrameBroadcaster per model shape, (image_scale,
+    crop_percent), that at least one PreviewAPI client is
+    watching. VideoCache only decodes and shapes frames while a
+    shape has subscribers, so the preview costs nothing when
+    nobody uses it. Subscriptions change on the IOLoop's thread
+    and are read from VideoCache's thread, hence the lock
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.broadcasters = {}
+        self.subscriber_counts = {}
+
+    def subscribe(self, shape):
+        """
+        Parameters
+        ----------
+        shape : tuple
+            (image_scale, crop_percent)
+
+        Returns
+        ----------
+        broadcaster : FrameBroadcaster
+            Publishes the shape's frames
+        """
+        with self.lock:
+            if shape not in self.broadcasters:
+                self.broadcasters[shape] = FrameBroadcaster()
+                self.subscriber_counts[shape] = 0
+            self.subscriber_counts[shape] += 1
+            return self.broadcasters[shape]
+
+    def unsubscribe(self, shape):
+        with self.lock:
+            self.subscriber_counts[shape] -= 1
+            if self.subscriber_counts[shape] == 0:
+                del self.subscriber_counts[shape]
+                del self.broadcasters[shape]
+
+    def get_shapes(self):
+        """
+        Returns
+        ----------
+        shapes : list<tuple>
+            (shape, broadcaster) pairs for every watched shape
+        """
+        with self.lock:
+            return list(self.broadcasters.items())
 
 
 class VideoAPI(tornado.web.RequestHandler):
@@ -61,40 +158,70 @@ class VideoAPI(tornado.web.RequestHandler):
     Serves a MJPEG of the images posted from the vehicle.
     '''
 
-    @tornado.web.asynchronous
+    # Lets the kernel queue about two frames per client
+    send_buffer_bytes = 64 * 1024
+
     @tornado.gen.coroutine
     def get(self):
+        yield self.stream_frames(self.application.broadcaster)
 
-        ioloop = tornado.ioloop.IOLoop.current()
-        self.set_header("Content-type", "multipart/x-mixed-replace;boundary=--boundarydonotcross")
-
-        self.served_image_timestamp = time.time()
-        my_boundary = "--boundarydonotcross"
+    @tornado.gen.coroutine
+    def stream_frames(self, broadcaster, content_type='image/jpeg'):
+        """
+        The kernel's default send buffer can hold seconds of video,
+        which a slow client would have to watch before it caught up.
+        A small buffer means flush() waits on the client instead,
+        and frames are skipped here
 
-        # TODO: Remove this hardcoded URL
+        Parameters
+        ----------
+        broadcaster : FrameBroadcaster
+            Where the frames come from
+        content_type : string
+            The frames' image type
+        """
+        stream_socket = self.request.connection.stream.socket
+        stream_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_bytes)
+        self.set_header("Content-type", CONTENT_TYPE)
+        frame_id = 0
         while True:
+            jpeg, frame_id, timestamp = yield broadcaster.wait_for_frame(frame_id)
+            # Lets consumers trace each frame to the engine command it produces
+            trace_headers = {
+                'X-Frame-Id': frame_id,
+                'X-Timestamp': repr(timestamp)
+            }
+            self.write(make_part_header(len(jpeg), extra_headers=trace_headers, content_type=content_type))
+            self.write(jpeg)
+            self.write(b'\r\n')
+            try:
+                # Frames that arrive while this waits on a slow client are skipped
+                yield self.flush()
+            except tornado.iostream.StreamClosedError:
+                break
 
-            interval = .1
-            if self.served_image_timestamp + interval < time.time():
-
-                # Can't serve the OpenCV numpy array
-                # Tornando: "... only accepts bytes, unicode, and dict objects" (from Tornado error Traceback)
-                # The result of cv2.imencode is a tuple like: (True, some_image), but I have no idea what True refers to
-                img = cv2.imencode('.jpg', self.application.video_cache.read_cache())[1].tostring()
 
-                # I have no idea what these lines do, but other people seem to use them, they
-                # came with this copied code and I don't want to break something by removing
-                self.write(my_boundary)
-                self.write("Content-type: image/jpeg\r\n")
-                self.write("Content-length: %s\r\n\r\n" % len(img))
-
-                # Serve the image
-                self.write(img)
+class PreviewAPI(VideoAPI):
+    '''
+    Serves the video already cropped, shrunk and contrast
+    normalized the way a model sees it, as a stream of PNGs. Ask
+    for the deployed model's shape with the image_scale and
+    crop_percent from its /model-metadata, for example
+    /preview?image_scale=8&crop_percent=50. See model_shape.py
+    '''
 
-                self.served_image_timestamp = time.time()
-                yield tornado.gen.Task(self.flush)
-            else:
-                yield tornado.gen.Task(ioloop.add_timeout, ioloop.time() + interval)
+    @tornado.gen.coroutine
+    def get(self):
+        shape = (
+            float(self.get_argument('image_scale')),
+            float(self.get_argument('crop_percent'))
+        )
+        previews = self.application.previews
+        broadcaster = previews.subscribe(shape)
+        try:
+            yield self.stream_frames(broadcaster, content_type=model_shape.CONTENT_TYPE)
+        finally:
+            previews.unsubscribe(shape)
 
 
 class Health(tornado.web.RequestHandler):
@@ -116,28 +243,86 @@ class Health(tornado.web.RequestHandler):
 def make_app():
     handlers = [
         (r"/video", VideoAPI),
+        (r"/preview", PreviewAPI),
         (r"/health", Health)
     ]
     return tornado.web.Application(handlers)
 
 class VideoCache():
 
-    def __init__(self):
-        self.frame = None
+    def __init__(self, broadcaster, ioloop, source_url='http://localhost:8090/test.mjpg', previews=None, retry_seconds=1):
+        """
+        Reads ffserver's stream in a thread of its own and hands
+        each frame to the broadcaster on the IOLoop
+
+        Parameters
+        ----------
+        broadcaster : FrameBroadcaster
+            Fans frames out to the VideoAPI subscribers
+        ioloop : tornado.ioloop.IOLoop
+            The server's IOLoop
+        source_url : string
+            Where the camera's MJPEG stream comes from
+        previews : PreviewBroadcasters
+            Optional model-shaped streams to feed
+        retry_seconds : float
+            How long to wait before reopening the stream after
+            ffserver closes it or can't be reached
+        """
+        self.broadcaster = broadcaster
+        self.ioloop = ioloop
+        self.source_url = source_url
+        self.previews = previews
+        self.retry_seconds = retry_seconds
+        # Starts at 1 because subscribers that haven't seen a frame yet wait for ids above 0
+        self.frame_ids = itertools.count(1)
         self.t = Thread(target=self.write_cache, args=())
         self.t.daemon = True
         self.t.start()
 
     def write_cache(self):
-        for frame in live_video_stream('localhost'):
-            self.frame = frame
+        while True:
+            try:
+                for jpeg in live_video_stream(self.source_url):
+                    timestamp = time.time()
+                    # Numbered here, so that the frame and its previews share an id across stream restarts
+                    frame_id = next(self.frame_ids)
+                    # add_callback() is the only IOLoop method that's safe to call from another thread
+                    self.ioloop.add_callback(self.broadcaster.publish, jpeg, frame_id, timestamp)
+                    self.publish_previews(jpeg, frame_id, timestamp)
+            except:
+                traceback.print_exc()
+            time.sleep(self.retry_seconds)
 
-    def read_cache(self):
-        return self.frame
+    def publish_previews(self, jpeg, frame_id, timestamp):
+        if self.previews is None:
+            return
+        shapes = self.previews.get_shapes()
+        if len(shapes) == 0:
+            return
+        # Decoded once no matter how many shapes are watched
+        image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        for (image_scale, crop_percent), broadcaster in shapes:
+            png = model_shape.encode_for_model(image, image_scale, crop_percent)
+            self.ioloop.add_callback(broadcaster.publish, png, frame_id, timestamp)
 
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "--source_url",
+        required=False,
+        help="The camera's MJPEG stream. Point this at replay_server.py to replay a dataset from another host",
+        default='http://localhost:8090/test.mjpg')
+    args = vars(ap.parse_args())
     app = make_app()
-    app.video_cache = VideoCache()
+    app.broadcaster = FrameBroadcaster()
+    app.previews = PreviewBroadcasters()
+    app.video_cache = VideoCache(
+        broadcaster=app.broadcaster,
+        ioloop=tornado.ioloop.IOLoop.current(),
+        source_url=args['source_url'],
+        previews=app.previews
+    )
     app.listen(8091)
     tornado.ioloop.IOLoop.current().start()
@@ -0,0 +1,95 @@
+import argparse
+import cv2
+import io
+import numpy as np
+import time
+from car.parts.video.mjpeg import MjpegDemuxer
+
+
+"""
+Measures frames per second and CPU time per frame of the MJPEG
+demuxer against the parsing loop that every video consumer used
+to copy and paste. Both parse the same in-memory stream, so the
+numbers only include parsing, not the network or JPEG decoding.
+
+Example:
+    export PYTHONPATH=$PYTHONPATH:/Users/ryanzotti/Documents/repos/Self-Driving-Car
+    python car/parts/video/tests/benchmark_mjpeg.py --frames 500 --width 640 --height 480
+"""
+
+
+def make_jpeg(width, height):
+    # Noise compresses badly, which gives realistically large frames
+    image = np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)
+    image = cv2.GaussianBlur(image, (9, 9), 0)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def make_stream_bytes(jpeg, frame_count, has_content_length):
+    parts = []
+    for _ in range(frame_count):
+        parts.append(b'--boundarydonotcross\r\n')
+        parts.append(b'Content-type: image/jpeg\r\n')
+        if has_content_length:
+            parts.append('Content-length: {length}\r\n'.format(length=len(jpeg)).encode())
+        parts.append(b'\r\n')
+        parts.append(jpeg)
+        parts.append(b'\r\n')
+    return b''.join(parts)
+
+
+def legacy_frames(stream):
+    # The old parsing loop, minus the decode
+    opencv_bytes = bytes()
+    while True:
+        chunk = stream.read(1024)
+        if not chunk:
+            return
+        opencv_bytes += chunk
+        a = opencv_bytes.find(b'\xff\xd8')
+        b = opencv_bytes.find(b'\xff\xd9')
+        if a != -1 and b != -1:
+            jpg = opencv_bytes[a:b + 2]
+            opencv_bytes = opencv_bytes[b + 2:]
+            yield jpg
+
+
+def benchmark(name, frames, frame_count):
+    wall_start_seconds = time.perf_counter()
+    cpu_start_seconds = time.process_time()
+    count = 0
+    for _ in frames:
+        count += 1
+    cpu_seconds = time.process_time() - cpu_start_seconds
+    wall_seconds = time.perf_counter() - wall_start_seconds
+    return {
+        'parser': name,
+        'frames': count,
+        'frames_per_second': round(count / wall_seconds, 1),
+        'cpu_us_per_frame': round(cpu_seconds / max(count, 1) * 1000000.0, 1)
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--frames", required=False, help="Number of frames in the stream", default=500)
+    ap.add_argument("--width", required=False, help="Frame width", default=640)
+    ap.add_argument("--height", required=False, help="Frame height", default=480)
+    args = vars(ap.parse_args())
+    frame_count = int(args['frames'])
+    jpeg = make_jpeg(width=int(args['width']), height=int(args['height']))
+    print('JPEG size: {size} bytes'.format(size=len(jpeg)))
+
+    stream_bytes = make_stream_bytes(jpeg, frame_count, has_content_length=True)
+    marker_only_stream_bytes = make_stream_bytes(jpeg, frame_count, has_content_length=False)
+    results = [
+        benchmark('legacy', legacy_frames(io.BytesIO(stream_bytes)), frame_count),
+        benchmark('demuxer', MjpegDemuxer(io.BytesIO(stream_bytes)), frame_count),
+        benchmark('demuxer without Content-length', MjpegDemuxer(io.BytesIO(marker_only_stream_bytes)), frame_count)
+    ]
+    for result in results:
+        print(result)
+
+    # Every parser must produce the exact same frames
+    for frames in [MjpegDemuxer(io.BytesIO(stream_bytes)), MjpegDemuxer(io.BytesIO(marker_only_stream_bytes))]:
+        assert all(frame == jpeg for frame in frames)
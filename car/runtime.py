@@ -0,0 +1,125 @@
+import asyncio
+from datetime import datetime
+from threading import Thread
+
+
+class ThreadedRuntime:
+    """
+    The original runtime: every part runs its own infinite_loop()
+    in its own thread with its own requests.Session
+    """
+
+    name = 'threaded'
+
+    def start(self, parts):
+        """
+        Parameters
+        ----------
+        parts : list<Part>
+            The parts whose client loops should start running
+        """
+        for part in parts:
+            part.start()
+
+
+class AsyncioRuntime:
+    """
+    Runs every part's client loop as a coroutine on a single
+    event loop in a single thread, with one pooled aiohttp
+    session shared by all parts. On the Pi this replaces seven or
+    more OS threads fighting over the GIL with one
+    """
+
+    name = 'asyncio'
+
+    def __init__(self, connection_limit=32, connection_limit_per_host=4):
+        """
+        Parameters
+        ----------
+        connection_limit : int
+            Max number of open connections across all parts
+        connection_limit_per_host : int
+            Max number of open connections to any single host and
+            port. Each part only ever has one request in flight,
+            except the record tracker, which sends its image and
+            labels concurrently
+        """
+        self.connection_limit = connection_limit
+        self.connection_limit_per_host = connection_limit_per_host
+        self.event_loop = None
+        self.thread = None
+
+    def start(self, parts):
+        """
+        Parameters
+        ----------
+        parts : list<Part>
+            The parts whose client loops should start running
+        """
+        self.thread = Thread(target=self.run, args=(list(parts),))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, parts):
+        self.event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.event_loop)
+        print('{timestamp} - Starting asyncio runtime for {count} parts'.format(
+            timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"),
+            count=len(parts)
+        ))
+        self.event_loop.run_until_complete(self.run_parts(parts))
+
+    async def run_parts(self, parts):
+        """
+        aiohttp is imported here rather than at the top of the
+        file so that the threaded runtime keeps working on images
+        that don't have aiohttp installed
+        """
+        import aiohttp
+
+        for part in parts:
+            part.async_wake_event = asyncio.Event()
+            part.event_loop = self.event_loop
+            # Catch up on any wake-ups that happened before the handoff
+            part.async_wake_event.set()
+
+        connector = aiohttp.TCPConnector(
+            limit=self.connection_limit,
+            limit_per_host=self.connection_limit_per_host
+        )
+        async with aiohttp.ClientSession(connector=connector) as shared_session:
+            # Unix socket parts need a connector of their own
+            sessions = []
+            for part in parts:
+                session = part.transport.make_async_session(part)
+                sessions.append(session if session is not None else shared_session)
+            try:
+                await asyncio.gather(*[part.infinite_loop_async(session) for part, session in zip(parts, sessions)])
+            finally:
+                for session in sessions:
+                    if session is not shared_session:
+                        await session.close()
+
+
+def make_runtime(name):
+    """
+    Parameters
+    ----------
+    name : string
+        Either "threaded" or "asyncio"
+
+    Returns
+    ----------
+    runtime : ThreadedRuntime or AsyncioRuntime
+        The runtime that Vehicle.py uses to start its parts
+    """
+    runtimes = {
+        ThreadedRuntime.name: ThreadedRuntime,
+        AsyncioRuntime.name: AsyncioRuntime
+    }
+    if name not in runtimes:
+        raise ValueError('Unknown part runtime: {name}. Choose one of {names}'.format(
+            name=name,
+            names=sorted(runtimes.keys())
+        ))
+    return runtimes[name]()
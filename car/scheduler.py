@@ -0,0 +1,115 @@
+import time
+
+
+class FixedRateScheduler:
+    """
+    Paces the drive loop on a fixed grid of monotonic deadlines.
+    Each deadline is computed from the previous deadline rather
+    than from when the previous tick finished, so small delays
+    don't accumulate into drift. What happens after a tick
+    overruns its deadline is decided by the overrun policy:
+
+    skip
+        Drop the ticks that were missed and wait for the next
+        deadline on the original grid
+    catch_up
+        Run the missed ticks back to back until the loop is on
+        schedule again. If the loop falls more than
+        max_catch_up_ticks behind, the grid is reset instead so
+        that one long stall doesn't cause a burst of ticks
+    degrade
+        Like skip, but also mark the loop as degraded so that
+        Vehicle.py drops non-critical parts, like memory
+        publishing, until the loop has been on time for
+        recovery_ticks ticks in a row
+    """
+
+    SKIP = 'skip'
+    CATCH_UP = 'catch_up'
+    DEGRADE = 'degrade'
+    overrun_policies = [SKIP, CATCH_UP, DEGRADE]
+
+    def __init__(self, rate_hz, overrun_policy='skip', metrics=None, max_catch_up_ticks=5, recovery_ticks=20):
+        """
+        Parameters
+        ----------
+        rate_hz : float
+            The drive loop's target frequency
+        overrun_policy : string
+            One of skip, catch_up or degrade
+        metrics : Metrics
+            Optional metrics that deadline misses, lateness and
+            sleep slack are recorded into
+        max_catch_up_ticks : int
+            The most ticks the catch_up policy will try to make up
+        recovery_ticks : int
+            Number of consecutive on-time ticks after which the
+            degrade policy restores non-critical parts
+        """
+        if overrun_policy not in self.overrun_policies:
+            raise ValueError('Unknown overrun policy: {policy}. Choose one of {policies}'.format(
+                policy=overrun_policy,
+                policies=self.overrun_policies
+            ))
+        self.period_seconds = 1.0 / rate_hz
+        self.overrun_policy = overrun_policy
+        self.metrics = metrics
+        self.max_catch_up_ticks = max_catch_up_ticks
+        self.recovery_ticks = recovery_ticks
+        self.next_deadline = None
+        self.is_degraded = False
+        self.consecutive_on_time_ticks = 0
+
+    def start(self):
+        """
+        Starts the grid. The first tick runs immediately
+        """
+        self.next_deadline = time.monotonic()
+
+    def wait_for_next_tick(self):
+        """
+        Blocks until the next tick should start. Call this once
+        at the end of every tick
+        """
+        self.next_deadline += self.period_seconds
+        now = time.monotonic()
+        lateness_seconds = now - self.next_deadline
+        if lateness_seconds <= 0.0:
+            self.on_time()
+            sleep_seconds = -lateness_seconds
+            self.record('sleep_slack_seconds', sleep_seconds)
+            time.sleep(sleep_seconds)
+        else:
+            self.overrun(now, lateness_seconds)
+
+    def on_time(self):
+        self.consecutive_on_time_ticks += 1
+        if self.is_degraded and self.consecutive_on_time_ticks >= self.recovery_ticks:
+            self.is_degraded = False
+
+    def overrun(self, now, lateness_seconds):
+        self.consecutive_on_time_ticks = 0
+        if self.metrics is not None:
+            self.metrics.increment('deadline_misses')
+        self.record('deadline_lateness_seconds', lateness_seconds)
+
+        # Number of whole deadlines that have already passed
+        missed_ticks = int(lateness_seconds // self.period_seconds) + 1
+        if self.overrun_policy == self.CATCH_UP and missed_ticks <= self.max_catch_up_ticks:
+            # Start the next tick now and keep the original grid
+            return
+        if self.overrun_policy == self.CATCH_UP:
+            # Too far behind to catch up, so start a new grid
+            self.next_deadline = now
+            return
+        if self.overrun_policy == self.DEGRADE:
+            self.is_degraded = True
+        # Skip to the next deadline on the original grid
+        if self.metrics is not None:
+            self.metrics.increment('skipped_ticks', missed_ticks)
+        self.next_deadline += missed_ticks * self.period_seconds
+        time.sleep(self.next_deadline - now)
+
+    def record(self, name, seconds):
+        if self.metrics is not None:
+            self.metrics.record(name, seconds)
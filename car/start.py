@@ -1,7 +1,9 @@
 import argparse
 from car.config import load_config
 from car.vehicle import Vehicle
-from car.Memory import Memory
+from car.memory import Memory
+from car.transports import make_transport
+from car.worker import ProcessPart
 from car.parts.video.client import Client as Camera
 from car.parts.user_input.client import Client as UserInput
 from car.parts.engine.client import Client as Engine
@@ -35,6 +37,13 @@ ap.add_argument(
     dest='is_localhost',
     help="Indicates if control-loop clients should expect part services on localhost or named Docker container"
 )
+ap.add_argument(
+    "--runtime",
+    required=False,
+    choices=['threaded', 'asyncio'],
+    help="Run part clients in their own threads or as coroutines on one event loop",
+    default='threaded'
+)
 
 part_names = [
     "video",
@@ -74,14 +83,36 @@ memory.put(['vehicle/brake'], True)
 car = Vehicle(
     mem=memory,
     warm_up_seconds=cfg.WARM_UP_SECONDS,
-    port=port
+    port=port,
+    runtime=args['runtime']
 )
 
+
+def make_part(part_class, **kwargs):
+    """
+    Creates the part in the control loop's process, or in a
+    worker process if the config lists it in WORKER_PROCESS_PARTS
+    """
+    if kwargs['name'] in cfg.WORKER_PROCESS_PARTS:
+        return ProcessPart(part_class, kwargs)
+    return part_class(**kwargs)
+
+
+# Co-located Pi parts can skip TCP. See car/transports.py
+engine_transport = make_transport(cfg.PART_TRANSPORT, socket_directory=cfg.PART_SOCKET_DIRECTORY)
+if engine_transport.is_in_process:
+    # Other containers read the memory server, so it must keep running
+    memory_transport = make_transport('http')
+else:
+    memory_transport = engine_transport
+
 # Consume video from a cheap webcam
-camera = Camera(
+camera = make_part(
+    Camera,
     name='video',
     output_names=[
-        'camera/image_array'
+        'camera/frame',
+        'camera/jpeg'
     ],
     is_localhost=is_localhost,
     is_verbose=args['verbose-video']
@@ -95,10 +126,13 @@ user_input = UserInput(
         'dashboard/brake',
         'dashboard/driver_type',
         'dashboard/model_constant_throttle',
-        'remote_model/angle'
+        'remote_model/angle',
+        'remote_model/frame_id',
+        'remote_model/frame_timestamp'
     ],
     is_localhost=is_localhost,
-    is_verbose=args['verbose-user-input']
+    is_verbose=args['verbose-user-input'],
+    rate_hz=cfg.POLLING_PART_HZ
 )
 car.add(user_input)
 
@@ -110,16 +144,21 @@ engine = Engine(
         'dashboard/driver_type',
         'dashboard/model_constant_throttle',
         'local_model/angle',
+        'local_model/frame_id',
+        'local_model/frame_timestamp',
         'local_model/throttle',
         'ps3_controller/angle',
         'ps3_controller/brake',
         'ps3_controller/throttle',
         'remote_model/angle',
+        'remote_model/frame_id',
+        'remote_model/frame_timestamp',
         'remote_model/throttle',
         'vehicle/brake'
     ],
     is_localhost=is_localhost,
-    is_verbose=args['verbose-engine']
+    is_verbose=args['verbose-engine'],
+    transport=engine_transport
 )
 car.add(engine)
 
@@ -141,21 +180,26 @@ memoryClient = MemoryClient(
         'vehicle/brake'
     ],
     is_localhost=is_localhost,
-    is_verbose=args['verbose-memory']
+    is_verbose=args['verbose-memory'],
+    transport=memory_transport
 )
 car.add(memoryClient)
 
 # Optionally consume driving predictions from a local model
-local_model = Model(
+local_model = make_part(
+    Model,
     name='local-model',
     input_names=[
-        'camera/image_array',
+        'camera/frame',
         'dashboard/driver_type'
     ],
     output_names=[
-        'local_model/angle'
+        'local_model/angle',
+        'local_model/frame_id',
+        'local_model/frame_timestamp'
     ],
     is_localhost=is_localhost,
+    is_model_shaped=cfg.MODEL_SHAPED_FRAMES,
     is_verbose=args['verbose-local-model']
 )
 
@@ -177,7 +221,8 @@ ps3_controller = PS3Controller(
         'ps3_controller/recording'
     ],
     is_localhost=is_localhost,
-    is_verbose=args['verbose-ps3-controller']
+    is_verbose=args['verbose-ps3-controller'],
+    rate_hz=cfg.POLLING_PART_HZ
 )
 car.add(ps3_controller)
 
@@ -192,7 +237,7 @@ names are hard coded there
 record_tracker = RecordTracker(
     name='record-tracker',
     input_names=[
-        'camera/image_array',
+        'camera/jpeg',
         'ps3_controller/angle',
         'ps3_controller/recording',
         'ps3_controller/throttle'
@@ -210,5 +255,6 @@ car.add(record_tracker)
 
 car.start(
     rate_hz=cfg.DRIVE_LOOP_HZ,
-    max_loop_count=cfg.MAX_LOOPS
+    max_loop_count=cfg.MAX_LOOPS,
+    overrun_policy=cfg.DRIVE_LOOP_OVERRUN_POLICY
 )
@@ -37,6 +37,37 @@ MODELS_PATH = os.path.join(CAR_PATH, 'model')
 DRIVE_LOOP_HZ = 20
 MAX_LOOPS = 100000
 
+# Max rate at which parts that poll their servers (user input, PS3
+# controller) call request(). There is no point in polling much
+# faster than the drive loop can consume the results
+POLLING_PART_HZ = DRIVE_LOOP_HZ * 2
+
+# What the drive loop does after a tick overruns its deadline: skip,
+# catch_up or degrade (skip and drop non-critical parts until the
+# loop is back on time). See car/scheduler.py
+DRIVE_LOOP_OVERRUN_POLICY = 'degrade'
+
+# How the control loop reaches the engine and memory servers on the
+# Pi: http, unix (sockets in PART_SOCKET_DIRECTORY, which must be
+# mounted into the containers) or in_process (engine only, the memory
+# server stays on HTTP). See car/transports.py
+PART_TRANSPORT = 'http'
+PART_SOCKET_DIRECTORY = '/tmp/car-sockets'
+
+# Part clients that run in worker processes of their own instead of
+# threads in the control loop's process, for example ['video'] so
+# that JPEG decoding doesn't compete with the drive loop for the GIL.
+# Frames come back through shared memory. See car/worker.py
+WORKER_PROCESS_PARTS = []
+
+# Send the model server frames that are already cropped, shrunk and
+# contrast normalized for the deployed model, instead of full JPEGs.
+# Cuts the bytes per prediction by roughly image_scale^2, so it pays
+# off at an image_scale of 4 and up. The shaped frames are PNGs, so
+# the only difference from the server doing the work is rounding.
+# See car/parts/video/model_shape.py
+MODEL_SHAPED_FRAMES = False
+
 #CAMERA
 CAMERA_RESOLUTION = (120, 160) #(height, width)
 CAMERA_FRAMERATE = DRIVE_LOOP_HZ
@@ -0,0 +1,177 @@
+import argparse
+import asyncio
+from multiprocessing import Process, Queue
+import statistics
+from threading import Thread
+import time
+import tornado.ioloop
+import tornado.web
+from car.memory import Memory
+from car.vehicle import Vehicle
+from car.parts.engine.client import Client as Engine
+from car.parts.memory.client import Client as MemoryClient
+from car.parts.ps3_controller.client import Client as PS3Controller
+from car.parts.user_input.client import Client as UserInput
+
+
+"""
+Compares the threaded and asyncio part runtimes side by side.
+Each runtime drives the engine, memory, user input and PS3
+controller clients against a stub server for the same number of
+drive loop ticks, in its own process so that neither run's
+threads leak into the other's numbers.
+
+Example:
+    export PYTHONPATH=$PYTHONPATH:/Users/ryanzotti/Documents/repos/Self-Driving-Car
+    python car/tests/benchmark_runtimes.py --rate_hz 20 --loops 400
+"""
+
+user_input_names = [
+    'dashboard/brake',
+    'dashboard/driver_type',
+    'dashboard/model_constant_throttle',
+    'remote_model/angle'
+]
+ps3_controller_names = [
+    'ps3_controller/angle',
+    'ps3_controller/brake',
+    'ps3_controller/throttle',
+    'ps3_controller/recording'
+]
+engine_input_names = [
+    'dashboard/brake',
+    'dashboard/driver_type',
+    'dashboard/model_constant_throttle',
+    'ps3_controller/angle',
+    'ps3_controller/brake',
+    'ps3_controller/throttle',
+    'remote_model/angle',
+    'vehicle/brake'
+]
+
+
+class Command(tornado.web.RequestHandler):
+    def post(self):
+        self.write({})
+
+
+class UserInputState(tornado.web.RequestHandler):
+    def get(self):
+        self.write({
+            'dashboard/brake': False,
+            'dashboard/driver_type': 'user',
+            'dashboard/model_constant_throttle': 0.0,
+            'remote_model/angle': 0.0
+        })
+
+
+class PS3State(tornado.web.RequestHandler):
+    def post(self):
+        self.write({
+            'ps3_controller/angle': 0.0,
+            'ps3_controller/brake': False,
+            'ps3_controller/throttle': 0.0,
+            'ps3_controller/recording': False
+        })
+
+
+def start_stub_server(port):
+    def run():
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        app = tornado.web.Application([
+            (r"/command", Command),
+            (r"/update", Command),
+            (r"/get-input", UserInputState),
+            (r"/get-state", PS3State)
+        ])
+        app.listen(port)
+        tornado.ioloop.IOLoop.current().start()
+    thread = Thread(target=run, args=())
+    thread.daemon = True
+    thread.start()
+
+
+def run_vehicle(runtime, stub_port, vehicle_port, rate_hz, loops, results):
+    memory = Memory()
+    memory.put(['vehicle/brake'], False)
+    vehicle = Vehicle(
+        mem=memory,
+        warm_up_seconds=1,
+        port=vehicle_port,
+        runtime=runtime
+    )
+    vehicle.add(UserInput(name='user-input', output_names=user_input_names, is_localhost=True, port=stub_port, rate_hz=rate_hz * 2))
+    vehicle.add(PS3Controller(name='ps3-controller', output_names=ps3_controller_names, is_localhost=True, port=stub_port, rate_hz=rate_hz * 2))
+    vehicle.add(Engine(name='engine', input_names=engine_input_names, is_localhost=True, port=stub_port))
+    vehicle.add(MemoryClient(name='memory', input_names=engine_input_names, is_localhost=True, port=stub_port))
+
+    # Record when each tick actually starts to measure jitter
+    tick_times = []
+    part_loop = vehicle.part_loop
+
+    def timed_part_loop():
+        tick_times.append(time.monotonic())
+        part_loop()
+
+    vehicle.part_loop = timed_part_loop
+
+    cpu_start_seconds = time.process_time()
+    wall_start_seconds = time.monotonic()
+    vehicle.start(rate_hz=rate_hz, max_loop_count=loops)
+    cpu_seconds = time.process_time() - cpu_start_seconds
+    wall_seconds = time.monotonic() - wall_start_seconds - vehicle.warm_up_seconds
+
+    target_seconds = 1.0 / rate_hz
+    jitters_ms = [abs((b - a) - target_seconds) * 1000.0 for a, b in zip(tick_times, tick_times[1:])]
+    jitters_ms.sort()
+    engine_summary = vehicle.parts['engine'].metrics.summarize()['histograms'].get('request_seconds', {})
+    results.put({
+        'runtime': runtime,
+        'ticks': len(tick_times),
+        'cpu_percent': 100.0 * cpu_seconds / wall_seconds,
+        'jitter_mean_ms': statistics.mean(jitters_ms),
+        'jitter_p99_ms': jitters_ms[int(len(jitters_ms) * 0.99) - 1],
+        'engine_request_p50_ms': engine_summary.get('p50_ms'),
+        'engine_request_p99_ms': engine_summary.get('p99_ms')
+    })
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "--rate_hz",
+        required=False,
+        help="Drive loop frequency",
+        default=20
+    )
+    ap.add_argument(
+        "--loops",
+        required=False,
+        help="Number of drive loop ticks per runtime",
+        default=400
+    )
+    ap.add_argument(
+        "--port",
+        required=False,
+        help="Port for the stub part server",
+        default=8191
+    )
+    args = vars(ap.parse_args())
+    rate_hz = int(args['rate_hz'])
+    loops = int(args['loops'])
+    stub_port = int(args['port'])
+
+    start_stub_server(stub_port)
+    results = Queue()
+    for i, runtime in enumerate(['threaded', 'asyncio']):
+        process = Process(
+            target=run_vehicle,
+            args=(runtime, stub_port, stub_port + 1 + i, rate_hz, loops, results)
+        )
+        process.start()
+        result = results.get()
+        process.join(timeout=5)
+        if process.is_alive():
+            # Part loops never exit on their own
+            process.terminate()
+        print(result)
@@ -0,0 +1,243 @@
+import json
+import os
+import socket
+import traceback
+from urllib.parse import urlparse
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
+
+"""
+A transport decides how a part's client reaches its server. The
+part's request() always talks to self.session and self.endpoint,
+so switching transports never requires changing a part. Each
+transport mounts a different requests adapter on the part's
+session instead:
+
+http
+    A TCP connection to host:port, which is how every part has
+    always worked
+unix
+    A Unix domain socket in a directory that is mounted into the
+    part's container and the control loop's container. It skips
+    TCP on the loopback hop, but keeps HTTP so the server code
+    stays the same
+in_process
+    Calls the server's handler functions directly, with no socket
+    and no HTTP parsing. Only works if the server code can be
+    imported into the control loop, and only for parts that define
+    get_in_process_handlers()
+"""
+
+
+class UnixSocketConnection(HTTPConnection):
+    """
+    An HTTP connection that connects to a Unix domain socket
+    instead of a TCP host and port
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.socket_path = kwargs.pop('socket_path')
+        super().__init__(*args, **kwargs)
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        return sock
+
+
+class UnixSocketConnectionPool(HTTPConnectionPool):
+
+    ConnectionCls = UnixSocketConnection
+
+    def __init__(self, socket_path, maxsize=1):
+        super().__init__('localhost', maxsize=maxsize, socket_path=socket_path)
+
+
+class UnixSocketAdapter(HTTPAdapter):
+    """
+    Sends every request on the session to one Unix domain socket,
+    regardless of the host in the URL
+    """
+
+    def __init__(self, socket_path, **kwargs):
+        self.pool = UnixSocketConnectionPool(socket_path)
+        super().__init__(**kwargs)
+
+    def get_connection(self, url, proxies=None):
+        return self.pool
+
+    # Newer versions of requests call this instead of get_connection()
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self.pool
+
+    def close(self):
+        super().close()
+        self.pool.close()
+
+
+class InProcessAdapter(BaseAdapter):
+    """
+    Answers requests by calling the server's handler functions in
+    the caller's thread. A handler receives the request body and
+    returns a dictionary, which is returned as JSON just like the
+    Tornado handlers would
+    """
+
+    def __init__(self, handlers, is_verbose=False):
+        """
+        Parameters
+        ----------
+        handlers : dict
+            Maps a url path, like /command, to a function that
+            takes the request body and returns a dictionary
+        is_verbose : boolean
+            Indicates whether to print handler stack traces
+        """
+        super().__init__()
+        self.handlers = handlers
+        self.is_verbose = is_verbose
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.encoding = 'utf-8'
+        response.headers['Content-Type'] = 'application/json; charset=UTF-8'
+        handler = self.handlers.get(urlparse(request.url).path)
+        if handler is None:
+            response.status_code = 404
+            response._content = b'{}'
+            return response
+        try:
+            result = handler(request.body)
+            response.status_code = 200
+            response._content = json.dumps(result).encode('utf-8')
+        except:
+            # Tornado would have answered with a 500 too
+            if self.is_verbose:
+                traceback.print_exc()
+            response.status_code = 500
+            response._content = b'{}'
+        return response
+
+    def close(self):
+        pass
+
+
+class HttpTransport:
+
+    name = 'http'
+    is_in_process = False
+
+    def make_session(self, part):
+        """
+        Use a session to keep open a long-lived connection.
+        In my experience this significantly reduces latency
+        and CPU usage. You can see details about HTTPAdapeters
+        in the link below
+        https://laike9m.com/blog/requests-secret-pool_connections-and-pool_maxsize,89/
+        """
+        session = requests.Session()
+        session.mount('http://', HTTPAdapter(pool_connections=1))
+        return session
+
+    def make_async_session(self, part):
+        """
+        Returns
+        ----------
+        session : aiohttp.ClientSession
+            A session for the asyncio runtime, or None to use the
+            runtime's shared session
+        """
+        return None
+
+
+class UnixSocketTransport:
+
+    name = 'unix'
+    is_in_process = False
+
+    def __init__(self, socket_directory):
+        """
+        Parameters
+        ----------
+        socket_directory : string
+            The directory, mounted into every container involved,
+            where part servers create their sockets. A part's
+            socket is named after the part, like engine.sock
+        """
+        self.socket_directory = socket_directory
+
+    def get_socket_path(self, part):
+        return os.path.join(self.socket_directory, '{name}.sock'.format(name=part.name))
+
+    def make_session(self, part):
+        session = requests.Session()
+        session.mount('http://', UnixSocketAdapter(self.get_socket_path(part)))
+        return session
+
+    def make_async_session(self, part):
+        import aiohttp
+        connector = aiohttp.UnixConnector(path=self.get_socket_path(part))
+        return aiohttp.ClientSession(connector=connector)
+
+
+class InProcessTransport:
+
+    name = 'in_process'
+    is_in_process = True
+
+    def __init__(self, handlers=None):
+        """
+        Parameters
+        ----------
+        handlers : dict
+            Optional url path to handler function mapping. If not
+            given, the part's get_in_process_handlers() is used
+        """
+        self.handlers = handlers
+
+    def make_session(self, part):
+        handlers = self.handlers
+        if handlers is None:
+            handlers = part.get_in_process_handlers()
+        session = requests.Session()
+        session.mount('http://', InProcessAdapter(handlers, is_verbose=part.is_verbose))
+        return session
+
+    def make_async_session(self, part):
+        return None
+
+
+def make_transport(name, socket_directory=None):
+    """
+    Parameters
+    ----------
+    name : string
+        One of http, unix or in_process
+    socket_directory : string
+        Where the part servers' Unix domain sockets live. Only
+        used by the unix transport
+
+    Returns
+    ----------
+    transport : HttpTransport, UnixSocketTransport or InProcessTransport
+    """
+    if name == HttpTransport.name:
+        return HttpTransport()
+    elif name == UnixSocketTransport.name:
+        return UnixSocketTransport(socket_directory=socket_directory)
+    elif name == InProcessTransport.name:
+        return InProcessTransport()
+    raise ValueError('Unknown part transport: {name}. Choose one of {names}'.format(
+        name=name,
+        names=transport_names
+    ))
+
+
+transport_names = [HttpTransport.name, UnixSocketTransport.name, InProcessTransport.name]
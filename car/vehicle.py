@@ -8,21 +8,46 @@ import tornado.concurrent
 import tornado.gen
 import tornado.ioloop
 import tornado.web
-from .Memory import Memory
+from .memory import Memory
+from .metrics import Metrics
+from .runtime import make_runtime
+from .scheduler import FixedRateScheduler
 from datetime import datetime
 
 
 class Vehicle():
-    def __init__(self, warm_up_seconds, port, mem=None):
+    def __init__(self, warm_up_seconds, port, mem=None, runtime='threaded'):
 
         if not mem:
             mem = Memory()
         self.mem = mem
         self.parts = OrderedDict()
+        self.scheduler = None
+
+        """
+        Parts grouped by their position in the dataflow graph
+        implied by their input and output names. part_loop() runs
+        the levels in order, so every part reads inputs that the
+        parts producing them have already written this tick. Parts
+        run inline rather than on a thread pool, because every
+        part's call() only swaps inputs and outputs while its own
+        thread or worker process does the slow requests
+        """
+        self.part_levels = []
+
+        # Memory key of the camera's latest frame
+        self.camera_key = 'camera/frame'
         self.on = True
         self.warm_up_seconds = warm_up_seconds
         self.port = port
 
+        # Decides whether parts run in their own threads or as
+        # coroutines on a shared event loop. See runtime.py
+        self.runtime = make_runtime(runtime)
+
+        # Drive loop timings served on /metrics next to each part's
+        self.metrics = Metrics()
+
         """
         The UI will ping this server's health check when
         the contorl-loop is dockerized and running on the
@@ -33,8 +58,23 @@ class Vehicle():
         self.microservice_thread.daemon = True
         self.microservice_thread.start()
 
+    def get_metrics(self):
+        """
+        Returns
+        ----------
+        metrics : dict
+            p50/p95/p99 summaries of the drive loop's timings and
+            of every part's call and request timings
+        """
+        result = {
+            'vehicle': self.metrics.summarize(),
+            'parts': {name: part.metrics.summarize() for name, part in self.parts.items()}
+        }
+        return result
+
     def start_microservice(self, port):
         asyncio.set_event_loop(asyncio.new_event_loop())
+        vehicle = self
 
         class Health(tornado.web.RequestHandler):
             executor = ThreadPoolExecutor(5)
@@ -51,7 +91,22 @@ class Vehicle():
                 result = yield self.is_healthy()
                 self.write(result)
 
-        self.microservice = tornado.web.Application([(r"/health", Health)])
+        class MetricsAPI(tornado.web.RequestHandler):
+            executor = ThreadPoolExecutor(5)
+
+            @tornado.concurrent.run_on_executor
+            def get_metrics(self):
+                return vehicle.get_metrics()
+
+            @tornado.gen.coroutine
+            def get(self):
+                result = yield self.get_metrics()
+                self.write(result)
+
+        self.microservice = tornado.web.Application([
+            (r"/health", Health),
+            (r"/metrics", MetricsAPI)
+        ])
         self.microservice.listen(port)
         tornado.ioloop.IOLoop.current().start()
 
@@ -69,8 +124,49 @@ class Vehicle():
             timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
         ))
         self.parts[name] = part
+        self.part_levels = self.build_part_levels()
 
-    def start(self, rate_hz=10, max_loop_count=None):
+    def build_part_levels(self):
+        """
+        Orders the parts topologically based on which part
+        produces each of another part's inputs. Inputs that no
+        part produces, like vehicle/brake which the vehicle sets
+        itself, don't create dependencies. If the wiring ever
+        contains a cycle, I break it by running the part that was
+        added first, so it reads the previous tick's values just
+        like it would have in the old insertion-order loop
+
+        Returns
+        ----------
+        levels : list<list<string>>
+            Part names grouped into levels that only depend on
+            earlier levels
+        """
+        producers = {}
+        for name, part in self.parts.items():
+            for output_name in part.output_names or []:
+                producers[output_name] = name
+
+        dependencies = {}
+        for name, part in self.parts.items():
+            dependencies[name] = set(
+                producers[input_name] for input_name in part.input_names or []
+                if input_name in producers and producers[input_name] != name
+            )
+
+        levels = []
+        finished = set()
+        remaining = list(self.parts.keys())
+        while len(remaining) > 0:
+            level = [name for name in remaining if dependencies[name] <= finished]
+            if len(level) == 0:
+                level = [remaining[0]]
+            levels.append(level)
+            finished.update(level)
+            remaining = [name for name in remaining if name not in finished]
+        return levels
+
+    def start(self, rate_hz=10, max_loop_count=None, overrun_policy='skip'):
         """
         Start vehicle's main drive loop.
         This is the main thread of the vehicle. It starts all the new
@@ -84,6 +180,9 @@ class Vehicle():
         max_loop_count : int
             Maxiumum number of loops the drive loop should execute. This is
             used for testing the all the parts of the vehicle work.
+        overrun_policy : string
+            What the drive loop does after a tick misses its deadline:
+            skip, catch_up or degrade. See scheduler.py
         """
 
         try:
@@ -92,9 +191,18 @@ class Vehicle():
             self.latency_threshold = (1.0 / rate_hz) * 5
 
             self.on = True
+            self.scheduler = FixedRateScheduler(
+                rate_hz=rate_hz,
+                overrun_policy=overrun_policy,
+                metrics=self.metrics
+            )
+
+            self.runtime.start(self.parts.values())
 
-            for name, part in self.parts.items():
-                part.start()
+            print('{timestamp} - Part execution order: {levels}'.format(
+                timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"),
+                levels=self.part_levels
+            ))
 
             # Wait until the parts warm up. This is needed so that parts
             # don't try to read while other parts' values prematurely.
@@ -112,8 +220,9 @@ class Vehicle():
             ))
 
             loop_count = 0
+            self.scheduler.start()
             while self.on:
-                start_time = time.time()
+                start_time = time.monotonic()
                 loop_count += 1
 
                 # Make sure all parts are responding quickly
@@ -150,14 +259,14 @@ class Vehicle():
                             timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
                         ))
                 self.part_loop()
+                self.record_frame_age()
 
                 # stop drive loop if loop_count exceeds max_loopcount
                 if max_loop_count and loop_count > max_loop_count:
                     self.on = False
 
-                sleep_time = 1.0 / rate_hz - (time.time() - start_time)
-                if sleep_time > 0.0:
-                    time.sleep(sleep_time)
+                self.metrics.record('loop_seconds', time.monotonic() - start_time)
+                self.scheduler.wait_for_next_tick()
 
         except KeyboardInterrupt:
             pass
@@ -172,6 +281,7 @@ class Vehicle():
     # car with no actual brake, so I accomplish the
     # same thing by just telling the engine to stop
     def apply_system_brake(self):
+        self.metrics.increment('brake_events')
         self.mem.put(['vehicle/brake'], True)
         engine = self.parts['engine']
         engine_inputs = self.mem.get(engine.input_names)
@@ -181,19 +291,43 @@ class Vehicle():
         ))
 
     def part_loop(self):
-        for name, part in self.parts.items():
-            if part.input_names is not None:
-                inputs = self.mem.get(part.input_names)
-                outputs = part.call(inputs)
-            else:
-                outputs = part.call()
-            if part.is_safe():
-                if outputs is not None:
-                    # Save the output(s) to memory
-                    self.mem.put(part.output_names, outputs)
-            else:
-                part.print_latency_warning()
-                self.apply_system_brake()
+        for level in self.part_levels:
+            for name in level:
+                self.run_part(self.parts[name])
+
+    def record_frame_age(self):
+        """
+        The video client keeps returning its last frame when the
+        camera stalls, so memory's change timestamp tells me how
+        old the frame the parts just consumed really is
+        """
+        frame_age_seconds = self.mem.get_age_seconds(self.camera_key)
+        if frame_age_seconds is None:
+            return
+        self.metrics.record('camera_frame_age_seconds', frame_age_seconds)
+        if frame_age_seconds > self.latency_threshold:
+            self.metrics.increment('stale_camera_frames')
+
+    def run_part(self, part):
+        if self.scheduler.is_degraded and not part.is_critical:
+            # The loop is behind schedule, so drop optional work
+            part.metrics.increment('degraded_skips')
+            return
+        start_time = time.monotonic()
+        if part.input_names is not None:
+            # All of a part's inputs come from the same memory version
+            _, inputs = self.mem.snapshot(part.input_names)
+            outputs = part.call(inputs)
+        else:
+            outputs = part.call()
+        part.metrics.record('call_seconds', time.monotonic() - start_time)
+        if part.is_safe():
+            if outputs is not None:
+                # Save the output(s) to memory
+                self.mem.put(part.output_names, outputs)
+        else:
+            part.print_latency_warning()
+            self.apply_system_brake()
 
     def stop(self):
         print('{timestamp} - Shutting down vehicle and its parts...'.format(
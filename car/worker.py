@@ -0,0 +1,288 @@
+import atexit
+from datetime import datetime
+import multiprocessing
+import queue
+import time
+import traceback
+from car.frame import Frame, SharedFrameRing
+from car.metrics import Metrics
+from car.Part import Part
+
+
+"""
+Runs a CPU-heavy part client, like the video client that decodes
+every JPEG, in a worker process of its own so that its work isn't
+serialized with the drive loop and every other part's thread by
+the GIL. The drive loop talks to a ProcessPart, which looks like
+any other part, while the real part runs in the worker:
+
+    drive loop --inputs--> input queue ---------> worker's part.call()
+    drive loop <-frames--- SharedFrameRing <----- worker's frames
+    drive loop <-outputs-- output queue <-------- worker's other outputs
+
+Both queues only ever hold the latest message, so a slow reader
+or writer drops stale messages instead of building a backlog
+"""
+
+
+class SharedFrameRef:
+    """
+    Stands in for a Frame in the outputs sent over the output
+    queue. The frame itself travels through the SharedFrameRing
+    """
+
+    def __init__(self, frame_id):
+        self.frame_id = frame_id
+
+
+class WorkerMetrics(Metrics):
+    """
+    The parent's metrics, like the drive loop's call_seconds, plus
+    the most recent summary of the metrics the part recorded in
+    the worker process
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.worker_summary = {}
+
+    def summarize(self):
+        summary = super().summarize()
+        summary['worker'] = self.worker_summary
+        return summary
+
+
+def put_latest(latest_queue, message):
+    """
+    Puts a message on a queue of size one, replacing whatever
+    message is still waiting. Never blocks
+
+    Parameters
+    ----------
+    latest_queue : multiprocessing.Queue
+        A queue created with maxsize=1
+    message : object
+        Any picklable object
+    """
+    try:
+        latest_queue.put_nowait(message)
+    except queue.Full:
+        try:
+            latest_queue.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            latest_queue.put_nowait(message)
+        except queue.Full:
+            # The other side beat me to it, which is just as good
+            pass
+
+
+def run_worker(part_class, part_kwargs, frame_ring, input_queue, output_queue, poll_seconds, metrics_seconds):
+    """
+    The worker process' main function. Creates the real part,
+    starts its thread and shuttles inputs and outputs between it
+    and the ProcessPart in the control loop's process
+
+    Parameters
+    ----------
+    part_class : class
+        The part's client class, like car.parts.video.client.Client
+    part_kwargs : dict
+        Keyword arguments for the part's constructor
+    frame_ring : SharedFrameRing
+        Where Frame outputs are written
+    input_queue : multiprocessing.Queue
+        Receives the drive loop's inputs for parts that have any
+    output_queue : multiprocessing.Queue
+        Sends (outputs, last_update_time, metrics summary) tuples
+    poll_seconds : float
+        How long to wait for new inputs before checking the part
+        for new outputs
+    metrics_seconds : float
+        How often to send the part's metrics summary
+    """
+    part = part_class(**part_kwargs)
+    part.start()
+    last_update_time = None
+    last_frame = None
+    last_metrics_time = 0.0
+    while True:
+        try:
+            inputs = input_queue.get(timeout=poll_seconds)
+            part.call(inputs)
+        except queue.Empty:
+            pass
+        if part.last_update_time == last_update_time:
+            continue
+        last_update_time = part.last_update_time
+        # Parts without inputs, like the camera, return their outputs from call()
+        if part.input_names is None:
+            outputs = part.call()
+        else:
+            outputs = part.outputs
+        try:
+            if isinstance(outputs, tuple):
+                shared_outputs = []
+                for output in outputs:
+                    if isinstance(output, Frame):
+                        last_frame = write_frame(frame_ring, output, last_frame)
+                        output = SharedFrameRef(output.frame_id)
+                    shared_outputs.append(output)
+                outputs = tuple(shared_outputs)
+            elif isinstance(outputs, Frame):
+                last_frame = write_frame(frame_ring, outputs, last_frame)
+                outputs = SharedFrameRef(outputs.frame_id)
+        except:
+            if part.is_verbose:
+                traceback.print_exc()
+            continue
+        summary = None
+        if time.monotonic() - last_metrics_time >= metrics_seconds:
+            summary = part.metrics.summarize()
+            last_metrics_time = time.monotonic()
+        put_latest(output_queue, (outputs, last_update_time, summary))
+
+
+def write_frame(frame_ring, frame, last_frame):
+    # A part returns the same frame until it has a new one
+    if frame is not last_frame:
+        frame_ring.write(frame)
+    return frame
+
+
+class ProcessPart(Part):
+
+    def __init__(self, part_class, part_kwargs, max_image_bytes=640 * 480 * 3, max_jpeg_bytes=512 * 1024,
+                 frame_slots=4, poll_seconds=0.005, metrics_seconds=1.0):
+        """
+        Hosts a part client in a worker process. The drive loop
+        uses this object exactly like the part itself
+
+        Parameters
+        ----------
+        part_class : class
+            The part's client class, like car.parts.video.client.Client
+        part_kwargs : dict
+            Keyword arguments for the part's constructor, which
+            runs in the worker. Must include name, and input_names
+            and output_names if the part has them
+        max_image_bytes : int
+            The largest decoded frame the part can output
+        max_jpeg_bytes : int
+            The largest JPEG the part can output
+        frame_slots : int
+            Number of frames in the shared-memory ring
+        poll_seconds : float
+            How often the worker checks its part for new outputs
+            while it isn't receiving inputs
+        metrics_seconds : float
+            How often the worker sends its part's metrics, which
+            are served on the vehicle's /metrics under "worker"
+        """
+        super().__init__(
+            name=part_kwargs['name'],
+            port=None,
+            url='/',
+            input_names=part_kwargs.get('input_names'),
+            output_names=part_kwargs.get('output_names'),
+            is_verbose=part_kwargs.get('is_verbose', False)
+        )
+        self.part_class = part_class
+        self.metrics = WorkerMetrics()
+        self.outputs = None
+        self.last_frame = None
+        """
+        The worker is forked rather than spawned. Spawning would
+        re-run start.py, which creates the car at import time,
+        and fork is the default on the Pi's Linux anyway
+        """
+        context = multiprocessing.get_context('fork')
+        self.frame_ring = SharedFrameRing(
+            max_image_bytes=max_image_bytes,
+            max_jpeg_bytes=max_jpeg_bytes,
+            slot_count=frame_slots,
+            context=context
+        )
+        atexit.register(self.frame_ring.close)
+        self.input_queue = context.Queue(maxsize=1)
+        self.output_queue = context.Queue(maxsize=1)
+        self.process = context.Process(
+            target=run_worker,
+            args=(part_class, part_kwargs, self.frame_ring, self.input_queue, self.output_queue,
+                  poll_seconds, metrics_seconds)
+        )
+        self.process.daemon = True
+
+    def start(self):
+        """
+        Starts the worker process and the thread that receives its
+        outputs
+        """
+        print('{timestamp} - Starting {part} in a worker process'.format(
+            timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"),
+            part=self.name
+        ))
+        self.process.start()
+        self.thread.start()
+
+    def infinite_loop(self):
+        """
+        Unlike other parts, this thread doesn't call a server. It
+        only receives the worker's outputs. last_update_time comes
+        from the part in the worker, so if the worker hangs or
+        dies, the part stops being responsive and the car brakes
+        """
+        while True:
+            outputs, last_update_time, summary = self.output_queue.get()
+            self.outputs = outputs
+            self.last_update_time = last_update_time
+            if summary is not None:
+                self.metrics.worker_summary = summary
+
+    async def infinite_loop_async(self, session):
+        # The worker does the part's I/O, so there is nothing for the event loop to do
+        self.start()
+
+    def _call(self, *args):
+        if self.input_names is not None:
+            self.inputs = dict(zip(self.input_names, *args))
+            # Pickling happens on the queue's feeder thread, not here
+            put_latest(self.input_queue, args[0])
+        return self.resolve(self.outputs)
+
+    def resolve(self, outputs):
+        """
+        Replaces SharedFrameRefs with frames read from the ring
+        """
+        if isinstance(outputs, tuple):
+            return tuple(self.resolve(output) for output in outputs)
+        if isinstance(outputs, SharedFrameRef):
+            return self.read_frame()
+        return outputs
+
+    def read_frame(self):
+        """
+        Returns the same Frame object until the worker writes a new
+        frame, so that Memory doesn't count a repeat as a change
+
+        Returns
+        ----------
+        frame : Frame
+            The newest frame
+        """
+        frame_id = self.frame_ring.get_latest_frame_id()
+        if frame_id is None:
+            return None
+        if self.last_frame is None or self.last_frame.frame_id != frame_id:
+            self.last_frame = self.frame_ring.read_latest()
+        return self.last_frame
+
+    def is_safe(self):
+        """
+        Runs the part's own safety check against the inputs and
+        last update time held here. This works because parts'
+        is_safe() only look at those, like the model's check of
+        the driver type
+        """
+        return self.part_class.is_safe(self)
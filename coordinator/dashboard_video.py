@@ -0,0 +1,192 @@
+import cv2
+from threading import Lock
+import time
+import tornado.locks
+
+
+"""
+Pushes the car's video to every dashboard viewer. The scheduler's
+video thread hands each frame from the Pi to DashboardVideo once,
+and every viewer's WebSocket (DashboardVideoSocket in editor.py)
+sends that same frame. A viewer only ever has one frame in flight.
+It sends the newest frame only after the browser has acknowledged
+the previous one, so a slow viewer skips stale frames instead of
+falling further and further behind, and never slows down the other
+viewers.
+
+Each viewer also gets its own JPEG quality. The Pi's original JPEG
+is forwarded untouched, without re-encoding, as long as a viewer
+keeps up. A viewer whose frames take longer to deliver than the
+time between frames steps down to a lower quality. Each quality is
+encoded at most once per frame, and only if some viewer uses it.
+"""
+
+# None is the Pi's original JPEG. Lower numbers are cv2 JPEG qualities
+QUALITY_LEVELS = [None, 80, 60, 40, 25]
+
+
+class AdaptiveQuality:
+    """
+    Picks a viewer's JPEG quality from how long its frames take to
+    deliver, which includes the network and the browser's decode
+    """
+
+    def __init__(self, levels=QUALITY_LEVELS, smoothing=0.3, step_down_ratio=1.0, step_up_ratio=0.5,
+                 hold_seconds=2.0):
+        """
+        Parameters
+        ----------
+        levels : list
+            Qualities from best to worst
+        smoothing : float
+            Weight of the newest delivery time in the moving average
+        step_down_ratio : float
+            Step down when the average delivery time exceeds this
+            fraction of the time between frames
+        step_up_ratio : float
+            Step up when the average delivery time is below this
+            fraction of the time between frames
+        hold_seconds : float
+            Minimum time between quality changes, so one slow frame
+            doesn't make the quality bounce
+        """
+        self.levels = levels
+        self.smoothing = smoothing
+        self.step_down_ratio = step_down_ratio
+        self.step_up_ratio = step_up_ratio
+        self.hold_seconds = hold_seconds
+        self.index = 0
+        self.delivery_seconds = None
+        self.last_change_time = time.monotonic()
+
+    @property
+    def quality(self):
+        return self.levels[self.index]
+
+    def update(self, delivery_seconds, frame_interval_seconds):
+        """
+        Parameters
+        ----------
+        delivery_seconds : float
+            How long the newest frame took from send to ack
+        frame_interval_seconds : float
+            The average time between frames from the Pi
+        """
+        if self.delivery_seconds is None:
+            self.delivery_seconds = delivery_seconds
+        else:
+            self.delivery_seconds += self.smoothing * (delivery_seconds - self.delivery_seconds)
+        if frame_interval_seconds is None:
+            return
+        now = time.monotonic()
+        if now - self.last_change_time < self.hold_seconds:
+            return
+        if self.delivery_seconds > self.step_down_ratio * frame_interval_seconds:
+            if self.index < len(self.levels) - 1:
+                self.index += 1
+                self.last_change_time = now
+        elif self.delivery_seconds < self.step_up_ratio * frame_interval_seconds:
+            if self.index > 0:
+                self.index -= 1
+                self.last_change_time = now
+
+
+class DashboardVideo:
+
+    def __init__(self, smoothing=0.1):
+        """
+        Parameters
+        ----------
+        smoothing : float
+            Weight of the newest gap between frames in the moving
+            average of the frame interval
+        """
+        # Set by the scheduler once its event loop is running
+        self.loop = None
+        # Maps each quality in use to the newest frame's JPEG at that quality
+        self.jpegs = None
+        self.sequence_number = 0
+        self.condition = tornado.locks.Condition()
+        self.smoothing = smoothing
+        self.frame_interval_seconds = None
+        self.last_publish_time = None
+        # Viewers are added on the event loop and read from the video thread
+        self.lock = Lock()
+        self.viewer_qualities = {}
+
+    def add_viewer(self, viewer):
+        """
+        Returns
+        ----------
+        quality : AdaptiveQuality
+            The viewer's quality controller
+        """
+        quality = AdaptiveQuality()
+        with self.lock:
+            self.viewer_qualities[viewer] = quality
+        return quality
+
+    def remove_viewer(self, viewer):
+        with self.lock:
+            self.viewer_qualities.pop(viewer, None)
+
+    def get_viewer_count(self):
+        with self.lock:
+            return len(self.viewer_qualities)
+
+    def publish_from_thread(self, jpeg, image):
+        """
+        Called by the scheduler's video thread for every frame
+
+        Parameters
+        ----------
+        jpeg : bytes
+            The frame exactly as the Pi sent it
+        image : np.ndarray
+            The decoded frame, used to encode lower qualities
+        """
+        if self.loop is None:
+            return
+        with self.lock:
+            qualities = set(quality.quality for quality in self.viewer_qualities.values())
+        if len(qualities) == 0:
+            return
+        jpegs = {None: bytes(jpeg)}
+        for quality in qualities:
+            if quality is not None:
+                jpegs[quality] = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+        self.loop.call_soon_threadsafe(self.publish, jpegs)
+
+    def publish(self, jpegs):
+        # Runs on the event loop
+        now = time.monotonic()
+        if self.last_publish_time is not None:
+            interval_seconds = now - self.last_publish_time
+            if self.frame_interval_seconds is None:
+                self.frame_interval_seconds = interval_seconds
+            else:
+                self.frame_interval_seconds += self.smoothing * (interval_seconds - self.frame_interval_seconds)
+        self.last_publish_time = now
+        self.jpegs = jpegs
+        self.sequence_number += 1
+        self.condition.notify_all()
+
+    async def wait_for_frame(self, seen_sequence_number):
+        """
+        Parameters
+        ----------
+        seen_sequence_number : int
+            The sequence number of the last frame the viewer got, or
+            0 if it hasn't gotten any
+
+        Returns
+        ----------
+        jpegs : dict
+            The newest frame's JPEG by quality. None is the original
+        sequence_number : int
+            The newest frame's sequence number. Any gap from the
+            seen sequence number is frames the viewer skipped
+        """
+        while self.sequence_number <= seen_sequence_number:
+            await self.condition.wait()
+        return self.jpegs, self.sequence_number
@@ -110,14 +110,51 @@ function showLiveVideo(args){
     removeVideoSafely();
     const videoImageContainer = document.querySelector('div#video-image-container');
     const videoImage = new Image();
-    const videoUrl = '/video?host='+host+'&port='+port;
-    videoImage.src = videoUrl;
     videoImage.setAttribute("id","drive-mpeg-image");
     videoImageContainer.appendChild(videoImage);
+    if (!('WebSocket' in window)){
+        const videoUrl = '/video?host='+host+'&port='+port;
+        videoImage.src = videoUrl;
+        return videoImage
+    }
+    /*
+    editor.py pushes each frame as one binary message and
+    waits for my ack before it sends the next one, so frames
+    that arrive while I'm still drawing are skipped on the
+    server instead of piling up here
+    */
+    const protocol = (window.location.protocol == 'https:') ? 'wss://' : 'ws://';
+    const socket = new WebSocket(protocol + window.location.host + '/video-ws');
+    socket.binaryType = 'blob';
+    let frameUrl = null;
+    socket.onmessage = function(event){
+        const previousFrameUrl = frameUrl;
+        frameUrl = URL.createObjectURL(event.data);
+        videoImage.src = frameUrl;
+        if (previousFrameUrl != null){
+            URL.revokeObjectURL(previousFrameUrl);
+        }
+    }
+    // A frame that fails to draw still needs an ack or the video stalls
+    const sendAck = function(){
+        if (socket.readyState == WebSocket.OPEN){
+            socket.send('ack');
+        }
+    }
+    videoImage.addEventListener('load', sendAck);
+    videoImage.addEventListener('error', sendAck);
+    videoSocket = socket;
     return videoImage
 }
 
+// The live video's WebSocket, if one is open
+let videoSocket = null;
+
 function removeVideoSafely(){
+    if (videoSocket != null){
+        videoSocket.close();
+        videoSocket = null;
+    }
     if (document.contains(document.getElementById("drive-mpeg-image"))) {
         document.querySelector("#drive-mpeg-image").remove();
     }
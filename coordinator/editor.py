@@ -3,7 +3,8 @@ from aiohttp import ClientSession, ClientTimeout
 from tornado import gen
 import argparse
 import cv2
-from datetime import datetime
+from datetime import datetime, timedelta
+import socket
 import time
 import urllib.request
 from ai.record_reader import RecordReader
@@ -13,6 +14,9 @@ import numpy as np
 from psycopg2 import pool
 import tornado.gen
 import tornado.ioloop
+import tornado.iostream
+import tornado.locks
+import tornado.util
 import tornado.web
 import tornado.websocket
 import tornado.httpserver
@@ -29,7 +33,9 @@ from shutil import rmtree
 import traceback
 from concurrent.futures import ThreadPoolExecutor
 from ai.transformations import pseduo_crop, show_resize_effect
+from ai.tensor_payload import CONTENT_TYPE as TENSOR_CONTENT_TYPE, encode_tensor_payload
 from coordinator.scheduler import Scheduler
+from car.parts.video.mjpeg import make_part_header
 
 
 class Home(tornado.web.RequestHandler):
@@ -179,6 +185,21 @@ class Memory(tornado.web.RequestHandler):
         self.write(result)
 
 
+class RemoteModelLatency(tornado.web.RequestHandler):
+    """
+    Per-stage latency of the laptop driving path: JPEG decode and
+    re-encode, network, and the model server's own queue, decode,
+    preprocess and inference times. Video transport from the Pi
+    isn't included, since it would compare the Pi's clock to the
+    laptop's.
+    The engine part server's /metrics has the other end, the age
+    of each frame when the engine acted on its prediction
+    """
+
+    def get(self):
+        self.write(self.application.scheduler.remote_model_metrics.summarize())
+
+
 class ReadSlider(tornado.web.RequestHandler):
     executor = ThreadPoolExecutor(5)
 
@@ -702,9 +723,10 @@ class LaptopModelAPIHealth(tornado.web.RequestHandler):
     def get_health(self):
         try:
             timeout_seconds = 1
-            request = requests.get('http://localhost:8886/health',timeout=timeout_seconds)
+            # Not healthy until the model has warmed up, or the first reviews would be slow
+            request = requests.get('http://localhost:8886/ready',timeout=timeout_seconds)
             response = json.loads(request.text)
-            return {'is_healthy': response['is_healthy']}
+            return {'is_healthy': response['is_ready']}
         except:
             return {'is_healthy': False}
 
@@ -798,12 +820,30 @@ class AIAngleAPI(tornado.web.RequestHandler):
             record_id=record_id
         )
 
-        img = cv2.imencode('.jpg', frame)[1].tostring()
-        files = {'image': img}
+        """
+        I send the frame's raw pixels rather than a JPEG. That saves
+        an encode here and a decode on the model server, and the
+        model sees the recorded PNG's exact pixels, like it did in
+        training, instead of a lossy JPEG copy
+        """
+        """
+        Reviews can compare other models, or other epochs of the
+        same model, against the default one. The model server loads
+        the one named here if it hasn't already
+        """
+        fields = {}
+        if json_input.get('model_id') is not None and json_input.get('epoch') is not None:
+            fields['model_id'] = int(json_input['model_id'])
+            fields['epoch'] = int(json_input['epoch'])
+        body = encode_tensor_payload(frame, **fields)
         # TODO: Remove hard-coded model API
-        request = requests.post('http://localhost:8886/predict', files=files)
+        request = requests.post(
+            'http://localhost:8886/predict-tensor',
+            data=body,
+            headers={'Content-Type': TENSOR_CONTENT_TYPE}
+        )
         response = json.loads(request.text)
-        prediction = response['prediction']
+        prediction = response['predictions'][0]
         predicted_angle = prediction
         result = {
             'angle': predicted_angle
@@ -1327,54 +1367,94 @@ class ImageAPI(tornado.web.RequestHandler):
 
 class VideoAPI(tornado.web.RequestHandler):
     '''
-    Serves a MJPEG of the images posted from the vehicle.
+    Serves a MJPEG of the images posted from the vehicle. The
+    dashboard uses DashboardVideoSocket instead, but this still
+    works for anything that can only show an <img>.
     '''
 
-    @tornado.gen.coroutine
-    def get(self):
-
-        ioloop = tornado.ioloop.IOLoop.current()
+    async def get(self):
+        """
+        Sends every new frame exactly as the Pi sent it, so nothing
+        is re-encoded per viewer, and waits for the next frame
+        instead of polling for it
+        """
         self.set_header("Content-type", "multipart/x-mixed-replace;boundary=--boundarydonotcross")
+        dashboard_video = self.application.scheduler.dashboard_video
+        # MJPEG has no acks to adapt to, so this viewer always gets the original
+        dashboard_video.add_viewer(self)
+        try:
+            sequence_number = 0
+            while True:
+                jpegs, sequence_number = await dashboard_video.wait_for_frame(sequence_number)
+                img = jpegs[None]
+                self.write(make_part_header(len(img)))
+                self.write(img)
+                self.write(b'\r\n')
+                await self.flush()
+        except tornado.iostream.StreamClosedError:
+            pass
+        finally:
+            dashboard_video.remove_viewer(self)
 
-        self.served_image_timestamp = time.time()
-        my_boundary = "--boundarydonotcross"
 
-        while True:
-
-            interval = .1
-            if self.served_image_timestamp + interval < time.time():
-
-                """
-                Sometimes when the Pi is under heavy load (e.g., when you deploy
-                the Tensorlfow model service), the video part has timeouts, which
-                leads to images that are None, and this leads to OpenCV empty jpeg
-                errors like this:
-                    (-10:Unknown error code -10) Raw image encoder error: Empty JPEG image
-                The best fix is to make the services perform better under load, but
-                it's nice to address the symptom too by asking OpenCV to skip
-                encoding of empty images
-                """
-                if self.application.scheduler.raw_dash_frame is None:
-                    continue
-
-                # Can't serve the OpenCV numpy array
-                # Tornando: "... only accepts bytes, unicode, and dict objects" (from Tornado error Traceback)
-                # The result of cv2.imencode is a tuple like: (True, some_image), but I have no idea what True refers to
-                img = cv2.imencode('.jpg', self.application.scheduler.raw_dash_frame)[1].tostring()
-
-                # I have no idea what these lines do, but other people seem to use them, they
-                # came with this copied code and I don't want to break something by removing
-                self.write(my_boundary)
-                self.write("Content-type: image/jpeg\r\n")
-                self.write("Content-length: %s\r\n\r\n" % len(img))
-
-                # Serve the image
-                self.write(img)
+class DashboardVideoSocket(tornado.websocket.WebSocketHandler):
+    '''
+    Pushes each new frame to the dashboard as one binary message.
+    The browser acknowledges every frame once it has drawn it, and
+    I only send the next frame after the ack, so a slow viewer
+    skips frames instead of queueing them. See dashboard_video.py
+    '''
 
-                self.served_image_timestamp = time.time()
-                yield tornado.gen.Task(self.flush)
-            else:
-                yield tornado.gen.Task(ioloop.add_timeout, ioloop.time() + interval)
+    # A viewer that never acks still gets a frame this often
+    ack_timeout_seconds = 1.0
+
+    # Lets the kernel queue about two frames, so a slow network shows up as slow acks
+    send_buffer_bytes = 64 * 1024
+
+    def open(self):
+        stream_socket = self.ws_connection.stream.socket
+        stream_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_bytes)
+        self.is_open = True
+        self.ack = tornado.locks.Event()
+        self.dashboard_video = self.application.scheduler.dashboard_video
+        self.quality = self.dashboard_video.add_viewer(self)
+        self.skipped_frame_count = 0
+        tornado.ioloop.IOLoop.current().spawn_callback(self.push_frames)
+
+    async def push_frames(self):
+        sequence_number = 0
+        while self.is_open:
+            jpegs, new_sequence_number = await self.dashboard_video.wait_for_frame(sequence_number)
+            if sequence_number > 0:
+                self.skipped_frame_count += new_sequence_number - sequence_number - 1
+            sequence_number = new_sequence_number
+            if not self.is_open:
+                break
+            # A quality this viewer just switched to won't be encoded until the next frame
+            jpeg = jpegs.get(self.quality.quality, jpegs[None])
+            self.ack.clear()
+            start_time = time.monotonic()
+            try:
+                await self.write_message(jpeg, binary=True)
+                await self.ack.wait(timeout=timedelta(seconds=self.ack_timeout_seconds))
+            except tornado.websocket.WebSocketClosedError:
+                break
+            except tornado.util.TimeoutError:
+                pass
+            self.quality.update(
+                delivery_seconds=time.monotonic() - start_time,
+                frame_interval_seconds=self.dashboard_video.frame_interval_seconds
+            )
+
+    def on_message(self, message):
+        # The browser's ack for the last frame
+        self.ack.set()
+
+    def on_close(self):
+        self.is_open = False
+        self.dashboard_video.remove_viewer(self)
+        # Wakes push_frames() if it's waiting for an ack
+        self.ack.set()
 
 
 class PS3ControllerSixAxisStart(tornado.web.RequestHandler):
@@ -2245,6 +2325,7 @@ def make_app():
         (r"/user-labels", UserLabelsAPI),
         (r"/image", ImageAPI),
         (r"/video", VideoAPI),
+        (r"/video-ws", DashboardVideoSocket),
         (r"/new-dataset-name", NewDatasetName),
         (r"/dataset-record-ids",DatasetRecordIdsAPI),
         (r"/dataset-record-ids-filesystem", DatasetRecordIdsAPIFileSystem),
@@ -2291,6 +2372,7 @@ def make_app():
         (r"/highest-model-epoch", HighestModelEpoch),
         (r"/start-car-service", StartCarService),
         (r"/vehicle-memory", Memory),
+        (r"/remote-model-latency", RemoteModelLatency),
         (r"/pi-service-status", PiServiceStatus),
         (r"/stop-service", StopService),
         (r"/initialize-ps3-setup", InitiaizePS3Setup),
@@ -1,8 +1,11 @@
 from aiohttp import ClientSession, ClientTimeout
 import concurrent
 import datetime
+import time
 import traceback
 
+from car.metrics import Metrics
+from coordinator.dashboard_video import DashboardVideo
 from coordinator.utilities import *
 
 
@@ -88,6 +91,21 @@ class Scheduler(object):
         self.raw_dash_frame = None
         self.is_video_cache_loop_running = False
 
+        """
+        The id and capture time of raw_dash_frame as a single
+        (frame_id, frame_timestamp) tuple, so that the remote model
+        loop never pairs a frame with another frame's id. They pass
+        through the laptop model and the user_input part to the
+        engine, which records the frame's age when it acts on it
+        """
+        self.raw_dash_frame_trace = None
+
+        # Per-stage latency of the remote (laptop) model path, served on /remote-model-latency
+        self.remote_model_metrics = Metrics()
+
+        # Pushes raw_dash_frame's JPEG to the dashboard's viewers
+        self.dashboard_video = DashboardVideo()
+
         # Local cache of all Postgres toggles
         self.toggles = None
 
@@ -212,34 +230,60 @@ class Scheduler(object):
         the Pi
         """
         try:
-            img = cv2.imencode('.jpg', self.raw_dash_frame)[1].tostring()
+            frame_id, frame_timestamp = self.raw_dash_frame_trace
+            start_time = time.monotonic()
+            img = cv2.imencode('.jpg', self.raw_dash_frame)[1].tobytes()
+            self.remote_model_metrics.record('encode_seconds', time.monotonic() - start_time)
             port = self.get_services()['angle-model-laptop']['port']
             host = 'localhost'
             endpoint = f'http://{host}:{port}/predict'
-            files = {'image': img}
+            files = {
+                'image': img,
+                'frame_id': str(frame_id),
+                'frame_timestamp': repr(frame_timestamp),
+                # Puts this ahead of the dataset reviewer's bulk scoring (see ai/batching.py)
+                'lane': 'driving'
+            }
             timeout = ClientTimeout(total=self.timeout_seconds)
+            start_time = time.monotonic()
             async with ClientSession(timeout=timeout) as session:
                 async with session.post(endpoint, data=files) as response:
                     output_json = await response.json()
-                    return output_json['prediction']
+            round_trip_seconds = time.monotonic() - start_time
+            timings = output_json.get('timings', {})
+            for name, seconds in timings.items():
+                self.remote_model_metrics.record('server_' + name, seconds)
+            self.remote_model_metrics.record(
+                'network_seconds',
+                max(0.0, round_trip_seconds - sum(timings.values()))
+            )
+            return output_json['prediction'], frame_id, frame_timestamp
         except:
             if is_verbose:
                 traceback.print_exc()
 
-    async def call_user_input_remote_model_api(self, model_angle):
+    async def call_user_input_remote_model_api(self, model_angle, frame_id=None, frame_timestamp=None):
         """
         Populates the remote_model field of the user_input API
 
         Parameters
         ----------
-        json_input : dict
-            Dictionary of the data to pass the API
+        model_angle : float
+            The laptop model's predicted angle
+        frame_id : int
+            The id of the frame the angle was predicted from
+        frame_timestamp : float
+            The time.time() when the video server received the frame
         """
         timeout = ClientTimeout(total=self.timeout_seconds)
         port = self.get_services()['user-input']['port']
         host = self.service_host
         endpoint = f'http://{host}:{port}/track-remote-model'
-        json_input = {'remote_model/angle': model_angle}
+        json_input = {
+            'remote_model/angle': model_angle,
+            'remote_model/frame_id': frame_id,
+            'remote_model/frame_timestamp': frame_timestamp
+        }
         try:
             async with ClientSession(timeout=timeout) as session:
                 async with session.post(endpoint, json=json_input) as response:
@@ -258,9 +302,14 @@ class Scheduler(object):
         """
         while True:
             if self.raw_dash_frame is not None:
-                model_angle = await self.call_model_api()
-                if model_angle is not None:
-                    await self.call_user_input_remote_model_api(model_angle=model_angle)
+                prediction = await self.call_model_api()
+                if prediction is not None:
+                    model_angle, frame_id, frame_timestamp = prediction
+                    await self.call_user_input_remote_model_api(
+                        model_angle=model_angle,
+                        frame_id=frame_id,
+                        frame_timestamp=frame_timestamp
+                    )
 
             """
             From trial an error I learned that if you don't include some sort
@@ -443,45 +492,32 @@ class Scheduler(object):
             await asyncio.sleep(self.interval_seconds * 5)
 
     # This is used to stream video live for the self-driving sessions
-    # The syntax is super ugly and I don't understand how it works
-    # This is where I got this code from here, which comes with an explanation:
-    # https://stackoverflow.com/questions/21702477/how-to-parse-mjpeg-http-stream-from-ip-camera
     def get_video(self, ip, port):
         stream = urllib.request.urlopen('http://{ip}:{port}/video'.format(ip=ip, port=port))
-        opencv_bytes = bytes()
-        """
-        When the video is streaming well, about 1 of every 15
-        iterations of this loop produces an image. When the
-        video is killed and there is nothing to show, the else
-        part of the loop gets called consecutively indefinitely.
-        I can avoid the zombie threads that take over my entire
-        Tornado server (99% of CPU) if I check a consecutive
-        failure count exceeding some arbitrarily high threshold
-        """
-        count_threshold = 50
-        consecutive_no_image_count = 0
-        was_available = False
-        while self.is_video_cache_loop_running:
-            opencv_bytes += stream.read(1024)
-            a = opencv_bytes.find(b'\xff\xd8')
-            b = opencv_bytes.find(b'\xff\xd9')
-            if a != -1 and b != -1:
-                jpg = opencv_bytes[a:b + 2]
-                opencv_bytes = opencv_bytes[b + 2:]
-                frame = cv2.imdecode(np.fromstring(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
-                if cv2.waitKey(1) == 27:
-                    exit(0)
-                consecutive_no_image_count = 0
-                was_available = True
-                self.raw_dash_frame = frame
-            else:
-                if was_available:
-                    consecutive_no_image_count = 1
-                else:
-                    consecutive_no_image_count += 1
-                if consecutive_no_image_count > count_threshold:
-                    self.is_video_cache_loop_running = False
-                was_available = False
+        demuxer = MjpegDemuxer(stream)
+        frame_count = 0
+        for jpg in demuxer:
+            if not self.is_video_cache_loop_running:
+                break
+            frame_count += 1
+            # The video server stamps each frame. Fall back to my own count and clock if it didn't
+            frame_id = int(demuxer.headers.get(b'x-frame-id', frame_count))
+            frame_timestamp = float(demuxer.headers.get(b'x-timestamp', time.time()))
+            """
+            I don't measure video transport here. The timestamp comes
+            from the Pi's clock, so subtracting it from mine would
+            mostly measure how far apart the two clocks are
+            """
+            start_time = time.monotonic()
+            frame = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            self.remote_model_metrics.record('decode_seconds', time.monotonic() - start_time)
+            if cv2.waitKey(1) == 27:
+                exit(0)
+            self.raw_dash_frame_trace = (frame_id, frame_timestamp)
+            self.raw_dash_frame = frame
+            self.dashboard_video.publish_from_thread(jpeg=jpg, image=frame)
+        # Lets the caller know that the stream needs to be reopened
+        self.is_video_cache_loop_running = False
         stream.close()
 
     async def start(self):
@@ -493,6 +529,9 @@ class Scheduler(object):
 
         self.aiopg_pool = await aiopg.create_pool(connection_string, minsize=10, maxsize=10)
 
+        # The video thread hands frames to the dashboard through this loop
+        self.dashboard_video.loop = asyncio.get_running_loop()
+
         self.is_local_test = await read_toggle_aio(
             postgres_host=self.postgres_host,
             web_page='raspberry pi',
@@ -635,14 +674,25 @@ class Scheduler(object):
             if service == 'angle-model-laptop':
                 host = 'localhost'
             endpoint = f'http://{host}:{port}/health'
+            health_field = 'is_healthy'
+            """
+            A model service is up long before its model has loaded and
+            warmed up, and until then its predictions are slow enough
+            to miss the car's timeouts. So for models I record whether
+            they're ready rather than whether they're up
+            """
+            if service.startswith('angle-model'):
+                endpoint = f'http://{host}:{port}/ready'
+                health_field = 'is_ready'
 
             start_time = datetime.utcnow()
             try:
                 timeout = ClientTimeout(total=self.timeout_seconds)
                 async with ClientSession(timeout=timeout) as session:
                     async with session.get(endpoint) as response:
+                        # /ready answers 503 until it's ready, but with the same JSON
                         health = await response.json()
-                        is_healthy = health['is_healthy']
+                        is_healthy = health[health_field]
                         end_time = datetime.utcnow()
                         sql = sql_query.format(
                             start_time=start_time,